@@ -0,0 +1,47 @@
+import pathlib
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from python_runner.python_action_wrapper import ActionService
+    from logging import Logger
+
+from st2common.content.utils import get_pack_base_path
+from st2common.runners.base_action import Action
+
+from lib.git import git
+from lib.gitdir import find_git_dir, is_dirty
+from lib.metrics import Metrics
+
+
+class CheckoutPackCommit(Action):
+
+    if TYPE_CHECKING:
+        action_service: ActionService
+        logger: Logger
+
+    def run(self, pack: str = None, commit: str = None):
+        metrics = Metrics("checkout_pack_commit")
+        pack_path = pathlib.Path(get_pack_base_path(pack))
+        git_dir = find_git_dir(pack_path)
+        if git_dir is None:
+            return False, {
+                "error_message": f"{pack_path} is not a git checkout",
+                "metrics": metrics.finish(self.config, self.logger),
+            }
+        with metrics.span("check_dirty"):
+            dirty = is_dirty(pack_path, git_dir)
+        if dirty:
+            return False, {
+                "error_message": f"{pack_path} has local changes",
+                "metrics": metrics.finish(self.config, self.logger),
+            }
+
+        self.logger.info(f"Checking out {commit} in {pack_path}")
+        with metrics.span("git_checkout"):
+            git("checkout", "--quiet", "--detach", commit, cwd=str(pack_path))
+            head = git("rev-parse", "HEAD", cwd=str(pack_path))
+        return True, {
+            "commit": head,
+            "metrics": metrics.finish(self.config, self.logger),
+        }
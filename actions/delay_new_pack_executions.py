@@ -1,13 +1,34 @@
-from typing import Dict, Tuple, TYPE_CHECKING
+import pathlib
+import time
+
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from python_runner.python_action_wrapper import ActionService
     from logging import Logger
 
-from st2client.client import Client
-from st2client.models.policy import Policy
 from st2common.runners.base_action import Action
 
+from lib.client import get_client
+from lib.concurrency import (
+    DEFAULT_PARALLELISM,
+    DEFAULT_RETRIES,
+    http_status,
+    run_parallel,
+)
+from lib.datastore import delete_key, load_json, save_json
+from lib.execution_query import DELAYED_STATUS, count_executions
+from lib.lease import PackLeases
+from lib.metrics import Metrics
+from lib.pack_resolver import PackResolver
+from lib.plan import (
+    PlanError,
+    check_plan,
+    new_plan,
+    pack_fingerprint,
+    value_fingerprint,
+)
+
 
 # Never try to delay these actions
 NEVER_MANAGE_ACTIONS = [
@@ -16,11 +37,18 @@ NEVER_MANAGE_ACTIONS = [
     # This action should run as part of st2gitops.deploy_pack
     # so, don't block other actions used by that workflow:
     "st2gitops.get_pack_commit_hash",
+    "st2gitops.get_pack_state",
+    "st2gitops.plan_pack_deploy",
+    "st2gitops.checkout_pack_commit",
+    "st2gitops.stage_pack",
     "st2gitops.manage_pack_resources",
     "st2gitops.suspend_st2_rules",
     "st2gitops.wait_or_pause_running_pack_executions",
     "st2gitops.unpause_pack_executions",
-    # We DO want a policy for st2gitops.deploy_pack
+    "st2gitops.pack_lease",
+    # st2gitops.deploy_packs runs its unload/install steps in this workflow.
+    "st2gitops.deploy_pack_lane",
+    # We DO want a policy for st2gitops.deploy_pack (and st2gitops.deploy_packs)
     # so that no new deployments start until any current runs complete.
 ]
 
@@ -28,6 +56,20 @@ NEVER_MANAGE_ACTIONS = [
 # Do not use st2gitops, or unloading will remove all the policies too.
 POLICY_PACK = "__st2gitops__"
 POLICY_PREFIX = "delay"
+POLICY_TYPE = "action.concurrency"
+POLICY_PARAMETERS = {"action": "delay", "threshold": 0}
+
+# Per-pack datastore key recording the policies created by action=delay as
+# {action_ref: policy_ref}, so that action=resume only has to delete those.
+LEDGER_KEY_PREFIX = "st2gitops_delay_policies"
+
+# how action=resume removes the policies (see release_mode)
+RELEASE_ALL = "all"
+RELEASE_RAMP = "ramp"
+# defaults for the release_* parameters
+DEFAULT_RELEASE_STEP = 5
+DEFAULT_RELEASE_INTERVAL = 10
+DEFAULT_RELEASE_TIMEOUT = 300
 
 
 class DelayNewPackExecutions(Action):
@@ -38,54 +80,173 @@ class DelayNewPackExecutions(Action):
 
     def __init__(self, config=None, action_service=None):
         super().__init__(config, action_service)
-        self.client = Client()
+        self.metrics = Metrics("delay_new_pack_executions")
+        self.client = get_client(self.config, metrics=self.metrics)
         self.check_mode = False
+        self.parallelism = DEFAULT_PARALLELISM
+        self.retries = DEFAULT_RETRIES
+        # filled in by check_mode, see lib.plan
+        self.plan = new_plan("delay_new_pack_executions")
+        self.release_mode = RELEASE_ALL
+        self.release_step = DEFAULT_RELEASE_STEP
+        self.release_interval = DEFAULT_RELEASE_INTERVAL
+        self.release_timeout = DEFAULT_RELEASE_TIMEOUT
+        # {pack_name: {action_ref: policy_ref}} to release with _ramp_release
+        self.ramp_policies: Dict[str, Dict[str, str]] = {}
+        # {pack_name: how its delayed executions were released}, see _ramp_release
+        self.releases: Dict[str, Dict[str, Any]] = {}
 
-    def run(self, from_packs: list = None, action: str = None, check_mode=False):
+    def run(
+        self,
+        from_packs: list = None,
+        action: str = None,
+        check_mode=False,
+        parallelism=DEFAULT_PARALLELISM,
+        retries=DEFAULT_RETRIES,
+        lease_owner: str = "",
+        plan: dict = None,
+        release_mode: str = RELEASE_ALL,
+        release_step: int = DEFAULT_RELEASE_STEP,
+        release_interval: float = DEFAULT_RELEASE_INTERVAL,
+        release_timeout: float = DEFAULT_RELEASE_TIMEOUT,
+    ):
         self.check_mode = check_mode
+        self.parallelism = parallelism
+        self.retries = retries
+        self.release_mode = release_mode
+        self.release_step = release_step
+        self.release_interval = release_interval
+        self.release_timeout = release_timeout
+        self.ramp_policies = {}
+        self.releases = {}
+        self.plan = new_plan("delay_new_pack_executions", action)
         results = {"success": True, "packs": {}}
 
-        if len(from_packs) == 1:
-            packs = {from_packs[0]: self.client.packs.get_by_ref_or_id(from_packs[0])}
-        else:
-            packs = {p.ref: p for p in self.client.packs.get_all()}
-
-        self.logger.debug(f"Got {len(packs)} packs")
+        planned_packs = {}
+        if plan:
+            try:
+                if check_mode:
+                    raise PlanError("A plan cannot be applied in check_mode")
+                planned_packs = check_plan(plan, "delay_new_pack_executions", action)
+            except PlanError as exc:
+                self.logger.error(f"Cannot apply the plan: {exc}")
+                results["success"] = False
+                results["error_message"] = str(exc)
+                results["metrics"] = self.metrics.finish(self.config, self.logger)
+                return results
+        from_packs = list(from_packs or planned_packs)
 
         packs_results: Dict[str, Dict[str, Tuple[bool, str]]] = {}
         # {pack_name: {action_name: (success, policy_name)}}
 
+        # Packs that another deploy holds the lease on are not delayed. Resuming
+        # is never refused: it only renews the leases the owner still holds.
+        leases = PackLeases.from_config(self.client, self.config, lease_owner)
+        with self.metrics.span("acquire_leases"):
+            if action == "resume":
+                lease_errors = {}
+            elif self.check_mode:
+                lease_errors = leases.check_all(from_packs)
+            else:
+                lease_errors = leases.acquire_all(from_packs)
+        for pack_name, error in lease_errors.items():
+            self.logger.error(f"Skipping pack {pack_name}: {error}")
+        leased_packs = [name for name in from_packs if name not in lease_errors]
+
+        # Only the planned operations of packs that did not change since the plan
+        # was made are applied. Everything else is looked up from scratch.
+        with self.metrics.span("check_plan"):
+            fresh = self._fresh_packs(planned_packs, leased_packs, action)
+        # packs that were not installed when a delay was planned are not stale, just new
+        stale_packs = [
+            name
+            for name in leased_packs
+            if name in planned_packs
+            and name not in fresh
+            and (action != "delay" or planned_packs[name].get("path"))
+        ]
+        for pack_name in stale_packs:
+            self.logger.warning(
+                f"Pack {pack_name} changed since the plan was made. Looking it up again."
+            )
+
+        resolver = PackResolver.from_config(
+            self.client, self.config, self.logger, parallelism=parallelism
+        )
+        with self.metrics.span("resolve_packs"):
+            packs = resolver.resolve(
+                [pack_name for pack_name in leased_packs if pack_name not in fresh]
+            )
+
+        self.logger.debug(
+            f"Got {sum(pack is not None for pack in packs.values())} installed packs"
+        )
+
         if self.check_mode:
             self.logger.info("check_mode enabled. Simulating policy changes...")
 
-        for pack_name in from_packs:
-            pack = packs.get(pack_name)
-            if not pack:
-                self.logger.debug(
-                    f"Pack {pack_name} not found. Nothing to delay. Continuing..."
-                )
-                continue
-            if action == "delay":
-                packs_results[pack_name] = self.delay_executions(
-                    pack_name=pack_name, pack=pack
-                )
-            elif action == "resume":
-                packs_results[pack_name] = self.resume_executions(
-                    pack_name=pack_name, pack=pack
-                )
+        renewed_packs = leased_packs
+        if action == "resume" or self.check_mode:
+            renewed_packs = leases.held(leased_packs)
+        with leases.heartbeat(renewed_packs, self.logger):
+            for pack_name in leased_packs:
+                if pack_name in fresh:
+                    with self.metrics.span("apply_plan"):
+                        packs_results[pack_name] = self.apply_planned(
+                            pack_name, fresh[pack_name], action
+                        )
+                    continue
+                pack = packs.get(pack_name)
+                if action == "delay":
+                    if not pack:
+                        self.logger.debug(
+                            f"Pack {pack_name} not found. "
+                            "Nothing to delay. Continuing..."
+                        )
+                        if self.check_mode:
+                            self._plan_pack(pack_name, None, None, [])
+                        continue
+                    with self.metrics.span("delay_executions"):
+                        packs_results[pack_name] = self.delay_executions(
+                            pack_name=pack_name, pack=pack
+                        )
+                elif action == "resume":
+                    # The pack may have been unloaded by a failed deploy, but
+                    # its policies still need to be removed.
+                    with self.metrics.span("resume_executions"):
+                        packs_results[pack_name] = self.resume_executions(
+                            pack_name=pack_name, pack=pack
+                        )
+            if self.ramp_policies:
+                with self.metrics.span("ramp_release"):
+                    packs_results.update(self._ramp_release(self.ramp_policies))
 
-        results["success"] = all(
+        results["success"] = not lease_errors and all(
             action_result[0]  # action_result = (success, policy_ref)
             for pack_results in packs_results.values()
             for action_result in pack_results.values()
         )
         results["packs"] = packs_results
+        results["lease_errors"] = lease_errors
+        if action == "resume" and self.release_mode == RELEASE_RAMP:
+            results["releases"] = self.releases
+        if self.check_mode:
+            results["plan"] = self.plan
+        if plan:
+            results["stale_packs"] = stale_packs
+        results["metrics"] = self.metrics.finish(self.config, self.logger)
         return results
 
     def delay_executions(self, pack_name, pack) -> Dict[str, Tuple[bool, str]]:
         self.logger.info(f"Delaying all executions for actions in pack: {pack_name}")
         results = {}
 
+        # policies left over from an earlier (possibly interrupted) delay are reused as-is
+        existing_policy_refs = {
+            policy.ref for policy in self.client.policies.get_all(pack=POLICY_PACK)
+        }
+
+        actions_to_delay = []
         actions = self.client.actions.get_all(pack=pack_name)
         for action in actions:
             if action.ref in NEVER_MANAGE_ACTIONS:
@@ -94,56 +255,442 @@ class DelayNewPackExecutions(Action):
                 )
                 # The action MUST not manage itself or other prohibited actions
                 continue
-            policy_instance = Policy(
-                pack=POLICY_PACK,
-                name=f"{POLICY_PREFIX}.{action.ref}",
-                enabled=True,
-                policy_type="action.concurrency",
-                parameters={
-                    "action": "delay",
-                    "threshold": 0,
-                },
-                resource_ref=action.ref,
-            )
-            if self.check_mode:
-                policy = policy_instance
-                policy.ref = f"{policy.pack}.{policy.name}"
-            else:
-                policy = self.client.policies.create(policy_instance)
-            results[action.ref] = (True, policy.ref)
+            policy_ref = self._policy_ref(action.ref)
+            if policy_ref in existing_policy_refs:
+                self.logger.debug(
+                    f"Executions for action={action.ref} are already delayed "
+                    f"by policy={policy_ref}. Leaving it alone."
+                )
+                results[action.ref] = (True, policy_ref)
+                continue
+            actions_to_delay.append(action)
+
+        if self.check_mode:
+            operations = []
+            for action in actions_to_delay:
+                policy_ref = self._policy_ref(action.ref)
+                results[action.ref] = (True, policy_ref)
+                operations.append(
+                    {
+                        "op": "create_policy",
+                        "ref": policy_ref,
+                        "action_ref": action.ref,
+                        "current": None,
+                        "desired": {
+                            "policy_type": POLICY_TYPE,
+                            "parameters": POLICY_PARAMETERS,
+                        },
+                    }
+                )
+            fingerprint = pack_fingerprint(pathlib.Path(pack.path))
+            self._plan_pack(pack_name, pack.path, fingerprint, operations)
+            return results
+
+        return self._create_delay_policies(
+            pack_name, [action.ref for action in actions_to_delay], results
+        )
+
+    def _create_delay_policies(
+        self,
+        pack_name: str,
+        action_refs: List[str],
+        results: Dict[str, Tuple[bool, str]],
+    ) -> Dict[str, Tuple[bool, str]]:
+        # Record the policies before creating them so that a resume after a
+        # crash in the middle of this loop still finds every one of them.
+        ledger = self._load_ledger(pack_name) or {}
+        ledger.update(
+            {action_ref: policy_ref for action_ref, (_, policy_ref) in results.items()}
+        )
+        ledger.update(
+            {action_ref: self._policy_ref(action_ref) for action_ref in action_refs}
+        )
+        save_json(self.client, self._ledger_key(pack_name), ledger)
+
+        outcomes = run_parallel(
+            self._create_delay_policy,
+            action_refs,
+            parallelism=self.parallelism,
+            retries=self.retries,
+        )
+        for action_ref, outcome in outcomes.items():
+            policy_ref = self._policy_ref(action_ref)
+            if not outcome.ok:
+                self.logger.error(
+                    f"Failed to delay executions for action={action_ref} "
+                    f"after {outcome.attempts} attempt(s): {outcome.error}"
+                )
+                results[action_ref] = (False, policy_ref)
+                continue
+            results[action_ref] = (True, policy_ref)
             self.logger.debug(
-                f"Delayed executions for action={action.ref} "
-                f"by creating action.concurrency policy={policy.ref} with threshold=0"
+                f"Delayed executions for action={action_ref} "
+                f"by creating {POLICY_TYPE} policy={policy_ref} with threshold=0 "
+                f"in {outcome.elapsed:.3f}s"
             )
 
         return results
 
+    @staticmethod
+    def _policy_ref(action_ref: str) -> str:
+        return f"{POLICY_PACK}.{POLICY_PREFIX}.{action_ref}"
+
+    def _create_delay_policy(self, action_ref: str) -> str:
+        from st2client.models.policy import Policy
+
+        policy_instance = Policy(
+            pack=POLICY_PACK,
+            name=f"{POLICY_PREFIX}.{action_ref}",
+            enabled=True,
+            policy_type=POLICY_TYPE,
+            parameters=dict(POLICY_PARAMETERS),
+            resource_ref=action_ref,
+        )
+        try:
+            policy = self.client.policies.create(policy_instance)
+        except Exception as exc:
+            if http_status(exc) == 409:
+                # Created concurrently or by a retried request that did reach st2api.
+                return self._policy_ref(action_ref)
+            raise
+        return policy.ref
+
     def resume_executions(self, pack_name, pack) -> Dict[str, Tuple[bool, str]]:
         self.logger.info(
             f"Resuming/Re-allowing executions for actions in pack: {pack_name}"
         )
-        results = {}
+        ledger = self._load_ledger(pack_name)
+        policies = ledger
+        if policies is None:
+            self.logger.debug(
+                f"No ledger of delay policies for pack {pack_name}. "
+                f"Searching {POLICY_PACK} for matching policies instead."
+            )
+            policies = self._find_delay_policies(pack_name)
 
-        policies = self.client.policies.get_all(pack=POLICY_PACK)
-        for policy in policies:
-            if not policy.name.startswith(f"{POLICY_PREFIX}.{pack_name}"):
-                continue
+        if self.check_mode:
+            operations = [
+                {
+                    "op": "delete_policy",
+                    "ref": policy_ref,
+                    "action_ref": action_ref,
+                    "current": {"policy_type": POLICY_TYPE},
+                    "desired": None,
+                }
+                for action_ref, policy_ref in policies.items()
+            ]
+            # the policies to delete come from the ledger, so it must not change
+            self._plan_pack(
+                pack_name,
+                getattr(pack, "path", None),
+                value_fingerprint(ledger),
+                operations,
+            )
+            return {
+                action_ref: (True, policy_ref)
+                for action_ref, policy_ref in policies.items()
+            }
 
-            if self.check_mode:
-                success = True
-            else:
-                # policy.enabled = False
-                # policy = self.client.policies.update(policy)
+        return self._release_delay_policies(pack_name, policies)
+
+    def _release_delay_policies(
+        self, pack_name: str, policies: Dict[str, str]
+    ) -> Dict[str, Tuple[bool, str]]:
+        if self.release_mode == RELEASE_RAMP and policies:
+            # released together with the other packs, once all are looked up
+            self.ramp_policies[pack_name] = policies
+            return {}
+        return self._delete_delay_policies(pack_name, policies)
+
+    def _ramp_release(
+        self, policies_by_pack: Dict[str, Dict[str, str]]
+    ) -> Dict[str, Dict[str, Tuple[bool, str]]]:
+        """Let the delayed executions of all packs through a few at a time.
+
+        Instead of deleting the policies at once, their threshold (how many
+        executions of the action may run at the same time) is raised by
+        release_step every release_interval seconds. It is only raised while the
+        number of delayed executions of the action goes down, so runners that are
+        busy with the ones already released do not get more. A policy is deleted
+        once nothing is delayed by it any more. After release_timeout the rest
+        are deleted at once. The policies of all packs share each step, so the
+        release takes at most release_timeout however many packs there are.
+
+        Each pack's release is reported in self.releases[pack_name] as
+        {delayed, drain_seconds, timed_out, actions: {action_ref:
+        {delayed, drain_seconds, threshold}}}.
+        """
+        started = time.monotonic()
+        # action refs start with their pack name, so they are unique across packs
+        pack_of = {
+            action_ref: pack_name
+            for pack_name, policies in policies_by_pack.items()
+            for action_ref in policies
+        }
+        held = {
+            action_ref: policy_ref
+            for policies in policies_by_pack.values()
+            for action_ref, policy_ref in policies.items()
+        }
+        thresholds = {action_ref: 0 for action_ref in held}
+        depths = self._delayed_depths(held)
+        last_depths = dict(depths)
+        for pack_name, policies in policies_by_pack.items():
+            self.releases[pack_name] = {
+                "delayed": sum(depths[action_ref] for action_ref in policies),
+                "drain_seconds": None,
+                "timed_out": False,
+                "actions": {
+                    action_ref: {
+                        "delayed": depths[action_ref],
+                        "drain_seconds": None,
+                        "threshold": 0,
+                    }
+                    for action_ref in policies
+                },
+            }
+        self.logger.info(
+            f"Releasing {sum(depths.values())} delayed executions of packs "
+            f"{sorted(policies_by_pack)} {self.release_step} at a time per action"
+        )
+
+        results: Dict[str, Dict[str, Tuple[bool, str]]] = {
+            pack_name: {} for pack_name in policies_by_pack
+        }
+        while True:
+            elapsed = round(time.monotonic() - started, 3)
+            drained: Dict[str, Dict[str, str]] = {}
+            for action_ref, policy_ref in held.items():
+                if depths[action_ref] == 0:
+                    pack_name = pack_of[action_ref]
+                    drained.setdefault(pack_name, {})[action_ref] = policy_ref
+                    report = self.releases[pack_name]["actions"][action_ref]
+                    report["drain_seconds"] = elapsed
+            for pack_name, policies in drained.items():
+                for action_ref in policies:
+                    del held[action_ref]
+                pack_held = self._of_pack(held, pack_of, pack_name)
+                results[pack_name].update(
+                    self._delete_delay_policies(pack_name, policies, keep=pack_held)
+                )
+                if not pack_held:
+                    self.releases[pack_name]["drain_seconds"] = elapsed
+                    self.logger.info(
+                        f"The delayed executions of pack {pack_name} "
+                        f"drained in {elapsed}s"
+                    )
+            if not held:
+                break
+            if elapsed >= self.release_timeout:
+                self.logger.warning(
+                    f"Executions of {sorted(held)} were still delayed after "
+                    f"{self.release_timeout}s. Releasing them all at once."
+                )
+                for pack_name in sorted(set(pack_of[ref] for ref in held)):
+                    self.releases[pack_name]["timed_out"] = True
+                    results[pack_name].update(
+                        self._delete_delay_policies(
+                            pack_name, self._of_pack(held, pack_of, pack_name)
+                        )
+                    )
+                break
 
-                success = self.client.policies.delete(policy)
-            results[policy.resource_ref] = (success, policy.ref)
+            raised = {
+                action_ref: thresholds[action_ref] + self.release_step
+                for action_ref in held
+                if thresholds[action_ref] == 0
+                or depths[action_ref] < last_depths[action_ref]
+            }
+            last_depths = dict(depths)
+            for action_ref in self._set_thresholds(held, raised):
+                thresholds[action_ref] = raised[action_ref]
+                report = self.releases[pack_of[action_ref]]["actions"][action_ref]
+                report["threshold"] = raised[action_ref]
+
+            time.sleep(self.release_interval)
+            depths = self._delayed_depths(held)
+
+        return results
+
+    @staticmethod
+    def _of_pack(
+        policies: Dict[str, str], pack_of: Dict[str, str], pack_name: str
+    ) -> Dict[str, str]:
+        return {
+            action_ref: policy_ref
+            for action_ref, policy_ref in policies.items()
+            if pack_of[action_ref] == pack_name
+        }
+
+    def _delayed_depths(self, policies: Dict[str, str]) -> Dict[str, int]:
+        """{action_ref: number of delayed executions}.
+
+        An action whose executions cannot be counted counts as drained, so its
+        policy is deleted as it would be without release_mode=ramp.
+        """
+        outcomes = run_parallel(
+            lambda action_ref: count_executions(
+                self.client, action=action_ref, status=DELAYED_STATUS
+            ),
+            policies,
+            parallelism=self.parallelism,
+            retries=self.retries,
+        )
+        depths = {}
+        for action_ref, outcome in outcomes.items():
+            if not outcome.ok:
+                self.logger.warning(
+                    f"Could not count the delayed executions of {action_ref}: "
+                    f"{outcome.error}"
+                )
+            depths[action_ref] = outcome.value if outcome.ok else 0
+        return depths
+
+    def _set_thresholds(
+        self, policies: Dict[str, str], thresholds: Dict[str, int]
+    ) -> List[str]:
+        """Update the thresholds of policies. Return the action refs that were updated."""
+        def set_threshold(action_ref):
+            policy = self.client.policies.get_by_ref_or_id(policies[action_ref])
+            policy.parameters = dict(
+                policy.parameters, threshold=thresholds[action_ref]
+            )
+            return self.client.policies.update(policy)
+
+        outcomes = run_parallel(
+            set_threshold,
+            thresholds,
+            parallelism=self.parallelism,
+            retries=self.retries,
+        )
+        updated = []
+        for action_ref, outcome in outcomes.items():
+            if outcome.ok:
+                updated.append(action_ref)
+                continue
+            # it is raised again on the next step, or deleted on timeout
+            self.logger.warning(
+                f"Could not raise the threshold of policy={policies[action_ref]} "
+                f"to {thresholds[action_ref]}: {outcome.error}"
+            )
+        return updated
+
+    def _delete_delay_policies(
+        self,
+        pack_name: str,
+        policies: Dict[str, str],
+        keep: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Tuple[bool, str]]:
+        """Delete policies. keep has the pack's other policies, still to be deleted."""
+        results = {}
+        outcomes = run_parallel(
+            # missing policies (eg already deleted by an interrupted resume) are not an error
+            lambda item: self.client.policies.delete_by_id(item[1]),
+            policies.items(),
+            key=lambda item: item[0],
+            parallelism=self.parallelism,
+            retries=self.retries,
+        )
+        remaining = dict(keep or {})
+        for action_ref, outcome in outcomes.items():
+            policy_ref = policies[action_ref]
+            success = outcome.ok and bool(outcome.value)
+            results[action_ref] = (success, policy_ref)
+            if not success:
+                remaining[action_ref] = policy_ref
+                self.logger.error(
+                    f"Failed to delete policy={policy_ref} for action={action_ref} "
+                    f"after {outcome.attempts} attempt(s): {outcome.error}"
+                )
+                continue
             self.logger.debug(
-                f"Resumed/Re-allowed executions for action={policy.resource_ref} "
-                f"by deleting action.concurrency policy={policy.ref}"
+                f"Resumed/Re-allowed executions for action={action_ref} "
+                f"by deleting action.concurrency policy={policy_ref}"
             )
 
+        # Keep only what still needs to be deleted, so the next resume picks up from here.
+        if remaining:
+            save_json(self.client, self._ledger_key(pack_name), remaining)
+        else:
+            delete_key(self.client, self._ledger_key(pack_name))
+
         return results
 
+    def _plan_pack(
+        self,
+        pack_name: str,
+        pack_path: Optional[str],
+        fingerprint: Optional[str],
+        operations: List[Dict[str, Any]],
+    ) -> None:
+        self.plan["packs"][pack_name] = {
+            "path": pack_path,
+            "fingerprint": fingerprint,
+            "operations": operations,
+        }
+
+    def _fresh_packs(
+        self, planned_packs: Dict[str, Dict[str, Any]], pack_names, action: str
+    ) -> Dict[str, Dict[str, Any]]:
+        fresh = {}
+        for pack_name in pack_names:
+            planned = planned_packs.get(pack_name)
+            if not planned:
+                continue
+            if action == "delay":
+                # packs that were not installed when the plan was made have no path
+                if not planned.get("path"):
+                    continue
+                fingerprint = pack_fingerprint(pathlib.Path(planned["path"]))
+            else:
+                fingerprint = value_fingerprint(self._load_ledger(pack_name))
+            if fingerprint == planned["fingerprint"]:
+                fresh[pack_name] = planned
+        return fresh
+
+    def apply_planned(
+        self, pack_name: str, planned: Dict[str, Any], action: str
+    ) -> Dict[str, Tuple[bool, str]]:
+        """Create or delete the policies planned for a pack in check_mode.
+
+        Neither the actions nor the policies of the pack are listed again.
+        """
+        if action == "delay":
+            action_refs = [
+                operation["action_ref"] for operation in planned["operations"]
+            ]
+            if not action_refs:
+                return {}
+            self.logger.info(
+                f"Delaying all executions for actions in pack: {pack_name}"
+            )
+            return self._create_delay_policies(pack_name, action_refs, {})
+
+        self.logger.info(
+            f"Resuming/Re-allowing executions for actions in pack: {pack_name}"
+        )
+        policies = {
+            operation["action_ref"]: operation["ref"]
+            for operation in planned["operations"]
+        }
+        return self._release_delay_policies(pack_name, policies)
+
+    @staticmethod
+    def _ledger_key(pack_name: str) -> str:
+        return f"{LEDGER_KEY_PREFIX}.{pack_name}"
+
+    def _load_ledger(self, pack_name) -> Optional[Dict[str, str]]:
+        return load_json(self.client, self._ledger_key(pack_name))
+
+    def _find_delay_policies(self, pack_name) -> Dict[str, str]:
+        # include the trailing "." so that resuming pack "fo" does not match "delay.foo.*"
+        name_prefix = f"{POLICY_PREFIX}.{pack_name}."
+        return {
+            policy.resource_ref: policy.ref
+            for policy in self.client.policies.get_all(pack=POLICY_PACK)
+            if policy.name.startswith(name_prefix)
+        }
+
 
 if __name__ == "__main__":
     test_action = DelayNewPackExecutions(config={})
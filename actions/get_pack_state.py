@@ -0,0 +1,85 @@
+import pathlib
+
+from typing import Dict, TYPE_CHECKING, Union
+
+import yaml
+
+if TYPE_CHECKING:
+    from python_runner.python_action_wrapper import ActionService
+    from logging import Logger
+
+from st2common.content.utils import get_pack_base_path
+from st2common.runners.base_action import Action
+
+from lib.concurrency import DEFAULT_PARALLELISM, run_parallel
+from lib.gitdir import find_git_dir, is_dirty, read_head
+from lib.metrics import Metrics
+
+
+class GetPackState(Action):
+
+    if TYPE_CHECKING:
+        action_service: ActionService
+        logger: Logger
+
+    def run(self, packs: list = None, parallelism=DEFAULT_PARALLELISM):
+        metrics = Metrics("get_pack_state")
+        with metrics.span("read_pack_state"):
+            outcomes = run_parallel(
+                self.pack_state, packs, parallelism=parallelism, retries=0
+            )
+
+        results = {}
+        for pack_name, outcome in outcomes.items():
+            if outcome.ok:
+                results[pack_name] = outcome.value
+            else:
+                self.logger.error(
+                    f"Could not get the state of pack {pack_name}: {outcome.error}"
+                )
+                results[pack_name] = {
+                    "installed": None,
+                    "pack": {},
+                    "commit": "",
+                    "ref": "",
+                    "dirty": None,
+                    "error_message": str(outcome.error),
+                }
+
+        success = all(result["installed"] is not None for result in results.values())
+        return {
+            "success": success,
+            "packs": results,
+            "metrics": metrics.finish(self.config, self.logger),
+        }
+
+    def pack_state(self, pack_name) -> Dict[str, Union[bool, str, dict, None]]:
+        result = {
+            "installed": False,
+            "pack": {},
+            "commit": "",
+            "ref": "",
+            "dirty": None,
+            "error_message": "",
+        }
+
+        pack_path = pathlib.Path(get_pack_base_path(pack_name))
+        pack_metadata_path = pack_path / "pack.yaml"
+        if not pack_metadata_path.exists():
+            self.logger.debug(f"Pack {pack_name} is not installed in {pack_path}")
+            return result
+
+        with pack_metadata_path.open("r") as pack_metadata_file:
+            result["pack"] = yaml.safe_load(pack_metadata_file)
+        result["installed"] = True
+
+        git_dir = find_git_dir(pack_path)
+        if git_dir is None:
+            self.logger.debug(f"Pack {pack_name} in {pack_path} is not a git checkout")
+            return result
+
+        ref, commit = read_head(git_dir)
+        result["commit"] = commit or ""
+        result["ref"] = ref or ""
+        result["dirty"] = is_dirty(pack_path, git_dir)
+        return result
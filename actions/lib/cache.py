@@ -0,0 +1,42 @@
+"""Local on-disk caches shared by the actions in this pack."""
+import json
+import os
+import pathlib
+import tempfile
+
+from typing import Any, Dict, Optional
+
+
+def get_cache_dir(config: Optional[Dict[str, Any]], *parts: str) -> pathlib.Path:
+    """Return (and create) a directory under the cache_dir from the pack config."""
+    config = config or {}
+    base = config.get("cache_dir") or os.path.join(tempfile.gettempdir(), "st2gitops")
+    path = pathlib.Path(base, *parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def read_json(path: pathlib.Path) -> Optional[Any]:
+    """Return the decoded content of a JSON cache file, or None if it is missing or corrupt."""
+    try:
+        with path.open("r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path: pathlib.Path, value: Any) -> None:
+    """Atomically replace a JSON cache file, so concurrent readers never see a partial file."""
+    write_text(path, json.dumps(value))
+
+
+def write_text(path: pathlib.Path, text: str) -> None:
+    """Atomically replace a file with text."""
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
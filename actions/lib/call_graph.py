@@ -0,0 +1,161 @@
+"""Index of the workflows that call actions in other packs.
+
+It is read from the workflow definitions (orquesta and action-chain) of the
+installed packs, so it needs no API calls. The calls of each pack are cached
+by the commit hash of the pack's git checkout.
+"""
+import pathlib
+
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import yaml
+
+from lib.cache import get_cache_dir, read_json, write_json
+from lib.gitdir import find_git_dir, read_head
+
+
+WORKFLOW_RUNNERS = ["orquesta", "action-chain"]
+
+
+def installed_packs() -> Dict[str, pathlib.Path]:
+    """{pack_name: pack_path} for every pack in the packs base paths."""
+    from st2common.content.utils import get_packs_base_paths
+
+    packs: Dict[str, pathlib.Path] = {}
+    for base_path in get_packs_base_paths():
+        base_path = pathlib.Path(base_path)
+        if not base_path.is_dir():
+            continue
+        for pack_path in sorted(base_path.iterdir()):
+            if (pack_path / "pack.yaml").is_file():
+                # like st2, the first base path with the pack wins
+                packs.setdefault(pack_path.name, pack_path)
+    return packs
+
+
+def workflow_calls(pack_name: str, pack_path: pathlib.Path) -> Dict[str, List[str]]:
+    """{workflow_ref: [refs of the actions it calls]} for the workflows in one pack.
+
+    Actions chosen with an expression (eg "action: <% ctx().action %>") are not known
+    until the workflow runs, so they are left out.
+    """
+    calls: Dict[str, List[str]] = {}
+    for metadata in _action_metadata(pack_path):
+        runner_type = metadata.get("runner_type")
+        if runner_type not in WORKFLOW_RUNNERS:
+            continue
+        name, entry_point = metadata["name"], metadata.get("entry_point")
+        if not entry_point:
+            continue
+        definition = _load_yaml(pack_path / "actions" / entry_point)
+        if not isinstance(definition, dict):
+            continue
+        if runner_type == "orquesta":
+            refs = _orquesta_calls(definition)
+        else:
+            refs = _action_chain_calls(definition)
+        calls[f"{pack_name}.{name}"] = sorted(refs)
+    return calls
+
+
+def action_refs(pack_name: str, pack_path: pathlib.Path) -> Optional[List[str]]:
+    """Refs of the actions defined in a pack, or None if the pack is not on disk."""
+    if not (pack_path / "pack.yaml").is_file():
+        return None
+    return sorted(
+        f"{pack_name}.{metadata['name']}" for metadata in _action_metadata(pack_path)
+    )
+
+
+def _action_metadata(pack_path: pathlib.Path) -> Iterator[Dict[str, Any]]:
+    for metadata_path in sorted((pack_path / "actions").glob("*.y*ml")):
+        metadata = _load_yaml(metadata_path)
+        if isinstance(metadata, dict) and metadata.get("name"):
+            yield metadata
+
+
+def _load_yaml(path: pathlib.Path) -> Any:
+    try:
+        with path.open("r") as f:
+            return yaml.safe_load(f)
+    except (OSError, yaml.YAMLError):
+        return None
+
+
+def _static_ref(value: Any) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    # orquesta allows inline parameters: "action: core.local cmd=date"
+    ref = value.strip().split(" ", 1)[0]
+    if "<%" in ref or "{{" in ref or "." not in ref:
+        return None
+    return ref
+
+
+def _orquesta_calls(definition: Dict[str, Any]) -> Set[str]:
+    tasks = definition.get("tasks") or {}
+    if not isinstance(tasks, dict):
+        return set()
+    refs = (
+        _static_ref(task.get("action"))
+        for task in tasks.values()
+        if isinstance(task, dict)
+    )
+    return {ref for ref in refs if ref}
+
+
+def _action_chain_calls(definition: Dict[str, Any]) -> Set[str]:
+    chain = definition.get("chain") or []
+    if not isinstance(chain, list):
+        return set()
+    refs = (_static_ref(link.get("ref")) for link in chain if isinstance(link, dict))
+    return {ref for ref in refs if ref}
+
+
+class CallGraph:
+    def __init__(self, logger, cache_dir: Optional[pathlib.Path] = None):
+        self.logger = logger
+        self.cache_dir = cache_dir
+
+    @classmethod
+    def from_config(cls, config, logger) -> "CallGraph":
+        return cls(logger, cache_dir=get_cache_dir(config, "call_graph"))
+
+    def pack_calls(
+        self, pack_name: str, pack_path: pathlib.Path
+    ) -> Dict[str, List[str]]:
+        """Like workflow_calls, but cached by the commit of the pack's git checkout."""
+        git_dir = find_git_dir(pack_path)
+        commit = read_head(git_dir)[1] if git_dir else None
+        cache_path = (
+            self.cache_dir / f"{pack_name}.json"
+            if self.cache_dir is not None and commit
+            else None
+        )
+        if cache_path is not None:
+            entry = read_json(cache_path)
+            if entry and entry.get("commit") == commit:
+                return entry["calls"]
+
+        calls = workflow_calls(pack_name, pack_path)
+        if cache_path is not None:
+            write_json(cache_path, {"commit": commit, "calls": calls})
+        return calls
+
+    def callers(self, target_packs: List[str]) -> Dict[str, List[str]]:
+        """{target_pack: [refs of workflows in other packs that call its actions]}"""
+        callers: Dict[str, Set[str]] = {pack: set() for pack in target_packs}
+        for pack_name, pack_path in installed_packs().items():
+            try:
+                calls = self.pack_calls(pack_name, pack_path)
+            except (OSError, ValueError) as exc:
+                self.logger.warning(
+                    f"Could not index the workflows of {pack_name}: {exc}"
+                )
+                continue
+            for workflow_ref, action_refs in calls.items():
+                for action_ref in action_refs:
+                    called_pack = action_ref.split(".", 1)[0]
+                    if called_pack in callers and called_pack != pack_name:
+                        callers[called_pack].add(workflow_ref)
+        return {pack: sorted(refs) for pack, refs in callers.items()}
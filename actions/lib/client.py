@@ -0,0 +1,109 @@
+import json
+
+from typing import Any, Dict, Optional
+
+
+# defaults for the api_* settings in config.schema.yaml
+DEFAULT_API_TIMEOUT = 30
+DEFAULT_API_POOL_SIZE = 20
+DEFAULT_API_RETRIES = 3
+
+
+def get_client(config: Optional[Dict[str, Any]] = None, metrics=None):
+    """Build an st2client Client whose managers share one keep-alive connection pool.
+
+    st2client sends every request with requests.get/post/..., which opens a new
+    TCP (and TLS) connection each time. Here every manager that talks to st2api or
+    st2auth gets an HTTP client backed by a single pooled requests.Session with a
+    default timeout and retries for connections that could not be established.
+    Requests that reached st2api are not retried here: that is left to
+    lib.concurrency.call_with_retry, so that one call is never retried by two
+    layers and every attempt is counted.
+
+    When metrics (a lib.metrics.Metrics) is given, the manager calls are counted.
+    """
+    # st2client is imported here so that only actions that need a client pay for it.
+    from st2client.client import Client
+    from st2client.utils.httpclient import HTTPClient
+
+    config = config or {}
+    timeout = config.get("api_timeout") or DEFAULT_API_TIMEOUT
+    session = _build_session(
+        pool_size=config.get("api_pool_size") or DEFAULT_API_POOL_SIZE,
+        retries=config.get("api_retries", DEFAULT_API_RETRIES),
+    )
+    pooled_http_client_class = _pooled_http_client_class()
+
+    client = Client()
+    for manager in client.managers.values():
+        http_client = getattr(manager, "client", None)
+        if type(http_client) is HTTPClient:
+            manager.client = pooled_http_client_class(
+                http_client, session=session, timeout=timeout
+            )
+    if metrics is not None:
+        metrics.instrument(client)
+    return client
+
+
+def _build_session(pool_size: int, retries: int):
+    import requests
+
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # Only connection errors: the request never reached st2api, so any method
+    # is safe to retry. Responses (eg 503) are returned as they are.
+    retry = Retry(total=retries, read=0, status=0, backoff_factor=0.3)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _pooled_http_client_class():
+    from st2client.utils import httpclient
+
+    class PooledHTTPClient(httpclient.HTTPClient):
+        """HTTPClient that sends requests through a shared session instead of new connections."""
+
+        def __init__(self, http_client, session, timeout):
+            # copy everything (root, cacert, debug, ...) from the client being replaced
+            self.__dict__.update(http_client.__dict__)
+            self.session = session
+            self.timeout = timeout
+
+        @httpclient.add_ssl_verify_to_kwargs
+        @httpclient.add_auth_token_to_headers
+        def get(self, url, **kwargs):
+            return self._request("GET", url, **kwargs)
+
+        @httpclient.add_ssl_verify_to_kwargs
+        @httpclient.add_auth_token_to_headers
+        @httpclient.add_json_content_type_to_headers
+        def post(self, url, data, **kwargs):
+            return self._request("POST", url, data=json.dumps(data), **kwargs)
+
+        @httpclient.add_ssl_verify_to_kwargs
+        @httpclient.add_auth_token_to_headers
+        def post_raw(self, url, data, **kwargs):
+            return self._request("POST", url, data=data, **kwargs)
+
+        @httpclient.add_ssl_verify_to_kwargs
+        @httpclient.add_auth_token_to_headers
+        @httpclient.add_json_content_type_to_headers
+        def put(self, url, data, **kwargs):
+            return self._request("PUT", url, data=json.dumps(data), **kwargs)
+
+        @httpclient.add_ssl_verify_to_kwargs
+        @httpclient.add_auth_token_to_headers
+        def delete(self, url, **kwargs):
+            return self._request("DELETE", url, **kwargs)
+
+        def _request(self, method, url, **kwargs):
+            kwargs.setdefault("timeout", self.timeout)
+            response = self.session.request(method, self.root + url, **kwargs)
+            return self._response_hook(response=response)
+
+    return PooledHTTPClient
@@ -0,0 +1,186 @@
+"""A snapshot of cluster state kept warm by the st2gitops.ClusterStateSensor.
+
+The sensor follows the st2 stream and writes a compact JSON snapshot to
+cache_dir/cluster_state/ every second. Actions read it instead of
+querying the API, and fall back to the API whenever it is missing or stale.
+"""
+import json
+import pathlib
+import time
+
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from lib.cache import get_cache_dir, read_json, write_text
+
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FILE = "cluster_state.json"
+# default for the cluster_state_max_age setting in config.schema.yaml
+DEFAULT_CLUSTER_STATE_MAX_AGE = 10
+# how often the sensor writes the snapshot
+WRITE_INTERVAL = 1.0
+# only what actions need to sort executions by pack and report them
+# (see EXECUTION_ATTRIBUTES in wait_or_pause_running_pack_executions)
+EXECUTION_FIELDS = {
+    "action": ["ref", "pack", "runner_type"],
+    "context": ["user"],
+}
+# same as st2common.constants.action.LIVEACTION_STATUS_RUNNING
+RUNNING_STATUS = "running"
+
+
+def snapshot_path(config) -> pathlib.Path:
+    return get_cache_dir(config, "cluster_state") / SNAPSHOT_FILE
+
+
+def compact_execution(execution: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep the EXECUTION_FIELDS of an execution (as a dict from the API or stream)."""
+    compact = {
+        "id": execution.get("id"),
+        "status": execution.get("status"),
+        "start_timestamp": execution.get("start_timestamp"),
+    }
+    for name, fields in EXECUTION_FIELDS.items():
+        value = execution.get(name) or {}
+        compact[name] = {field: value.get(field) for field in fields}
+    return compact
+
+
+class ClusterStateIndex:
+    """The in-memory index of the sensor.
+
+    executions has the running executions, by id. It is updated by execution
+    events and replaced by resync_executions() whenever the stream (re)connects,
+    which refreshed_at records.
+    """
+
+    def __init__(self):
+        self.stream_connected = False
+        self.executions: Dict[str, Dict[str, Any]] = {}
+        self.refreshed_at: Dict[str, float] = {}
+
+    def resync_executions(self, executions: Iterable[Dict[str, Any]]) -> None:
+        self.executions = {
+            execution["id"]: compact_execution(execution) for execution in executions
+        }
+        self.refreshed_at["executions"] = time.time()
+
+    def apply_execution(self, execution: Dict[str, Any]) -> None:
+        if execution.get("status") == RUNNING_STATUS:
+            self.executions[execution["id"]] = compact_execution(execution)
+        else:
+            self.executions.pop(execution.get("id"), None)
+
+    def running_by_pack(self) -> Dict[str, List[Dict[str, Any]]]:
+        by_pack: Dict[str, List[Dict[str, Any]]] = {}
+        for execution in self.executions.values():
+            by_pack.setdefault(execution["action"]["pack"], []).append(execution)
+        return by_pack
+
+    def write(self, path: pathlib.Path) -> None:
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "written_at": time.time(),
+            "stream_connected": self.stream_connected,
+            "refreshed_at": self.refreshed_at,
+            "running_executions": self.running_by_pack(),
+        }
+        write_text(path, json.dumps(snapshot, separators=(",", ":")))
+
+
+def read_snapshot(config, since: float = 0.0) -> Optional[Dict[str, Any]]:
+    """Return the latest snapshot, if the sensor is keeping it up to date.
+
+    That is: it was written after since (waiting for the next write if needed),
+    and the sensor is following the stream. Otherwise None, and the caller has to
+    ask the API.
+    """
+    config = config or {}
+    max_age = config.get("cluster_state_max_age", DEFAULT_CLUSTER_STATE_MAX_AGE)
+    if not max_age:
+        return None
+    path = snapshot_path(config)
+    deadline = time.time() + min(max_age, 2 * WRITE_INTERVAL)
+    while True:
+        snapshot = read_json(path)
+        if not isinstance(snapshot, dict):
+            return None
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            return None
+        written_at = snapshot.get("written_at", 0)
+        if written_at < time.time() - max_age or not snapshot.get("stream_connected"):
+            return None
+        if written_at >= since:
+            return snapshot
+        if time.time() >= deadline:
+            return None
+        time.sleep(WRITE_INTERVAL / 4)
+
+
+def running_executions(
+    snapshot: Dict[str, Any], pack_names: Optional[Iterable[str]] = None
+) -> List[Dict[str, Any]]:
+    """The running executions in a snapshot, of pack_names (or all packs)."""
+    by_pack = snapshot.get("running_executions") or {}
+    if pack_names is None:
+        pack_names = by_pack.keys()
+    executions = []
+    for pack_name in pack_names:
+        executions.extend(by_pack.get(pack_name, []))
+    return executions
+
+
+class SnapshotExecutionTracker:
+    """Track running executions by re-reading the snapshot of the sensor.
+
+    Each snapshot() has to be newer than the previous one. Once the snapshot is
+    missing or stale, this switches to the tracker from fallback() for good.
+    Executions are st2client resources, built with deserialize.
+    """
+
+    def __init__(
+        self,
+        config,
+        pack_names: List[str],
+        deserialize: Callable[[Dict[str, Any]], Any],
+        is_relevant: Callable[[Any], bool],
+        fallback: Callable[[], Any],
+        logger,
+    ):
+        self.config = config
+        self.pack_names = pack_names
+        self.deserialize = deserialize
+        self.is_relevant = is_relevant
+        self.fallback = fallback
+        self.logger = logger
+        self._since = time.time()
+        self._fallback = None
+
+    def snapshot(self) -> List[Any]:
+        if self._fallback is None:
+            snapshot = read_snapshot(self.config, since=self._since)
+            if snapshot is not None:
+                self._since = snapshot["written_at"] + 1e-6
+                executions = [
+                    self.deserialize(execution)
+                    for execution in running_executions(snapshot, self.pack_names)
+                ]
+                return [
+                    execution for execution in executions if self.is_relevant(execution)
+                ]
+            self.logger.warning(
+                "The cluster state snapshot is missing or stale. "
+                "Falling back to the st2 API."
+            )
+            self._fallback = self.fallback()
+        return self._fallback.snapshot()
+
+    def wait(self, timeout: float) -> None:
+        if self._fallback is not None:
+            self._fallback.wait(timeout)
+            return
+        time.sleep(max(0.0, min(WRITE_INTERVAL, timeout)))
+
+    def close(self) -> None:
+        if self._fallback is not None:
+            self._fallback.close()
@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterable, NamedTuple, Optional
+
+
+DEFAULT_PARALLELISM = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 8.0
+
+_attempt = threading.local()
+
+
+class CallResult(NamedTuple):
+    value: Any
+    error: Optional[BaseException]
+    attempts: int
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def http_status(exc: BaseException) -> Optional[int]:
+    """Return the HTTP status code of a failed st2client call, if there was one."""
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """Errors worth retrying: connection problems, timeouts, 429 and 5xx responses."""
+    # requests is always available because st2client depends on it.
+    from requests.exceptions import ConnectionError, Timeout
+
+    if isinstance(exc, (ConnectionError, Timeout)):
+        return True
+    status = http_status(exc)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def current_attempt() -> int:
+    """The attempt number of the call_with_retry() running in this thread, 1 outside of one."""
+    return getattr(_attempt, "number", 1)
+
+
+def call_with_retry(
+    func: Callable[..., Any],
+    *args,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF_SECONDS,
+    retry_on: Callable[[BaseException], bool] = is_transient_error,
+    **kwargs,
+) -> CallResult:
+    """Call func, retrying transient failures with exponential backoff and jitter.
+
+    Exceptions are captured in the returned CallResult instead of being raised.
+    """
+    start_time = time.monotonic()
+    outer_attempt = current_attempt()
+    attempt = 0
+    while True:
+        attempt += 1
+        _attempt.number = attempt
+        try:
+            value = func(*args, **kwargs)
+        except Exception as exc:
+            if attempt > retries or not retry_on(exc):
+                _attempt.number = outer_attempt
+                return CallResult(None, exc, attempt, time.monotonic() - start_time)
+            delay = min(backoff * 2 ** (attempt - 1), MAX_BACKOFF_SECONDS)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+        else:
+            _attempt.number = outer_attempt
+            return CallResult(value, None, attempt, time.monotonic() - start_time)
+
+
+def run_parallel(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    key: Callable[[Any], Hashable] = lambda item: item,
+    parallelism: int = DEFAULT_PARALLELISM,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF_SECONDS,
+    retry_on: Callable[[BaseException], bool] = is_transient_error,
+) -> Dict[Hashable, CallResult]:
+    """Run func(item) for every item with at most `parallelism` calls in flight.
+
+    Returns {key(item): CallResult} in the same order as items.
+    With parallelism <= 1 everything runs serially in the calling thread.
+    """
+    items = list(items)
+
+    def call(item) -> CallResult:
+        return call_with_retry(
+            func, item, retries=retries, backoff=backoff, retry_on=retry_on
+        )
+
+    if parallelism <= 1 or len(items) <= 1:
+        return {key(item): call(item) for item in items}
+
+    with ThreadPoolExecutor(max_workers=min(parallelism, len(items))) as executor:
+        outcomes = executor.map(call, items)
+        return {key(item): outcome for item, outcome in zip(items, outcomes)}
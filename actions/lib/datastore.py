@@ -0,0 +1,28 @@
+import json
+
+from typing import Any, Optional
+
+
+DEFAULT_KEY_TTL = 1 * 86400  # 1 day
+
+
+def load_json(client, name: str) -> Optional[Any]:
+    """Return the decoded value of a JSON datastore key, or None if it is not set."""
+    kvp = client.keys.get_by_name(name=name)
+    if not kvp:
+        return None
+    return json.loads(kvp.value)
+
+
+def save_json(client, name: str, value: Any, ttl: Optional[int] = DEFAULT_KEY_TTL):
+    from st2client.models import KeyValuePair
+
+    kvp = KeyValuePair(name=name, value=json.dumps(value, sort_keys=True))
+    if ttl:
+        kvp.ttl = ttl
+    return client.keys.update(kvp)
+
+
+def delete_key(client, name: str) -> None:
+    # deleting a key that does not exist is not an error.
+    client.keys.delete_by_id(name)
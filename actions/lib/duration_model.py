@@ -0,0 +1,159 @@
+"""Predict when running executions finish from the run times of earlier ones."""
+import math
+import pathlib
+import time
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from lib.cache import get_cache_dir, read_json, write_json
+from lib.concurrency import DEFAULT_PARALLELISM, run_parallel
+from lib.execution_query import format_timestamp, parse_timestamp
+
+
+# defaults for the duration_* settings in config.schema.yaml
+DEFAULT_DURATION_PERCENTILE = 90
+DEFAULT_DURATION_REFRESH_SECONDS = 300
+# run times up to this long are always found when a cache file is brought up to date
+DEFAULT_DURATION_HORIZON_SECONDS = 3600
+# run times kept per action ref
+MAX_SAMPLES = 100
+# fewer samples than this are not enough to predict anything
+MIN_SAMPLES = 3
+# same as st2common.constants.action.LIVEACTION_STATUS_SUCCEEDED
+SUCCEEDED_STATUS = "succeeded"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """The nearest-rank percentile of values."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class DurationModel:
+    """Run times of the recent successful executions of each action, per action ref.
+
+    They are cached in cache_dir/durations, one file per action ref with the
+    MAX_SAMPLES [start, seconds, execution id] samples that finished last.
+    A cache file older than refresh_seconds is brought up to date with one query,
+    for the executions that may have finished since it was checked. The API only
+    filters on start times, so this finds those that started up to horizon_seconds
+    (or the longest run time seen, if longer) before that: a longer run that
+    finished since is missed, but a caller with a budget of horizon_seconds has no
+    use for its run time anyway. Samples that are already cached are matched by
+    execution id.
+
+    An action is expected to take the percentile (eg p90) of its run times.
+    Without MIN_SAMPLES run times there is no prediction.
+    """
+
+    def __init__(
+        self,
+        client,
+        logger,
+        cache_dir: pathlib.Path,
+        pct: float = DEFAULT_DURATION_PERCENTILE,
+        refresh_seconds: float = DEFAULT_DURATION_REFRESH_SECONDS,
+        horizon_seconds: float = DEFAULT_DURATION_HORIZON_SECONDS,
+        parallelism: int = DEFAULT_PARALLELISM,
+    ):
+        self.client = client
+        self.logger = logger
+        self.cache_dir = cache_dir
+        self.pct = pct
+        self.refresh_seconds = refresh_seconds
+        self.horizon_seconds = horizon_seconds
+        self.parallelism = parallelism
+
+    @classmethod
+    def from_config(
+        cls,
+        client,
+        config,
+        logger,
+        horizon_seconds: float = DEFAULT_DURATION_HORIZON_SECONDS,
+        parallelism: int = DEFAULT_PARALLELISM,
+    ) -> "DurationModel":
+        config = config or {}
+        return cls(
+            client,
+            logger,
+            cache_dir=get_cache_dir(config, "durations"),
+            pct=config.get("duration_percentile", DEFAULT_DURATION_PERCENTILE),
+            refresh_seconds=config.get(
+                "duration_refresh_seconds", DEFAULT_DURATION_REFRESH_SECONDS
+            ),
+            horizon_seconds=horizon_seconds,
+            parallelism=parallelism,
+        )
+
+    def expected_durations(self, action_refs: Iterable[str]) -> Dict[str, float]:
+        """{action_ref: expected seconds}, for the action refs with enough history."""
+        outcomes = run_parallel(
+            self._samples, sorted(set(action_refs)), parallelism=self.parallelism
+        )
+        durations = {}
+        for action_ref, outcome in outcomes.items():
+            if not outcome.ok:
+                self.logger.warning(
+                    f"Could not read the run times of {action_ref}: {outcome.error}"
+                )
+                continue
+            samples = [sample[1] for sample in outcome.value]
+            if len(samples) >= MIN_SAMPLES:
+                durations[action_ref] = percentile(samples, self.pct)
+        return durations
+
+    def predict_drain(self, executions: List[Any]) -> Optional[float]:
+        """When the last of executions is expected to finish (seconds since the epoch).
+
+        None if any of them has no prediction, or already ran past it.
+        """
+        if not executions:
+            return time.time()
+        durations = self.expected_durations(
+            execution.action["ref"] for execution in executions
+        )
+        drain = 0.0
+        for execution in executions:
+            start = parse_timestamp(execution.start_timestamp)
+            duration = durations.get(execution.action["ref"])
+            if start is None or duration is None or start + duration < time.time():
+                return None
+            drain = max(drain, start + duration)
+        return drain
+
+    def _samples(self, action_ref: str) -> List[List[Any]]:
+        path = self.cache_dir / f"{action_ref}.json"
+        entry = read_json(path)
+        if not isinstance(entry, dict):
+            entry = {"checked_at": 0, "samples": []}
+        if entry["checked_at"] + self.refresh_seconds > time.time():
+            return entry["samples"]
+
+        filters = {}
+        if entry["samples"]:
+            # timestamp_gt filters on the start, so look back far enough to find
+            # executions that were running when the cache was last checked
+            longest = max(seconds for _, seconds, _ in entry["samples"])
+            lookback = max(longest, self.horizon_seconds)
+            filters["timestamp_gt"] = format_timestamp(entry["checked_at"] - lookback)
+        checked_at = time.time()
+        executions = self.client.executions.query(
+            action=action_ref,
+            status=SUCCEEDED_STATUS,
+            limit=MAX_SAMPLES,
+            include_attributes="id,start_timestamp,end_timestamp",
+            **filters,
+        )
+        samples = {sample[2]: sample for sample in entry["samples"]}
+        for execution in executions:
+            start = parse_timestamp(execution.start_timestamp)
+            end = parse_timestamp(getattr(execution, "end_timestamp", None))
+            if start is not None and end is not None:
+                samples[execution.id] = [start, end - start, execution.id]
+        # the ones that finished last first
+        newest = sorted(samples.values(), key=lambda sample: -(sample[0] + sample[1]))
+        entry = {"checked_at": checked_at, "samples": newest[:MAX_SAMPLES]}
+        write_json(path, entry)
+        return entry["samples"]
@@ -0,0 +1,162 @@
+import time
+
+from typing import Callable, Dict, Iterable, Union
+
+from lib.concurrency import (
+    DEFAULT_PARALLELISM,
+    DEFAULT_RETRIES,
+    call_with_retry,
+    run_parallel,
+)
+from lib.execution_tracker import Backoff
+
+
+PAUSED_STATUSES = ("pausing", "paused")
+# anything except these means the execution is no longer (being) paused
+NOT_RESUMED_STATUSES = ("pausing", "paused", "resuming")
+FINISHED_STATUSES = ("succeeded", "failed", "timeout", "canceled", "abandoned")
+
+Outcome = Dict[str, Union[str, bool, int, float, None]]
+
+
+class ExecutionController:
+    """Pause or resume many executions concurrently and confirm that it worked.
+
+    Every execution gets an outcome like:
+        {id, requested, status, confirmed, attempts, latency, error_message}
+    where "requested" says whether the pause/resume request was accepted, and
+    "confirmed" whether a status check saw the execution reach the target state.
+
+    With confirm=False only the requests are sent, and "confirmed" is based on the
+    status in the response. confirm_pauses() checks those outcomes later.
+    """
+
+    def __init__(
+        self,
+        client,
+        logger,
+        parallelism=DEFAULT_PARALLELISM,
+        retries=DEFAULT_RETRIES,
+        confirm_timeout=30.0,
+    ):
+        self.client = client
+        self.logger = logger
+        self.parallelism = parallelism
+        self.retries = retries
+        self.confirm_timeout = confirm_timeout
+
+    def pause(
+        self, execution_ids: Iterable[str], confirm: bool = True
+    ) -> Dict[str, Outcome]:
+        return self._control_all(
+            execution_ids,
+            request=self.client.executions.pause,
+            is_confirmed=_is_paused,
+            confirm=confirm,
+        )
+
+    def confirm_pauses(self, outcomes: Dict[str, Outcome]) -> None:
+        """Wait for the requested but unconfirmed pauses in outcomes, updating them."""
+        pending = [
+            outcome
+            for outcome in outcomes.values()
+            if outcome["requested"] and not outcome["confirmed"]
+        ]
+        deadline = time.monotonic() + self.confirm_timeout
+        run_parallel(
+            lambda outcome: self._confirm(outcome, _is_paused, deadline),
+            pending,
+            key=lambda outcome: outcome["id"],
+            parallelism=self.parallelism,
+            retries=0,
+        )
+
+    def resume(self, execution_ids: Iterable[str]) -> Dict[str, Outcome]:
+        return self._control_all(
+            execution_ids,
+            request=self.client.executions.resume,
+            is_confirmed=lambda status: status not in NOT_RESUMED_STATUSES,
+        )
+
+    def _control_all(
+        self, execution_ids, request, is_confirmed, confirm=True
+    ) -> Dict[str, Outcome]:
+        outcomes = run_parallel(
+            lambda execution_id: self._control(
+                execution_id, request, is_confirmed, confirm
+            ),
+            execution_ids,
+            parallelism=self.parallelism,
+            # _control() handles retries itself and does not raise.
+            retries=0,
+        )
+        return {execution_id: outcome.value for execution_id, outcome in outcomes.items()}
+
+    def _control(
+        self,
+        execution_id: str,
+        request: Callable,
+        is_confirmed: Callable[[str], bool],
+        confirm: bool = True,
+    ) -> Outcome:
+        start_time = time.monotonic()
+        response = call_with_retry(request, execution_id, retries=self.retries)
+        outcome: Outcome = {
+            "id": execution_id,
+            "requested": response.ok,
+            "status": getattr(response.value, "status", None),
+            "confirmed": False,
+            "attempts": response.attempts,
+            "latency": 0.0,
+            "error_message": "" if response.ok else str(response.error),
+        }
+        if not response.ok:
+            self.logger.warning(
+                f"Request to {request.__name__} execution={execution_id} failed: {response.error}"
+            )
+            # eg the execution already finished. Report where it is now.
+            outcome["status"] = self._get_status(execution_id)
+
+        outcome["confirmed"] = outcome["status"] is not None and is_confirmed(
+            outcome["status"]
+        )
+        if response.ok and confirm:
+            self._confirm(outcome, is_confirmed, start_time + self.confirm_timeout)
+        outcome["latency"] = round(time.monotonic() - start_time, 3)
+        return outcome
+
+    def _confirm(
+        self, outcome: Outcome, is_confirmed: Callable[[str], bool], deadline: float
+    ) -> None:
+        """Check the status of an execution until it is settled or the deadline passes."""
+        backoff = Backoff(minimum=0.1, maximum=2.0)
+        while not self._is_settled(outcome["status"], is_confirmed):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(backoff.next(), remaining))
+            status = self._get_status(outcome["id"])
+            if status is not None:
+                outcome["status"] = status
+        outcome["confirmed"] = outcome["status"] is not None and is_confirmed(
+            outcome["status"]
+        )
+
+    @staticmethod
+    def _is_settled(status, is_confirmed) -> bool:
+        return status is not None and (is_confirmed(status) or status in FINISHED_STATUSES)
+
+    def _get_status(self, execution_id: str):
+        response = call_with_retry(
+            self.client.executions.get_by_id,
+            execution_id,
+            params={"include_attributes": "id,status"},
+            retries=self.retries,
+        )
+        if not response.ok or response.value is None:
+            return None
+        return response.value.status
+
+
+def _is_paused(status) -> bool:
+    return status in PAUSED_STATUSES
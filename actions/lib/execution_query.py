@@ -0,0 +1,128 @@
+"""Paginated st2 execution queries that yield executions lazily, one page at a time."""
+import calendar
+import datetime
+
+from typing import Any, Collection, Iterable, Iterator, Optional
+
+
+# st2api returns at most api.max_page_size (100 by default) executions per request,
+# whatever limit is asked for, so anything past the first page needs another query.
+DEFAULT_PAGE_SIZE = 100
+# The executions API filters by a single action ref. With up to this many refs,
+# query each of them instead of paging through every running execution.
+MAX_ACTION_REF_QUERIES = 10
+# same as st2common.constants.action.LIVEACTION_STATUS_RUNNING
+RUNNING_STATUS = "running"
+# same as st2common.constants.action.LIVEACTION_STATUS_DELAYED
+DELAYED_STATUS = "delayed"
+TIMESTAMP_FORMATS = ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S")
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """Seconds since the epoch of an st2 API timestamp (always in UTC)."""
+    parsed = _parse_datetime(value)
+    if parsed is None:
+        return None
+    return calendar.timegm(parsed.timetuple()) + parsed.microsecond / 1e6
+
+
+def format_timestamp(value: float) -> str:
+    return datetime.datetime.utcfromtimestamp(value).strftime(TIMESTAMP_FORMAT)
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime.datetime]:
+    if not value:
+        return None
+    text = value.rstrip("Z")
+    if text.endswith("+00:00"):
+        text = text[: -len("+00:00")]
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, timestamp_format)
+        except ValueError:
+            continue
+    return None
+
+
+def iter_executions(
+    client, page_size: int = DEFAULT_PAGE_SIZE, **filters
+) -> Iterator[Any]:
+    """Yield the executions matching the API filters, fetching a page only when needed.
+
+    The API returns the newest executions first. Rather than an offset, which
+    shifts when executions stop matching (eg finish) between two requests, each
+    next page is asked for with a cursor: the executions that started no later
+    than the last one of the page (timestamp_lt). Those that started at the same
+    time are read again, and dropped here. Executions that start while paging
+    are not included. include_attributes must include start_timestamp.
+    """
+    seen = set()
+    while True:
+        page = client.executions.query(limit=page_size, **filters)
+        new = 0
+        for execution in page:
+            if execution.id not in seen:
+                seen.add(execution.id)
+                new += 1
+                yield execution
+        if len(page) < page_size:
+            return
+        last_start = _parse_datetime(page[-1].start_timestamp)
+        if last_start is None:
+            raise ValueError(f"Execution {page[-1].id} has no start_timestamp")
+        if new:
+            # timestamp_lt is exclusive, so this includes the same start time
+            last_start += datetime.timedelta(microseconds=1)
+        # else a whole page started at the same time, and then only older ones are
+        # left to read
+        filters["timestamp_lt"] = last_start.strftime(TIMESTAMP_FORMAT)
+
+
+def iter_running_executions(
+    client,
+    include_attributes: Collection[str],
+    pack_names: Optional[Collection[str]] = None,
+    action_refs: Optional[Collection[str]] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> Iterator[Any]:
+    """Yield the running executions of actions in pack_names (or of action_refs).
+
+    When the action refs are known and there are few of them, the API filters by
+    action ref. Otherwise every running execution is paged through and the ones
+    in other packs are dropped here, because the API cannot filter by pack.
+    """
+    filters = dict(
+        status=RUNNING_STATUS,
+        include_attributes=",".join(include_attributes),
+        page_size=page_size,
+    )
+    if action_refs is not None and len(action_refs) <= MAX_ACTION_REF_QUERIES:
+        for action_ref in sorted(action_refs):
+            yield from iter_executions(client, action=action_ref, **filters)
+        return
+
+    for execution in iter_executions(client, **filters):
+        if pack_names is not None and execution.action["pack"] not in pack_names:
+            continue
+        if action_refs is not None and execution.action["ref"] not in action_refs:
+            continue
+        yield execution
+
+
+def any_execution(executions: Iterable[Any]) -> bool:
+    """Whether executions yields anything. Stops reading at the first one."""
+    for _ in executions:
+        return True
+    return False
+
+
+def count_executions(client, **filters) -> int:
+    """The number of executions matching the API filters, from a one-item page.
+
+    st2api returns the total in the X-Total-Count header (see query_with_count).
+    """
+    _, count = client.executions.query_with_count(
+        limit=1, include_attributes="id", **filters
+    )
+    return int(count or 0)
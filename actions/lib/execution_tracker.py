@@ -0,0 +1,270 @@
+import json
+import os
+import queue
+import socket
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional
+
+
+EXECUTION_UPDATE_EVENT = "st2.execution__update"
+# same as st2common.constants.action.LIVEACTION_STATUS_RUNNING
+RUNNING_STATUS = "running"
+# how long to wait for the thread reading a closed stream connection to finish
+STREAM_CLOSE_TIMEOUT = 5.0
+# how often StreamExecutionTracker reconnects after the stream drops before it
+# falls back to polling
+STREAM_RECONNECTS = 3
+
+
+class Backoff:
+    """Polling interval that grows while nothing changes and resets when something does."""
+
+    def __init__(self, minimum=0.25, maximum=5.0, factor=2.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.current = minimum
+
+    def reset(self):
+        self.current = self.minimum
+
+    def next(self) -> float:
+        interval = self.current
+        self.current = min(self.current * self.factor, self.maximum)
+        return interval
+
+
+class PollingExecutionTracker:
+    """Track running executions by re-running a query, backing off while nothing changes.
+
+    query() must return the relevant running executions.
+    """
+
+    def __init__(self, query: Callable[[], List[Any]], backoff: Backoff = None):
+        self.query = query
+        self.backoff = backoff or Backoff()
+        self._last_ids = None
+
+    def snapshot(self) -> List[Any]:
+        executions = self.query()
+        ids = {execution.id for execution in executions}
+        if ids != self._last_ids:
+            self.backoff.reset()
+        self._last_ids = ids
+        return executions
+
+    def wait(self, timeout: float) -> None:
+        time.sleep(max(0.0, min(self.backoff.next(), timeout)))
+
+    def close(self) -> None:
+        pass
+
+
+class StreamConnection:
+    """One connection to the st2 stream, read by a thread into the events queue.
+
+    The queue gets the st2.execution__update payloads, then an exception once the
+    connection fails. connected is set once the stream answered. close() stops the
+    thread and closes the connection, even while the thread is blocked reading from it.
+    """
+
+    def __init__(self, client, logger):
+        self.events: "queue.Queue" = queue.Queue()
+        self.connected = threading.Event()
+        self._client = client
+        self._logger = logger
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._response = None
+        self._thread = threading.Thread(
+            target=self._listen, name="st2-stream", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            response = self._response
+        if response is not None:
+            _shutdown(response)
+        self._thread.join(STREAM_CLOSE_TIMEOUT)
+        if self._thread.is_alive():
+            self._logger.warning("The st2 stream listener did not stop")
+
+    def _listen(self) -> None:
+        # sseclient comes with st2client, which uses it in StreamManager.listen
+        from sseclient import SSEClient
+
+        response = None
+        try:
+            response = self._open()
+            with self._lock:
+                self._response = response
+            # close() may have run before the response was recorded
+            if self._stop.is_set():
+                return
+            self.connected.set()
+            for message in SSEClient(response).events():
+                if self._stop.is_set():
+                    return
+                # st2 sends keep-alive messages without data
+                if message.data:
+                    self.events.put(json.loads(message.data))
+        except Exception as exc:
+            if not self._stop.is_set():
+                self.events.put(exc)
+        else:
+            if not self._stop.is_set():
+                self.events.put(ConnectionError("The st2 stream was closed"))
+        finally:
+            if response is not None:
+                response.close()
+
+    def _open(self):
+        """Open the stream like StreamManager.listen, but keep the response."""
+        import requests
+
+        stream = self._client.managers["Stream"]
+        params = {"events": EXECUTION_UPDATE_EVENT}
+        # same as st2client.models.core.add_auth_token_to_kwargs_from_env
+        if os.environ.get("ST2_AUTH_TOKEN"):
+            params["x-auth-token"] = os.environ["ST2_AUTH_TOKEN"]
+        if os.environ.get("ST2_API_KEY"):
+            params["st2-api-key"] = os.environ["ST2_API_KEY"]
+        kwargs = {}
+        if stream.cacert is not None:
+            kwargs["verify"] = stream.cacert
+        if stream.basic_auth:
+            kwargs["auth"] = stream.basic_auth
+        url = stream.endpoint.rstrip("/") + "/stream"
+        response = requests.get(url, params=params, stream=True, **kwargs)
+        response.raise_for_status()
+        return response
+
+
+def _shutdown(response) -> None:
+    """Unblock a read of response in another thread.
+
+    Closing the response from here would wait for that read to finish, so the
+    socket underneath is shut down instead.
+    """
+    raw = response.raw
+    sock = getattr(getattr(raw, "_connection", None), "sock", None)
+    if sock is None:
+        # a response without a length owns the socket, behind http.client's file
+        sock = getattr(getattr(getattr(raw, "_fp", None), "fp", None), "raw", None)
+        sock = getattr(sock, "_sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class StreamExecutionTracker:
+    """Track running executions in memory using st2.execution__update events from the stream API.
+
+    The running set is seeded with query() and re-synced with it every resync_seconds
+    to cover events that were missed while (re)connecting. If the stream drops after
+    it connected, this reconnects (up to STREAM_RECONNECTS times) and re-syncs right
+    away. If the stream cannot be read, this falls back to a PollingExecutionTracker.
+    """
+
+    def __init__(
+        self,
+        client,
+        query: Callable[[], List[Any]],
+        is_relevant: Callable[[Any], bool],
+        logger,
+        resync_seconds: float = 30.0,
+    ):
+        self.client = client
+        self.query = query
+        self.is_relevant = is_relevant
+        self.logger = logger
+        self.resync_seconds = resync_seconds
+
+        self._running: Dict[str, Any] = {}
+        self._next_resync = 0.0
+        self._fallback: Optional[PollingExecutionTracker] = None
+        self._reconnects = 0
+        # subscribe before the first query so that no update falls in between.
+        self._connection = self._connect()
+
+    def _connect(self) -> StreamConnection:
+        connection = StreamConnection(self.client, self.logger)
+        connection.start()
+        return connection
+
+    def snapshot(self) -> List[Any]:
+        if self._fallback:
+            return self._fallback.snapshot()
+        self._drain(block_seconds=0)
+        if self._fallback:
+            return self._fallback.snapshot()
+        if time.monotonic() >= self._next_resync:
+            self._running = {execution.id: execution for execution in self.query()}
+            self._next_resync = time.monotonic() + self.resync_seconds
+        return list(self._running.values())
+
+    def wait(self, timeout: float) -> None:
+        if self._fallback:
+            self._fallback.wait(timeout)
+            return
+        timeout = min(timeout, self._next_resync - time.monotonic())
+        self._drain(block_seconds=max(0.0, timeout))
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _drain(self, block_seconds: float) -> None:
+        events = self._connection.events
+        try:
+            if block_seconds > 0:
+                item = events.get(timeout=block_seconds)
+            else:
+                item = events.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            self._apply(item)
+            if events is not self._connection.events:
+                # reconnected: the rest of the old queue was already lost
+                return
+            try:
+                item = events.get_nowait()
+            except queue.Empty:
+                return
+
+    def _apply(self, item) -> None:
+        if self._fallback:
+            return
+        if isinstance(item, Exception):
+            self._connection.close()
+            if self._connection.connected.is_set():
+                if self._reconnects < STREAM_RECONNECTS:
+                    self._reconnects += 1
+                    self.logger.info(f"Lost the st2 stream ({item}). Reconnecting.")
+                    self._connection = self._connect()
+                    # events may have been missed while reconnecting
+                    self._next_resync = 0.0
+                    return
+            self.logger.warning(
+                f"Could not follow execution updates on the st2 stream ({item}). "
+                f"Falling back to polling."
+            )
+            self._fallback = PollingExecutionTracker(self.query)
+            return
+
+        execution = self.client.executions.resource.deserialize(item)
+        if not self.is_relevant(execution):
+            return
+        if execution.status == RUNNING_STATUS:
+            self._running[execution.id] = execution
+        else:
+            self._running.pop(execution.id, None)
@@ -0,0 +1,29 @@
+"""Run git commands for operations that cannot be done by reading .git directly (see gitdir)."""
+import subprocess
+
+from typing import Optional
+
+
+class GitError(Exception):
+    """Raised when a git command fails."""
+
+
+def git(*args: str, cwd: Optional[str] = None, timeout: float = 300) -> str:
+    """Run git with args and return its stripped stdout."""
+    try:
+        completed = subprocess.run(
+            ["git", *args],
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=timeout,
+        )
+    except (OSError, subprocess.TimeoutExpired) as exc:
+        raise GitError(f"git {' '.join(args)} failed: {exc}") from exc
+    if completed.returncode != 0:
+        raise GitError(
+            f"git {' '.join(args)} failed with exit code {completed.returncode}: "
+            f"{completed.stderr.strip()}"
+        )
+    return completed.stdout.strip()
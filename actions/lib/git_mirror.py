@@ -0,0 +1,105 @@
+"""Bare mirrors of pack git repos, so that deploys only fetch new objects."""
+import fcntl
+import hashlib
+import pathlib
+import re
+import shutil
+
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from lib.cache import get_cache_dir
+from lib.git import GitError, git
+
+
+# how a mirror was brought up to date
+CLONED = "cloned"
+FETCHED = "fetched"
+# the requested commit was already in the mirror, so the remote was not contacted.
+# This is how a revert to the previously installed commit works offline.
+CACHED = "cached"
+
+FETCH_REFSPECS = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+COMMIT_HASH = re.compile(r"^[0-9a-f]{40}$")
+
+
+class GitMirror:
+    """One bare mirror per repo URL in cache_dir/git.
+
+    Access to a mirror is serialized with a lock file, so concurrent deploys of
+    the same repo never fetch into it at the same time or clone from it while
+    it is being updated.
+    """
+
+    def __init__(self, logger, cache_dir: pathlib.Path):
+        self.logger = logger
+        self.cache_dir = cache_dir
+
+    @classmethod
+    def from_config(cls, config, logger) -> "GitMirror":
+        return cls(logger, get_cache_dir(config, "git"))
+
+    def path(self, git_url: str) -> pathlib.Path:
+        name = re.sub(r"[^A-Za-z0-9._-]+", "_", git_url.rstrip("/").split("/")[-1])
+        digest = hashlib.sha1(git_url.encode()).hexdigest()[:12]
+        return self.cache_dir / f"{name}-{digest}"
+
+    @contextmanager
+    def locked(self, git_url: str) -> Iterator[pathlib.Path]:
+        mirror_path = self.path(git_url)
+        with open(f"{mirror_path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield mirror_path
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def clone(self, git_url: str, git_ref: str, path: pathlib.Path) -> str:
+        """Clone git_url into path (without a checkout) through its mirror.
+
+        Return how the mirror was updated (see the constants above).
+        The clone's origin is git_url, like a clone straight from the remote.
+        """
+        with self.locked(git_url) as mirror_path:
+            status = self.update(mirror_path, git_url, git_ref)
+            git("clone", "--quiet", "--no-checkout", str(mirror_path), str(path))
+        git("remote", "set-url", "origin", git_url, cwd=str(path))
+        return status
+
+    def update(self, mirror_path: pathlib.Path, git_url: str, git_ref: str) -> str:
+        """Bring the mirror up to date for git_ref. The caller must hold the lock."""
+        if not (mirror_path / "HEAD").is_file():
+            shutil.rmtree(str(mirror_path), ignore_errors=True)
+            git("clone", "--quiet", "--bare", git_url, str(mirror_path))
+            return CLONED
+        if COMMIT_HASH.match(git_ref) and _has_commit(mirror_path, git_ref):
+            return CACHED
+
+        # Branches and tags can move, so they are never taken from the mirror
+        # without fetching.
+        git(
+            "fetch",
+            "--quiet",
+            "--prune",
+            git_url,
+            *FETCH_REFSPECS,
+            cwd=str(mirror_path),
+        )
+        if not _has_commit(mirror_path, git_ref):
+            # eg a commit that is not on any branch or tag any more
+            _try_git("fetch", "--quiet", git_url, git_ref, cwd=str(mirror_path))
+        return FETCHED
+
+
+def _has_commit(mirror_path: pathlib.Path, ref: str) -> bool:
+    commit = _try_git(
+        "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}", cwd=str(mirror_path)
+    )
+    return commit is not None
+
+
+def _try_git(*args: str, cwd: Optional[str] = None) -> Optional[str]:
+    try:
+        return git(*args, cwd=cwd)
+    except GitError:
+        return None
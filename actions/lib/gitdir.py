@@ -0,0 +1,181 @@
+"""Read the state of a git checkout straight from its .git directory, without forking git."""
+import hashlib
+import os
+import pathlib
+import stat
+import struct
+
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+
+class IndexEntry(NamedTuple):
+    path: str
+    mtime: Tuple[int, int]
+    mode: int
+    size: int
+    sha: bytes
+
+
+def find_git_dir(work_tree: pathlib.Path) -> Optional[pathlib.Path]:
+    dot_git = work_tree / ".git"
+    if dot_git.is_dir():
+        return dot_git
+    if dot_git.is_file():
+        # worktrees and submodules use a "gitdir: <path>" file
+        content = dot_git.read_text().strip()
+        if content.startswith("gitdir:"):
+            return (work_tree / content[len("gitdir:"):].strip()).resolve()
+    return None
+
+
+def _common_dir(git_dir: pathlib.Path) -> pathlib.Path:
+    commondir = git_dir / "commondir"
+    if commondir.is_file():
+        return (git_dir / commondir.read_text().strip()).resolve()
+    return git_dir
+
+
+def resolve_ref(git_dir: pathlib.Path, ref: str) -> Optional[str]:
+    """Return the commit hash of a ref like refs/heads/master, following symbolic refs."""
+    for _ in range(10):
+        for base in (git_dir, _common_dir(git_dir)):
+            ref_file = base / ref
+            if ref_file.is_file():
+                value = ref_file.read_text().strip()
+                break
+        else:
+            return _packed_ref(_common_dir(git_dir), ref)
+        if not value.startswith("ref:"):
+            return value
+        ref = value[len("ref:"):].strip()
+    return None
+
+
+def _packed_ref(git_dir: pathlib.Path, ref: str) -> Optional[str]:
+    packed_refs = git_dir / "packed-refs"
+    if not packed_refs.is_file():
+        return None
+    with packed_refs.open("r") as f:
+        for line in f:
+            if line.startswith(("#", "^")):
+                continue
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == ref:
+                return parts[0]
+    return None
+
+
+def read_head(git_dir: pathlib.Path) -> Tuple[Optional[str], Optional[str]]:
+    """Return (ref, commit) for HEAD. ref is None when HEAD is detached."""
+    head = (git_dir / "HEAD").read_text().strip()
+    if head.startswith("ref:"):
+        ref = head[len("ref:"):].strip()
+        return ref, resolve_ref(git_dir, ref)
+    return None, head
+
+
+def read_index(git_dir: pathlib.Path) -> Iterator[IndexEntry]:
+    """Yield the stage 0 entries of .git/index (versions 2, 3 and 4)."""
+    index_file = git_dir / "index"
+    if not index_file.is_file():
+        return
+    data = index_file.read_bytes()
+    signature, version, count = struct.unpack(">4sLL", data[:12])
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        raise ValueError(f"Unsupported git index {index_file} (version {version})")
+
+    offset = 12
+    previous_path = b""
+    for _ in range(count):
+        (
+            _ctime_s,
+            _ctime_ns,
+            mtime_s,
+            mtime_ns,
+            _dev,
+            _ino,
+            mode,
+            _uid,
+            _gid,
+            size,
+            sha,
+            flags,
+        ) = struct.unpack(">10L20sH", data[offset : offset + 62])
+        entry_start = offset
+        offset += 62
+        if version >= 3 and flags & 0x4000:
+            # extended flags
+            offset += 2
+
+        if version == 4:
+            # the path is the previous path minus N bytes plus a new suffix
+            strip, offset = _read_offset_varint(data, offset)
+            end = data.index(b"\0", offset)
+            path = previous_path[: len(previous_path) - strip] + data[offset:end]
+            offset = end + 1
+        else:
+            end = data.index(b"\0", offset)
+            path = data[offset:end]
+            # entries are NUL padded to a multiple of 8 bytes
+            offset = entry_start + ((end - entry_start + 8) & ~7)
+        previous_path = path
+
+        stage = (flags >> 12) & 0x3
+        if stage == 0:
+            yield IndexEntry(
+                path.decode("utf-8", "surrogateescape"),
+                (mtime_s, mtime_ns),
+                mode,
+                size,
+                sha,
+            )
+
+
+def _read_offset_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, offset
+
+
+def _blob_sha(content: bytes) -> bytes:
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).digest()
+
+
+def is_dirty(work_tree: pathlib.Path, git_dir: pathlib.Path) -> bool:
+    """Whether any tracked file was modified, deleted or changed its executable bit.
+
+    Like git, files whose size and mtime match the index are assumed unchanged,
+    and only the others are hashed. Untracked files are not considered.
+    """
+    for entry in read_index(git_dir):
+        if stat.S_IFMT(entry.mode) == 0o160000:
+            # gitlink (submodule)
+            continue
+        path = work_tree / entry.path
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return True
+
+        is_link = stat.S_IFMT(entry.mode) == stat.S_IFLNK
+        if is_link != stat.S_ISLNK(st.st_mode):
+            return True
+        if not is_link and (entry.mode & 0o100) != (st.st_mode & 0o100):
+            return True
+        if st.st_size & 0xFFFFFFFF != entry.size:
+            return True
+        if (int(st.st_mtime), st.st_mtime_ns % 1_000_000_000) == entry.mtime:
+            continue
+
+        if is_link:
+            content = os.fsencode(os.readlink(path))
+        else:
+            content = path.read_bytes()
+        if _blob_sha(content) != entry.sha:
+            return True
+    return False
@@ -0,0 +1,179 @@
+"""Per-pack leases in the st2 datastore, so only deploys of the same pack serialize."""
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from lib.datastore import delete_key, load_json, save_json
+
+
+# default for the lease_ttl setting in config.schema.yaml
+DEFAULT_LEASE_TTL = 900
+LEASE_KEY_PREFIX = "st2gitops_lease"
+# how long a new lease is left to settle before reading it back (see PackLeases)
+ACQUIRE_SETTLE_SECONDS = 1.0
+
+
+class LeaseHeld(Exception):
+    """Raised when another deploy holds the lease on a pack."""
+
+    def __init__(self, pack_name: str, lease: Dict[str, Any]):
+        super().__init__(
+            f"Pack {pack_name} is being deployed by execution {lease.get('owner')} "
+            f"(lease renewed at {lease.get('renewed_at')})"
+        )
+        self.pack_name = pack_name
+        self.lease = lease
+
+
+def lease_key(pack_name: str) -> str:
+    return f"{LEASE_KEY_PREFIX}.{pack_name}"
+
+
+class PackLeases:
+    """Leases on packs, held by an owner (the id of the deploy workflow execution).
+
+    A lease is a datastore key with a TTL, so the lease of a deploy that died
+    expires on its own. Holders renew it (heartbeats) to keep it. An empty owner
+    never holds a lease, so it only checks that nobody else does.
+
+    Leases only serialize the steps that take a pack out of service (delay,
+    suspend, stage). The steps that put it back (resume, rollback, discard) must
+    never be refused, as a lease may have expired while st2 installed the pack.
+    They only renew the leases their owner still holds (see held()).
+
+    The datastore cannot compare-and-set, so acquire() reads every lease it
+    wrote back ACQUIRE_SETTLE_SECONDS later: of two deploys that wrote the same
+    lease at the same moment, the one whose write landed first then sees the
+    other owner and backs off.
+    """
+
+    def __init__(self, client, owner: str, ttl: int = DEFAULT_LEASE_TTL):
+        self.client = client
+        self.owner = owner
+        self.ttl = ttl
+
+    @classmethod
+    def from_config(cls, client, config, owner: str) -> "PackLeases":
+        config = config or {}
+        return cls(client, owner, ttl=config.get("lease_ttl") or DEFAULT_LEASE_TTL)
+
+    def holder(self, pack_name: str) -> Optional[Dict[str, Any]]:
+        """The lease on a pack, unless it is free or expired."""
+        lease = load_json(self.client, lease_key(pack_name))
+        if not lease:
+            return None
+        if lease.get("renewed_at", 0) + lease.get("ttl", self.ttl) < time.time():
+            return None
+        return lease
+
+    def check(self, pack_name: str) -> Optional[Dict[str, Any]]:
+        """Raise LeaseHeld if anyone other than the owner holds the lease on a pack.
+
+        Return the owner's lease, if it holds one.
+        """
+        lease = self.holder(pack_name)
+        if lease and (not self.owner or lease.get("owner") != self.owner):
+            raise LeaseHeld(pack_name, lease)
+        return lease
+
+    def acquire(self, pack_name: str) -> None:
+        """Take (or renew) the lease on a pack.
+
+        Raise LeaseHeld if someone else has it.
+        """
+        errors = self.acquire_all([pack_name])
+        if errors:
+            raise LeaseHeld(pack_name, self.holder(pack_name) or {})
+
+    def acquire_all(self, pack_names: Iterable[str]) -> Dict[str, str]:
+        """Acquire the leases on packs. Return {pack_name: error} for those others hold.
+
+        The written leases settle together, so this waits once however many packs
+        there are. A lease that was overwritten by another owner meanwhile is
+        left to that owner.
+        """
+        errors: Dict[str, str] = {}
+        written = []
+        for pack_name in pack_names:
+            try:
+                self._write(pack_name)
+            except LeaseHeld as exc:
+                errors[pack_name] = str(exc)
+                continue
+            if self.owner:
+                written.append(pack_name)
+        if written:
+            time.sleep(ACQUIRE_SETTLE_SECONDS)
+            errors.update(self.check_all(written))
+        return errors
+
+    def held(self, pack_names: Iterable[str]) -> List[str]:
+        """The packs whose lease the owner holds."""
+        if not self.owner:
+            return []
+        return [
+            pack_name
+            for pack_name in pack_names
+            if (self.holder(pack_name) or {}).get("owner") == self.owner
+        ]
+
+    def check_all(self, pack_names: Iterable[str]) -> Dict[str, str]:
+        """Return {pack_name: error} for the packs whose lease is held by others."""
+        errors: Dict[str, str] = {}
+        for pack_name in pack_names:
+            try:
+                self.check(pack_name)
+            except LeaseHeld as exc:
+                errors[pack_name] = str(exc)
+        return errors
+
+    def release(self, pack_name: str) -> None:
+        lease = self.holder(pack_name)
+        if self.owner and lease and lease.get("owner") == self.owner:
+            delete_key(self.client, lease_key(pack_name))
+
+    def _write(self, pack_name: str) -> None:
+        """Check, then write the owner's lease on a pack (see acquire_all)."""
+        lease = self.check(pack_name)
+        if not self.owner:
+            return
+        if lease is None:
+            lease = {"acquired_at": time.time()}
+        lease.update(
+            {
+                "owner": self.owner,
+                "pack": pack_name,
+                "renewed_at": time.time(),
+                "ttl": self.ttl,
+            }
+        )
+        save_json(self.client, lease_key(pack_name), lease, ttl=self.ttl)
+
+    @contextmanager
+    def heartbeat(self, pack_names: List[str], logger) -> Iterator[None]:
+        """Renew the leases on pack_names every ttl / 3 seconds until the block ends."""
+        if not self.owner or not pack_names:
+            yield
+            return
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.ttl / 3):
+                try:
+                    errors = self.acquire_all(pack_names)
+                except Exception as exc:
+                    errors = {pack_name: str(exc) for pack_name in pack_names}
+                for pack_name, error in errors.items():
+                    logger.warning(
+                        f"Could not renew the lease on pack {pack_name}: {error}"
+                    )
+
+        thread = threading.Thread(target=renew, name="st2gitops-lease", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
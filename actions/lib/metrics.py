@@ -0,0 +1,201 @@
+"""Timing spans and st2 API call counters, returned under "metrics" in action results."""
+import functools
+import pathlib
+import socket
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from lib.cache import write_text
+from lib.concurrency import current_attempt
+
+
+# st2client manager methods that send requests to the st2 API
+API_METHODS = [
+    "get_all",
+    "get_by_id",
+    "get_by_name",
+    "get_by_ref_or_id",
+    "get_property",
+    "query",
+    "query_with_count",
+    "create",
+    "update",
+    "delete",
+    "delete_by_id",
+    "pause",
+    "resume",
+]
+
+METRIC_PREFIX = "st2gitops"
+STATSD_MAX_DATAGRAM = 1400
+
+
+class Metrics:
+    """Collect per-phase timings and per-endpoint API counters for one action run.
+
+    Phases are timed with span(). Every st2client manager method in API_METHODS is
+    counted (calls, errors, retries and seconds) per endpoint, eg "Policy.create",
+    once the client is passed to instrument(). Calls made by a retry from
+    lib.concurrency.call_with_retry are counted as retries.
+    """
+
+    def __init__(self, action_name: str):
+        self.action_name = action_name
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        # {phase: {"count": int, "seconds": float}}
+        self.phases: Dict[str, Dict[str, float]] = {}
+        # {endpoint: {"calls": int, "errors": int, "retries": int, "seconds": float}}
+        self.api: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def span(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                totals = self.phases.setdefault(phase, {"count": 0, "seconds": 0.0})
+                totals["count"] += 1
+                totals["seconds"] += seconds
+
+    def instrument(self, client):
+        for manager_name, manager in client.managers.items():
+            for method_name in API_METHODS:
+                method = getattr(manager, method_name, None)
+                if method is not None:
+                    endpoint = f"{manager_name}.{method_name}"
+                    setattr(manager, method_name, self._counted(endpoint, method))
+        return client
+
+    def _counted(self, endpoint: str, method):
+        @functools.wraps(method)
+        def counted(*args, **kwargs):
+            retry = current_attempt() > 1
+            error = False
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                with self._lock:
+                    totals = self.api.setdefault(
+                        endpoint,
+                        {"calls": 0, "errors": 0, "retries": 0, "seconds": 0.0},
+                    )
+                    totals["calls"] += 1
+                    totals["errors"] += error
+                    totals["retries"] += retry
+                    totals["seconds"] += seconds
+
+        return counted
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "action": self.action_name,
+                "wall_seconds": round(time.perf_counter() - self.started, 4),
+                "phases": {
+                    phase: dict(totals, seconds=round(totals["seconds"], 4))
+                    for phase, totals in self.phases.items()
+                },
+                "api": {
+                    endpoint: dict(totals, seconds=round(totals["seconds"], 4))
+                    for endpoint, totals in sorted(self.api.items())
+                },
+                "api_calls": sum(totals["calls"] for totals in self.api.values()),
+            }
+
+    def finish(self, config: Optional[Dict[str, Any]], logger) -> Dict[str, Any]:
+        """Return the report, after exporting it as enabled in the pack config."""
+        report = self.report()
+        config = config or {}
+        try:
+            if config.get("metrics_textfile_dir"):
+                write_prometheus_textfile(
+                    pathlib.Path(config["metrics_textfile_dir"]), report
+                )
+            if config.get("metrics_statsd_address"):
+                send_statsd(config["metrics_statsd_address"], report)
+        except (OSError, ValueError) as exc:
+            # metrics must never fail a deploy
+            logger.warning(f"Could not export metrics: {exc}")
+        return report
+
+
+def write_prometheus_textfile(directory: pathlib.Path, report: Dict[str, Any]) -> None:
+    """Write the report for the node_exporter textfile collector (a file per action)."""
+    action = report["action"]
+    lines: List[str] = []
+
+    def gauge(name: str, help_text: str, samples: List[Any]) -> None:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}")
+
+    gauge(
+        "action_last_run_timestamp_seconds",
+        "When the action last finished.",
+        [({"action": action}, round(time.time(), 3))],
+    )
+    gauge(
+        "action_duration_seconds",
+        "Wall time of the last run of the action.",
+        [({"action": action}, report["wall_seconds"])],
+    )
+    gauge(
+        "action_phase_seconds",
+        "Time spent in each phase during the last run of the action.",
+        [
+            ({"action": action, "phase": phase}, totals["seconds"])
+            for phase, totals in report["phases"].items()
+        ],
+    )
+    for field, help_text in (
+        ("calls", "st2 API calls"),
+        ("errors", "Failed st2 API calls"),
+        ("retries", "Retried st2 API calls"),
+        ("seconds", "Time spent in st2 API calls"),
+    ):
+        gauge(
+            f"action_api_{field}",
+            f"{help_text} per endpoint during the last run of the action.",
+            [
+                ({"action": action, "endpoint": endpoint}, totals[field])
+                for endpoint, totals in report["api"].items()
+            ],
+        )
+
+    directory.mkdir(parents=True, exist_ok=True)
+    write_text(directory / f"{METRIC_PREFIX}_{action}.prom", "\n".join(lines) + "\n")
+
+
+def send_statsd(address: str, report: Dict[str, Any]) -> None:
+    """Send the report as statsd timers and counters to host:port over UDP."""
+    host, _, port = address.rpartition(":")
+    prefix = f"{METRIC_PREFIX}.{report['action']}"
+    lines = [f"{prefix}.duration:{report['wall_seconds'] * 1000:.1f}|ms"]
+    for phase, totals in report["phases"].items():
+        lines.append(f"{prefix}.phase.{phase}:{totals['seconds'] * 1000:.1f}|ms")
+    for endpoint, totals in report["api"].items():
+        for field in ("calls", "errors", "retries"):
+            lines.append(f"{prefix}.api.{endpoint}.{field}:{totals[field]}|c")
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        packet = ""
+        for line in lines:
+            if packet and len(packet) + len(line) + 1 > STATSD_MAX_DATAGRAM:
+                sock.sendto(packet.encode(), (host, int(port)))
+                packet = ""
+            packet = f"{packet}\n{line}" if packet else line
+        if packet:
+            sock.sendto(packet.encode(), (host, int(port)))
@@ -0,0 +1,143 @@
+import pathlib
+import time
+
+from typing import Any, Dict, Iterable, Optional
+
+from st2common.content.utils import get_pack_base_path
+
+from lib.cache import get_cache_dir, read_json, write_json
+from lib.concurrency import DEFAULT_PARALLELISM, run_parallel
+from lib.gitdir import find_git_dir, read_head
+
+
+# defaults for the pack_* settings in config.schema.yaml
+DEFAULT_PACK_CACHE_TTL = 60
+DEFAULT_PACK_BULK_THRESHOLD = 25
+
+
+class PackResolver:
+    """Look up installed packs by ref, with a short-lived on-disk cache.
+
+    resolve() returns {pack_ref: Pack or None}, where None means "not installed".
+    A few packs are fetched with parallel get_by_ref_or_id calls. Only when more
+    than bulk_threshold packs are missing from the cache are all packs listed.
+
+    Cache entries expire after ttl seconds, and are invalidated as soon as the
+    pack is (re)installed or removed: each entry records a fingerprint of the
+    pack directory (pack.yaml mtime and git HEAD) that must still match.
+    """
+
+    def __init__(
+        self,
+        client,
+        logger,
+        cache_dir: Optional[pathlib.Path] = None,
+        ttl: float = DEFAULT_PACK_CACHE_TTL,
+        bulk_threshold: int = DEFAULT_PACK_BULK_THRESHOLD,
+        parallelism: int = DEFAULT_PARALLELISM,
+    ):
+        self.client = client
+        self.logger = logger
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.bulk_threshold = bulk_threshold
+        self.parallelism = parallelism
+
+    @classmethod
+    def from_config(
+        cls, client, config, logger, parallelism: int = DEFAULT_PARALLELISM
+    ) -> "PackResolver":
+        config = config or {}
+        ttl = config.get("pack_cache_ttl", DEFAULT_PACK_CACHE_TTL)
+        return cls(
+            client,
+            logger,
+            cache_dir=get_cache_dir(config, "packs") if ttl else None,
+            ttl=ttl,
+            bulk_threshold=config.get(
+                "pack_bulk_threshold", DEFAULT_PACK_BULK_THRESHOLD
+            ),
+            parallelism=parallelism,
+        )
+
+    def resolve(self, pack_refs: Iterable[str]) -> Dict[str, Any]:
+        pack_refs = list(dict.fromkeys(pack_refs))
+        packs: Dict[str, Any] = {}
+        fingerprints = {ref: self._fingerprint(ref) for ref in pack_refs}
+
+        misses = []
+        for ref in pack_refs:
+            entry = self._read_cache(ref, fingerprints[ref])
+            if entry is None:
+                misses.append(ref)
+            else:
+                packs[ref] = self._deserialize(entry["pack"])
+
+        if len(misses) > self.bulk_threshold:
+            self.logger.debug(f"Listing all packs to look up {len(misses)} packs")
+            all_packs = {pack.ref: pack for pack in self.client.packs.get_all()}
+            fetched = {ref: all_packs.get(ref) for ref in misses}
+        elif misses:
+            outcomes = run_parallel(
+                self.client.packs.get_by_ref_or_id,
+                misses,
+                parallelism=self.parallelism,
+            )
+            fetched = {}
+            for ref, outcome in outcomes.items():
+                if not outcome.ok:
+                    raise outcome.error
+                fetched[ref] = outcome.value
+        else:
+            fetched = {}
+
+        for ref, pack in fetched.items():
+            packs[ref] = pack
+            self._write_cache(ref, fingerprints[ref], pack)
+            if pack is None:
+                self.logger.debug(f"Pack {ref} is not installed")
+
+        return {ref: packs[ref] for ref in pack_refs}
+
+    @staticmethod
+    def _fingerprint(ref: str) -> str:
+        pack_path = pathlib.Path(get_pack_base_path(ref))
+        try:
+            mtime = (pack_path / "pack.yaml").stat().st_mtime_ns
+        except OSError:
+            return "not-installed"
+        git_dir = find_git_dir(pack_path)
+        commit = read_head(git_dir)[1] if git_dir else None
+        return f"{mtime}:{commit}"
+
+    def _cache_path(self, ref: str) -> pathlib.Path:
+        return self.cache_dir / f"{ref}.json"
+
+    def _read_cache(self, ref: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        if self.cache_dir is None:
+            return None
+        entry = read_json(self._cache_path(ref))
+        if (
+            not entry
+            or entry.get("fingerprint") != fingerprint
+            or time.time() - entry.get("fetched_at", 0) > self.ttl
+        ):
+            return None
+        return entry
+
+    def _write_cache(self, ref: str, fingerprint: str, pack) -> None:
+        if self.cache_dir is None:
+            return
+        write_json(
+            self._cache_path(ref),
+            {
+                "fetched_at": time.time(),
+                "fingerprint": fingerprint,
+                "pack": pack.serialize() if pack is not None else None,
+            },
+        )
+
+    def _deserialize(self, pack_dict: Optional[Dict[str, Any]]):
+        if pack_dict is None:
+            return None
+        return self.client.packs.resource.deserialize(pack_dict)
@@ -0,0 +1,72 @@
+"""Serializable plans of API changes: made in check_mode, run later by an apply."""
+import hashlib
+import json
+import pathlib
+import time
+
+from typing import Any, Dict, Optional
+
+from lib.gitdir import find_git_dir, read_head
+
+
+PLAN_VERSION = 1
+
+
+class PlanError(Exception):
+    """Raised when a plan cannot be applied by an action."""
+
+
+def new_plan(action_name: str, mode: Optional[str] = None) -> Dict[str, Any]:
+    """An empty plan. Actions add {pack_name: {path, fingerprint, operations}} to packs.
+
+    Each operation lists the resource ref, its current and desired state, and the
+    API call that gets it there. The fingerprint is checked before applying the
+    operations of a pack (see pack_fingerprint).
+    """
+    return {
+        "version": PLAN_VERSION,
+        "action": action_name,
+        "mode": mode,
+        "created_at": time.time(),
+        "packs": {},
+    }
+
+
+def check_plan(
+    plan: Any, action_name: str, mode: Optional[str] = None
+) -> Dict[str, Dict[str, Any]]:
+    """Return the packs of a plan made by action_name (in mode), or raise PlanError."""
+    if not isinstance(plan, dict) or plan.get("version") != PLAN_VERSION:
+        raise PlanError(f"Not a version {PLAN_VERSION} plan")
+    if plan.get("action") != action_name or plan.get("mode") != mode:
+        raise PlanError(
+            f"The plan was made by {plan.get('action')} {plan.get('mode') or ''}, "
+            f"not {action_name} {mode or ''}"
+        )
+    return plan.get("packs") or {}
+
+
+def pack_fingerprint(pack_path: pathlib.Path, *file_names: str) -> str:
+    """Fingerprint the installed revision of a pack and the content of file_names.
+
+    This only reads local files (the git HEAD, or pack.yaml if the pack is not a
+    git checkout), so checking whether a plan is stale costs no API calls.
+    """
+    digest = hashlib.sha256()
+    git_dir = find_git_dir(pack_path)
+    commit = read_head(git_dir)[1] if git_dir else None
+    if commit:
+        digest.update(commit.encode() + b"\0")
+    else:
+        file_names = ("pack.yaml",) + file_names
+    for file_name in file_names:
+        path = pack_path / file_name
+        digest.update(file_name.encode() + b"\0")
+        if path.is_file():
+            digest.update(path.read_bytes())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def value_fingerprint(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
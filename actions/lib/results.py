@@ -0,0 +1,62 @@
+"""Keep large action results out of the workflow context (see result_mode)."""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from typing import Any, Dict, Iterable
+
+from lib.cache import get_cache_dir
+
+
+# the whole result, as before result_mode existed
+FULL = "full"
+# counts, plus only the entries that failed or changed something
+SUMMARY = "summary"
+# counts, plus a JSON lines file with every entry
+STREAM = "stream"
+
+# result files older than this are removed whenever a new one is written
+RESULT_FILE_MAX_AGE = 7 * 86400
+
+
+def write_result_file(
+    config, action_name: str, records: Iterable[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Write records as JSON lines to a new file in cache_dir/results.
+
+    Return {path, records, sha256}, where sha256 is the digest of the file content.
+    The file only appears once it is complete.
+    """
+    results_dir = get_cache_dir(config, "results")
+    _remove_old_files(results_dir)
+
+    name = f"{action_name}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.jsonl"
+    path = results_dir / name
+    digest = hashlib.sha256()
+    count = 0
+    fd, tmp_path = tempfile.mkstemp(dir=str(results_dir), prefix=f".{name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for record in records:
+                line = json.dumps(record, sort_keys=True, default=str).encode() + b"\n"
+                f.write(line)
+                digest.update(line)
+                count += 1
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return {"path": str(path), "records": count, "sha256": digest.hexdigest()}
+
+
+def _remove_old_files(results_dir) -> None:
+    cutoff = time.time() - RESULT_FILE_MAX_AGE
+    for path in results_dir.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            # eg removed by another action at the same time
+            continue
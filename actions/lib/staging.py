@@ -0,0 +1,444 @@
+"""Prepare a pack revision next to the installed pack, then swap it in with renames.
+
+Staging does the slow parts of packs.install (git clone, virtualenv, metadata
+checks) while the old revision is still in use. Activating only renames
+directories, so it takes seconds and can run while executions are delayed.
+
+Staging does not install pack dependencies. A revision whose dependencies differ
+from the installed one is refused, so that the deploy uses packs.install instead.
+"""
+import ctypes
+import functools
+import os
+import pathlib
+import shutil
+import subprocess
+
+from errno import EINVAL, ENOSYS
+
+from typing import List, NamedTuple, Optional, Tuple
+
+import yaml
+
+from lib.git import GitError, git
+from lib.git_mirror import GitMirror
+from lib.gitdir import find_git_dir, read_head
+from lib.venv_cache import DISABLED, HIT, MISS, VirtualenvCache
+
+
+# Directories next to the packs and virtualenvs, so that renames stay on one
+# filesystem. st2 only loads directories with a pack.yaml from the packs base
+# path, so this one is ignored.
+STAGING_DIR = ".st2gitops-staging"
+PIP_TIMEOUT = 900
+
+# for renameat2(2)
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+# {pack directory: (module, API model)} for the content that packs.register validates
+CONTENT_MODELS = {
+    "actions": ("st2common.models.api.action", "ActionAPI"),
+    "aliases": ("st2common.models.api.action", "ActionAliasAPI"),
+    "policies": ("st2common.models.api.policy", "PolicyAPI"),
+    "rules": ("st2common.models.api.rule", "RuleAPI"),
+    "sensors": ("st2common.models.api.sensor", "SensorTypeAPI"),
+}
+
+
+class StagingError(Exception):
+    """Raised when a pack revision cannot be staged or activated."""
+
+
+class PackPaths(NamedTuple):
+    pack_path: pathlib.Path
+    virtualenv_path: pathlib.Path
+
+
+class StagedPack(NamedTuple):
+    commit: str
+    # how the git mirror was updated, or "" without one (see lib.git_mirror)
+    git_mirror: str
+    # hit, miss or disabled (see lib.venv_cache)
+    virtualenv_cache: str
+
+
+def live_paths(pack_name: str) -> PackPaths:
+    """Where st2 loads the pack and its virtualenv from."""
+    from st2common.content.utils import get_pack_base_path
+    from st2common.util.sandboxing import get_sandbox_virtualenv_path
+
+    return PackPaths(
+        pathlib.Path(get_pack_base_path(pack_name)),
+        pathlib.Path(get_sandbox_virtualenv_path(pack_name)),
+    )
+
+
+def staged_paths(pack_name: str) -> PackPaths:
+    live = live_paths(pack_name)
+    return PackPaths(
+        live.pack_path.parent / STAGING_DIR / pack_name,
+        live.virtualenv_path.parent / STAGING_DIR / pack_name,
+    )
+
+
+def stage(
+    pack_name: str,
+    git_url: str,
+    git_ref: str,
+    logger,
+    venv_cache: Optional[VirtualenvCache] = None,
+    wheelhouse: Optional[str] = None,
+    mirror: Optional[GitMirror] = None,
+) -> StagedPack:
+    """Clone git_ref, validate it and build (or restore) its virtualenv."""
+    live = live_paths(pack_name)
+    staged = staged_paths(pack_name)
+    for path in staged:
+        _remove(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    commit, mirror_status = clone(
+        git_url, git_ref, staged.pack_path, reference=live.pack_path, mirror=mirror
+    )
+    logger.info(f"Staged {pack_name} at {commit} in {staged.pack_path}")
+
+    errors = validate(pack_name, staged.pack_path)
+    if errors:
+        raise StagingError(
+            f"Invalid metadata in {pack_name} at {commit}: " + "; ".join(errors)
+        )
+    dependencies = pack_dependencies(staged.pack_path)
+    if dependencies != pack_dependencies(live.pack_path):
+        raise StagingError(
+            f"The dependencies of {pack_name} at {commit} ({dependencies}) differ "
+            f"from the installed ones. packs.install has to install them."
+        )
+    apply_permissions(staged.pack_path)
+
+    cache_status = build_virtualenv(
+        pack_name,
+        staged.pack_path,
+        staged.virtualenv_path,
+        live.virtualenv_path,
+        logger,
+        venv_cache=venv_cache,
+        wheelhouse=wheelhouse,
+    )
+    return StagedPack(commit, mirror_status, cache_status)
+
+
+def clone(
+    git_url: str,
+    git_ref: str,
+    path: pathlib.Path,
+    reference: pathlib.Path,
+    mirror: Optional[GitMirror] = None,
+) -> Tuple[str, str]:
+    """Clone git_url into path with git_ref checked out.
+
+    With a mirror, only new objects are fetched from git_url. Otherwise objects
+    already in the installed pack's repo (reference) are copied from there
+    instead of being downloaded again.
+    Return the commit hash and how the mirror was updated.
+    """
+    mirror_status = ""
+    if mirror is not None:
+        mirror_status = mirror.clone(git_url, git_ref, path)
+    else:
+        args = ["clone", "--quiet", "--no-checkout"]
+        if find_git_dir(reference) is not None:
+            args += ["--reference-if-able", str(reference), "--dissociate"]
+        git(*args, git_url, str(path))
+    commit = _resolve(path, git_ref)
+    git("checkout", "--quiet", "--detach", commit, cwd=str(path))
+    return commit, mirror_status
+
+
+def _resolve(path: pathlib.Path, git_ref: str) -> str:
+    # branches only exist as remote-tracking branches after a clone
+    for ref in (f"origin/{git_ref}", git_ref):
+        try:
+            return git("rev-parse", "--verify", f"{ref}^{{commit}}", cwd=str(path))
+        except GitError:
+            continue
+    raise StagingError(f"{git_ref} is not a branch, tag or commit in {path}")
+
+
+def pack_dependencies(pack_path: pathlib.Path) -> List[str]:
+    """The dependencies in pack.yaml (none if the pack is not installed)."""
+    metadata = _load_yaml(pack_path / "pack.yaml")
+    if not isinstance(metadata, dict):
+        return []
+    return [str(dependency) for dependency in metadata.get("dependencies") or []]
+
+
+def apply_permissions(pack_path: pathlib.Path) -> None:
+    """Give the pack the st2 pack group and permissions, like packs.install does."""
+    from st2common.util.pack_management import (
+        apply_pack_owner_group,
+        apply_pack_permissions,
+    )
+
+    apply_pack_owner_group(pack_path=str(pack_path))
+    apply_pack_permissions(pack_path=str(pack_path))
+
+
+def validate(pack_name: str, pack_path: pathlib.Path) -> List[str]:
+    """Check the metadata like packs.register would. Return the errors found."""
+    import importlib
+
+    metadata = _load_yaml(pack_path / "pack.yaml")
+    if not isinstance(metadata, dict):
+        return ["pack.yaml is missing or is not a mapping"]
+    if metadata.get("ref", metadata.get("name")) != pack_name:
+        return [f"pack.yaml is for pack {metadata.get('ref', metadata.get('name'))}"]
+
+    errors = []
+    for directory, (module_name, model_name) in CONTENT_MODELS.items():
+        model = getattr(importlib.import_module(module_name), model_name)
+        for path in sorted((pack_path / directory).glob("*.y*ml")):
+            relative_path = path.relative_to(pack_path)
+            try:
+                content = _load_yaml(path, raise_errors=True)
+                if not isinstance(content, dict):
+                    raise ValueError("not a mapping")
+                content.setdefault("pack", pack_name)
+                model(**content).validate()
+            except Exception as exc:
+                errors.append(f"{relative_path}: {exc}")
+                continue
+            entry_point = content.get("entry_point")
+            if entry_point and not (path.parent / entry_point).is_file():
+                errors.append(f"{relative_path}: entry_point {entry_point} not found")
+    return errors
+
+
+def build_virtualenv(
+    pack_name: str,
+    pack_path: pathlib.Path,
+    virtualenv_path: pathlib.Path,
+    final_path: pathlib.Path,
+    logger,
+    venv_cache: Optional[VirtualenvCache] = None,
+    wheelhouse: Optional[str] = None,
+) -> str:
+    """Create the virtualenv like st2 does and install the pack's requirements.txt.
+
+    virtualenv_path is moved to final_path later. With venv_cache, an identical
+    virtualenv built before is restored instead. Return hit, miss or disabled.
+    With wheelhouse, requirements are only installed from that directory.
+    """
+    from st2common.config import cfg
+
+    runner = cfg.CONF.actionrunner
+    requirements = pack_path / "requirements.txt"
+    key = None
+    if venv_cache is not None and venv_cache.enabled:
+        python_version = _run(
+            [runner.python_binary, "-c", "import sys; print(sys.version)"]
+        )
+        key = VirtualenvCache.key(
+            pack_name,
+            python_version,
+            list(runner.virtualenv_opts),
+            requirements,
+            wheelhouse=wheelhouse,
+        )
+        if venv_cache.restore(key, virtualenv_path):
+            logger.info(f"Restored the virtualenv of {pack_name} from the cache")
+            return HIT
+
+    _run(
+        [
+            runner.virtualenv_binary,
+            "-p",
+            runner.python_binary,
+            *runner.virtualenv_opts,
+            str(virtualenv_path),
+        ]
+    )
+    if requirements.is_file():
+        logger.info(f"Installing {requirements} in {virtualenv_path}")
+        pip_args = ["--no-index", "--find-links", wheelhouse] if wheelhouse else []
+        _run(
+            [
+                str(virtualenv_path / "bin" / "pip"),
+                "install",
+                *pip_args,
+                "-r",
+                str(requirements),
+            ],
+            timeout=PIP_TIMEOUT,
+        )
+    # pip writes the virtualenv path into the scripts it installs.
+    _relocate_scripts(virtualenv_path, final_path)
+
+    if key is None:
+        return DISABLED
+    venv_cache.save(key, virtualenv_path)
+    return MISS
+
+
+def previous_paths(pack_name: str) -> PackPaths:
+    """Where activate() keeps the replaced pack and virtualenv for rollback()."""
+    staged = staged_paths(pack_name)
+    return PackPaths(
+        staged.pack_path.with_name(f"{pack_name}.previous"),
+        staged.virtualenv_path.with_name(f"{pack_name}.previous"),
+    )
+
+
+def activate(pack_name: str, commit: Optional[str], logger) -> None:
+    """Swap the staged pack and virtualenv in place of the installed ones.
+
+    The installed ones are kept in previous_paths() until discard().
+    """
+    live = live_paths(pack_name)
+    staged = staged_paths(pack_name)
+    previous = previous_paths(pack_name)
+    for path in staged:
+        if not path.is_dir():
+            raise StagingError(f"{pack_name} is not staged ({path} is missing)")
+    staged_commit = _head(staged.pack_path)
+    if commit and staged_commit != commit:
+        raise StagingError(
+            f"{staged.pack_path} has {staged_commit} staged instead of {commit}"
+        )
+
+    # the pack last, so that a failed swap leaves the installed pack untouched
+    for staged_path, live_path, previous_path in (
+        (staged.virtualenv_path, live.virtualenv_path, previous.virtualenv_path),
+        (staged.pack_path, live.pack_path, previous.pack_path),
+    ):
+        _remove(previous_path)
+        _swap(staged_path, live_path, previous_path)
+        logger.info(f"Moved {staged_path} to {live_path}")
+
+
+def rollback(pack_name: str, commit: str, logger) -> None:
+    """Put back the pack and virtualenv that activate() replaced.
+
+    commit is the commit that was installed before. Rolling back needs neither
+    git nor PyPI, only renames.
+    """
+    live = live_paths(pack_name)
+    staged = staged_paths(pack_name)
+    previous = previous_paths(pack_name)
+    if not any(path.is_dir() for path in previous):
+        raise StagingError(f"Nothing is kept to roll {pack_name} back to")
+    # activate() moves the pack last, so it may still be the installed one.
+    pack_path = previous.pack_path if previous.pack_path.is_dir() else live.pack_path
+    if not commit or _head(pack_path) != commit:
+        raise StagingError(f"{commit or 'No commit'} is not kept for {pack_name}")
+
+    for previous_path, live_path, staged_path in (
+        (previous.pack_path, live.pack_path, staged.pack_path),
+        (previous.virtualenv_path, live.virtualenv_path, staged.virtualenv_path),
+    ):
+        if not previous_path.is_dir():
+            continue
+        # the failed revision takes the place of the staged one, until discard()
+        _remove(staged_path)
+        _swap(previous_path, live_path, staged_path)
+        logger.info(f"Moved {previous_path} back to {live_path}")
+
+
+def discard(pack_name: str) -> None:
+    """Remove the staged and the previous pack and virtualenv."""
+    for path in (*staged_paths(pack_name), *previous_paths(pack_name)):
+        _remove(path)
+
+
+def _head(pack_path: pathlib.Path) -> Optional[str]:
+    git_dir = find_git_dir(pack_path)
+    return read_head(git_dir)[1] if git_dir is not None else None
+
+
+def _swap(
+    new_path: pathlib.Path, live_path: pathlib.Path, old_path: pathlib.Path
+) -> None:
+    """Move new_path to live_path, and what was at live_path to old_path.
+
+    On Linux both happen in one renameat2(RENAME_EXCHANGE) call, so live_path
+    never disappears, even for a moment.
+    """
+    if live_path.exists() and _exchange(new_path, live_path):
+        os.rename(str(new_path), str(old_path))
+        return
+    if live_path.exists():
+        os.rename(str(live_path), str(old_path))
+    os.rename(str(new_path), str(live_path))
+
+
+def _exchange(path_a: pathlib.Path, path_b: pathlib.Path) -> bool:
+    """Atomically exchange two paths. Return False where that is not supported."""
+    renameat2 = getattr(_libc(), "renameat2", None)
+    if renameat2 is None:
+        return False
+    result = renameat2(
+        AT_FDCWD,
+        os.fsencode(str(path_a)),
+        AT_FDCWD,
+        os.fsencode(str(path_b)),
+        RENAME_EXCHANGE,
+    )
+    if result == 0:
+        return True
+    errno = ctypes.get_errno()
+    if errno in (EINVAL, ENOSYS):
+        # eg a filesystem without RENAME_EXCHANGE
+        return False
+    raise OSError(errno, os.strerror(errno), str(path_a), None, str(path_b))
+
+
+@functools.lru_cache(maxsize=None)
+def _libc():
+    # renameat2 is in glibc since 2.28
+    return ctypes.CDLL(None, use_errno=True)
+
+
+def _relocate_scripts(virtualenv_path: pathlib.Path, final_path: pathlib.Path) -> None:
+    old, new = os.fsencode(str(virtualenv_path)), os.fsencode(str(final_path))
+    for script in (virtualenv_path / "bin").iterdir():
+        if script.is_symlink() or not script.is_file():
+            continue
+        content = script.read_bytes()
+        if old in content and b"\0" not in content:
+            script.write_bytes(content.replace(old, new))
+
+
+def _remove(path: pathlib.Path) -> None:
+    if path.is_symlink() or path.is_file():
+        path.unlink()
+    elif path.exists():
+        shutil.rmtree(str(path))
+
+
+def _load_yaml(path: pathlib.Path, raise_errors=False):
+    try:
+        with path.open("r") as f:
+            return yaml.safe_load(f)
+    except (OSError, yaml.YAMLError):
+        if raise_errors:
+            raise
+        return None
+
+
+def _run(args: List[str], timeout: float = 300) -> str:
+    try:
+        completed = subprocess.run(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            timeout=timeout,
+        )
+    except (OSError, subprocess.TimeoutExpired) as exc:
+        raise StagingError(f"{' '.join(args)} failed: {exc}") from exc
+    if completed.returncode != 0:
+        raise StagingError(
+            f"{' '.join(args)} failed with exit code {completed.returncode}: "
+            f"{completed.stdout.strip()[-2000:]}"
+        )
+    return completed.stdout.strip()
@@ -0,0 +1,166 @@
+"""Reuse pack virtualenvs between deploys when the requirements did not change."""
+import hashlib
+import os
+import pathlib
+import re
+import shutil
+
+from typing import Iterator, List, Optional, Set
+
+from lib.cache import get_cache_dir
+
+
+# default for the virtualenv_cache_size_mb setting in config.schema.yaml: the cache
+# is opt-in, as the default cache_dir is in the temp directory (often a tmpfs)
+DEFAULT_VIRTUALENV_CACHE_SIZE_MB = 0
+
+HIT = "hit"
+MISS = "miss"
+DISABLED = "disabled"
+# -r/--requirement and -c/--constraint lines of a requirements file
+INCLUDE_PATTERN = re.compile(r"^(?:-[rc]\s*|--(?:requirement|constraint)[=\s]\s*)(\S+)")
+
+
+class VirtualenvCache:
+    """Virtualenvs stored by a hash of everything that goes into building them.
+
+    The key covers the pack name (scripts in a virtualenv contain its path),
+    the python version, the virtualenv options, requirements.txt with the files
+    it includes (-r and -c) and the pip wheelhouse with the wheels in it, so a
+    hit is the environment that building it again would produce.
+
+    Entries are restored with hardlinks, or copied when the cache is on another
+    filesystem than the virtualenvs. Files in a restored virtualenv may be shared
+    with the cache, so they must be replaced rather than modified in place.
+    The least recently used entries are evicted once the cache is larger than
+    max_bytes.
+    """
+
+    def __init__(self, logger, cache_dir: Optional[pathlib.Path], max_bytes: int):
+        self.logger = logger
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(cls, config, logger) -> "VirtualenvCache":
+        config = config or {}
+        size_mb = config.get(
+            "virtualenv_cache_size_mb", DEFAULT_VIRTUALENV_CACHE_SIZE_MB
+        )
+        return cls(
+            logger,
+            cache_dir=get_cache_dir(config, "virtualenvs") if size_mb else None,
+            max_bytes=size_mb * 1024 * 1024,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache_dir is not None
+
+    @staticmethod
+    def key(
+        pack_name: str,
+        python_version: str,
+        virtualenv_opts: List[str],
+        requirements: pathlib.Path,
+        wheelhouse: Optional[str] = None,
+    ) -> str:
+        digest = hashlib.sha256()
+        for part in (pack_name, python_version, " ".join(virtualenv_opts)):
+            digest.update(part.encode() + b"\0")
+        # the include lines are part of the content, so the paths need no hashing
+        for path in _requirement_files(requirements, seen=set()):
+            digest.update(path.read_bytes() + b"\0")
+        if wheelhouse:
+            digest.update(b"wheelhouse\0" + wheelhouse.encode() + b"\0")
+            try:
+                wheels = sorted(os.listdir(wheelhouse))
+            except OSError:
+                wheels = []
+            digest.update("\0".join(wheels).encode())
+        return digest.hexdigest()
+
+    def restore(self, key: str, virtualenv_path: pathlib.Path) -> bool:
+        """Copy the cached virtualenv to virtualenv_path. Return False on a miss."""
+        if not self.enabled:
+            return False
+        entry = self.cache_dir / key
+        if not entry.is_dir():
+            return False
+        try:
+            _copy_tree(entry, virtualenv_path)
+        except OSError as exc:
+            self.logger.warning(f"Could not restore the cached virtualenv {key}: {exc}")
+            shutil.rmtree(str(virtualenv_path), ignore_errors=True)
+            return False
+        # the mtime of an entry records when it was last used
+        os.utime(str(entry))
+        return True
+
+    def save(self, key: str, virtualenv_path: pathlib.Path) -> None:
+        """Add a freshly built virtualenv, then evict entries over the size cap."""
+        if not self.enabled:
+            return
+        entry = self.cache_dir / key
+        partial = self.cache_dir / f".{key}.{os.getpid()}"
+        try:
+            _copy_tree(virtualenv_path, partial)
+            # another deploy may have added the same entry meanwhile
+            if not entry.exists():
+                os.rename(str(partial), str(entry))
+                os.utime(str(entry))
+        except OSError as exc:
+            self.logger.warning(f"Could not cache the virtualenv {key}: {exc}")
+        finally:
+            shutil.rmtree(str(partial), ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for entry in self.cache_dir.iterdir():
+            if entry.is_dir() and not entry.name.startswith("."):
+                entries.append((entry.stat().st_mtime, _tree_size(entry), entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.logger.info(f"Evicting the cached virtualenv {entry.name}")
+            shutil.rmtree(str(entry), ignore_errors=True)
+            total -= size
+
+
+def _requirement_files(
+    path: pathlib.Path, seen: Set[pathlib.Path]
+) -> Iterator[pathlib.Path]:
+    """path, then the files it includes with -r or -c (relative to it), in order."""
+    path = path.resolve()
+    if path in seen or not path.is_file():
+        return
+    seen.add(path)
+    yield path
+    for line in path.read_text(errors="replace").splitlines():
+        match = INCLUDE_PATTERN.match(line.strip())
+        if match:
+            yield from _requirement_files(path.parent / match.group(1), seen)
+
+
+def _copy_tree(source: pathlib.Path, destination: pathlib.Path) -> None:
+    try:
+        shutil.copytree(
+            str(source), str(destination), symlinks=True, copy_function=os.link
+        )
+    except OSError:
+        # eg EXDEV when the cache is on another filesystem
+        shutil.rmtree(str(destination), ignore_errors=True)
+        shutil.copytree(str(source), str(destination), symlinks=True)
+
+
+def _tree_size(path: pathlib.Path) -> int:
+    size = 0
+    for directory, _, files in os.walk(str(path)):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                continue
+    return size
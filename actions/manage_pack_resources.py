@@ -1,7 +1,7 @@
 import pathlib
 
 from collections import defaultdict
-from typing import DefaultDict, Dict, Tuple, TYPE_CHECKING, Union
+from typing import Any, DefaultDict, Dict, Tuple, TYPE_CHECKING, Union
 from urllib.parse import urlparse
 
 import yaml
@@ -9,10 +9,16 @@ import yaml
 if TYPE_CHECKING:
     from python_runner.python_action_wrapper import ActionService
 
-from st2client.client import Client
 from st2common.config import cfg
 from st2common.runners.base_action import Action
 
+from lib.client import get_client
+from lib.concurrency import DEFAULT_PARALLELISM, DEFAULT_RETRIES, run_parallel
+from lib.metrics import Metrics
+from lib.pack_resolver import PackResolver
+from lib.plan import PlanError, check_plan, new_plan, pack_fingerprint
+from lib.results import FULL, STREAM, SUMMARY, write_result_file
+
 
 # These are known resources that we can enable/disable
 # key is resource_type in pack_resources.yaml
@@ -26,6 +32,8 @@ RESOURCE_TYPES_MAP = {
     "aliases": "ActionAlias",
 }
 
+RESOURCES_FILE = "pack_resources.yaml"
+
 
 class ManagePackResources(Action):
 
@@ -36,20 +44,84 @@ class ManagePackResources(Action):
         super().__init__(config, action_service)
         webui_base_url = urlparse(cfg.CONF.webui.webui_base_url)
         self.webui_base_domain: str = webui_base_url.hostname
-        self.client = Client()
+        self.metrics = Metrics("manage_pack_resources")
+        self.client = get_client(self.config, metrics=self.metrics)
         self.check_mode = False
+        self.parallelism = DEFAULT_PARALLELISM
+        # filled in by check_mode, see lib.plan
+        self.plan = new_plan("manage_pack_resources")
 
-    def run(self, from_packs: list = None, check_mode=False):
+    def run(
+        self,
+        from_packs: list = None,
+        check_mode=False,
+        parallelism=DEFAULT_PARALLELISM,
+        plan: dict = None,
+        result_mode: str = FULL,
+    ):
         self.check_mode = check_mode
+        self.parallelism = parallelism
 
-        if len(from_packs) == 1:
-            packs = {from_packs[0]: self.client.packs.get_by_ref_or_id(from_packs[0])}
-        else:
-            packs = {p.ref: p for p in self.client.packs.get_all()}
+        planned_packs = {}
+        if plan:
+            try:
+                if check_mode:
+                    raise PlanError("A plan cannot be applied in check_mode")
+                planned_packs = check_plan(plan, "manage_pack_resources")
+            except PlanError as exc:
+                self.logger.error(f"Cannot apply the plan: {exc}")
+                return {
+                    "success": False,
+                    "error_message": str(exc),
+                    "packs": {},
+                    "packs_not_installed": [],
+                    "metrics": self.metrics.finish(self.config, self.logger),
+                }
+        from_packs = list(from_packs or planned_packs)
+
+        # Only the planned operations of packs that did not change since the plan
+        # was made are applied. Everything else is looked up from scratch.
+        with self.metrics.span("check_plan"):
+            fresh = self._fresh_packs(planned_packs, from_packs)
+        # packs that were not installed when the plan was made are not stale, just new
+        stale_packs = [
+            name
+            for name in from_packs
+            if planned_packs.get(name, {}).get("path") and name not in fresh
+        ]
+        for pack_name in stale_packs:
+            self.logger.warning(
+                f"Pack {pack_name} changed since the plan was made. Looking it up again."
+            )
+
+        resolver = PackResolver.from_config(
+            self.client, self.config, self.logger, parallelism=parallelism
+        )
+        with self.metrics.span("resolve_packs"):
+            packs = resolver.resolve(
+                [pack_name for pack_name in from_packs if pack_name not in fresh]
+            )
 
         results = {}
+        not_installed = []
         for pack_name in from_packs:
+            if pack_name in fresh:
+                results[pack_name] = self.apply_planned_resources(
+                    pack_name, fresh[pack_name]
+                )
+                continue
             pack = packs[pack_name]
+            if pack is None:
+                self.logger.info(f"Pack {pack_name} is not installed. Skipping it.")
+                not_installed.append(pack_name)
+                results[pack_name] = {}
+                if self.check_mode:
+                    self.plan["packs"][pack_name] = {
+                        "path": None,
+                        "fingerprint": None,
+                        "operations": [],
+                    }
+                continue
             results[pack_name] = self.resources_in_pack(pack_name, pack)
 
         success = all(
@@ -59,7 +131,79 @@ class ManagePackResources(Action):
             for result in resource_results.values()
         )
 
-        return {"success": success, "packs": results}
+        output = {"success": success, "packs_not_installed": not_installed}
+        if result_mode == FULL:
+            output["packs"] = results
+        else:
+            output["counts"] = {
+                pack_name: self._count_results(pack_results)
+                for pack_name, pack_results in results.items()
+            }
+        if result_mode == SUMMARY:
+            output["packs"] = {
+                pack_name: self._changed_or_failed(pack_results)
+                for pack_name, pack_results in results.items()
+            }
+        elif result_mode == STREAM:
+            with self.metrics.span("write_result_file"):
+                output["result_file"] = write_result_file(
+                    self.config,
+                    "manage_pack_resources",
+                    (
+                        dict(
+                            result,
+                            pack=pack_name,
+                            resource_type=resource_type,
+                            resource=resource_name,
+                        )
+                        for pack_name, pack_results in results.items()
+                        for resource_type, resource_results in pack_results.items()
+                        for resource_name, result in resource_results.items()
+                    ),
+                )
+        if self.check_mode:
+            output["plan"] = self.plan
+        if plan:
+            output["stale_packs"] = stale_packs
+        output["metrics"] = self.metrics.finish(self.config, self.logger)
+        return output
+
+    @staticmethod
+    def _count_results(pack_results) -> Dict[str, int]:
+        counts = {"resources": 0, "changed": 0, "noop": 0, "failed": 0}
+        for resource_results in pack_results.values():
+            for result in resource_results.values():
+                counts["resources"] += 1
+                if result["want_enabled"] != result["enabled_after"]:
+                    counts["failed"] += 1
+                elif result["noop"]:
+                    counts["noop"] += 1
+                else:
+                    counts["changed"] += 1
+        return counts
+
+    @staticmethod
+    def _changed_or_failed(pack_results) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        changed: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for resource_type, resource_results in pack_results.items():
+            for resource_name, result in resource_results.items():
+                if not result["noop"]:
+                    changed.setdefault(resource_type, {})[resource_name] = result
+        return changed
+
+    def _fresh_packs(
+        self, planned_packs: Dict[str, Dict[str, Any]], pack_names
+    ) -> Dict[str, Dict[str, Any]]:
+        fresh = {}
+        for pack_name in pack_names:
+            planned = planned_packs.get(pack_name)
+            # packs that were not installed when the plan was made have no path
+            if not planned or not planned.get("path"):
+                continue
+            pack_path = pathlib.Path(planned["path"])
+            if pack_fingerprint(pack_path, RESOURCES_FILE) == planned["fingerprint"]:
+                fresh[pack_name] = planned
+        return fresh
 
     def resources_in_pack(
         self, pack_name, pack
@@ -72,7 +216,14 @@ class ManagePackResources(Action):
         # }}
 
         pack_path = pathlib.Path(pack.path)
-        resources_file_path = pack_path / "pack_resources.yaml"
+        operations = []
+        if self.check_mode:
+            self.plan["packs"][pack_name] = {
+                "path": str(pack_path),
+                "fingerprint": pack_fingerprint(pack_path, RESOURCES_FILE),
+                "operations": operations,
+            }
+        resources_file_path = pack_path / RESOURCES_FILE
         if not resources_file_path.exists():
             return results
 
@@ -80,13 +231,13 @@ class ManagePackResources(Action):
             all_resources = yaml.safe_load(resources_file)
         resources = all_resources.get(self.webui_base_domain, {})
 
+        # {resource_type: {resource_name: name without the pack prefix}}
+        wanted: DefaultDict[str, Dict[str, str]] = defaultdict(dict)
         for resource_type, resource_list in resources.items():
+            if resource_type not in RESOURCE_TYPES_MAP:
+                # ignore unknown resource_type
+                continue
             for resource_name in resource_list:
-                client_resource_type = RESOURCE_TYPES_MAP.get(resource_type)
-                if not client_resource_type:
-                    # ignore unknown resource_type
-                    continue
-
                 # we support <pack>.<resource> and just <resource>
                 pack_prefix = f"{pack_name}."
                 pack_prefix_len = len(pack_prefix)
@@ -98,42 +249,126 @@ class ManagePackResources(Action):
 
                 # TODO: handle ^resource_name where ^ means enabled=False
 
-                result = self.manage_resource(
-                    resource_type=client_resource_type,
-                    name=name,
+                wanted[resource_type][resource_name] = name
+
+        for resource_type, names in wanted.items():
+            with self.metrics.span("reconcile_resources"):
+                results[resource_type] = self.reconcile_resources(
+                    resource_type=RESOURCE_TYPES_MAP[resource_type],
+                    names=names,
                     pack=pack_name,
                     enabled=True,
                 )
-                results[resource_type][resource_name] = result
+            for resource_name, result in results[resource_type].items():
+                if result["noop"]:
+                    continue
+                missing = bool(result["error_message"])
+                operations.append(
+                    {
+                        "op": "update",
+                        "resource_type": resource_type,
+                        "resource": resource_name,
+                        "ref": f"{pack_name}.{names[resource_name]}",
+                        # None when the resource could not be found
+                        "current": None
+                        if missing
+                        else {"enabled": result["enabled_before"]},
+                        "desired": {"enabled": result["want_enabled"]},
+                    }
+                )
         return results
 
-    def manage_resource(
-        self, resource_type: str, name: str, pack: str, enabled: bool
-    ) -> Dict[str, Union[bool, str]]:
+    def apply_planned_resources(
+        self, pack_name, planned: Dict[str, Any]
+    ) -> Dict[str, Dict[str, Dict[str, Union[bool, str]]]]:
+        """Run the operations planned for a pack in check_mode.
+
+        pack_resources.yaml is not read again, and resource types without planned
+        operations are not even listed. Resources that already reached their
+        desired state since the plan was made are left alone (noop).
+        """
+        results: DefaultDict[str, Dict[str, Dict[str, Union[bool, str]]]] = defaultdict(
+            dict
+        )
+        # {(resource_type, enabled): {resource_name: name without the pack prefix}}
+        wanted: DefaultDict[Tuple[str, bool], Dict[str, str]] = defaultdict(dict)
+        for operation in planned["operations"]:
+            key = (operation["resource_type"], operation["desired"]["enabled"])
+            name = operation["ref"][len(pack_name) + 1 :]
+            wanted[key][operation["resource"]] = name
+
+        for (resource_type, enabled), names in wanted.items():
+            with self.metrics.span("reconcile_resources"):
+                results[resource_type].update(
+                    self.reconcile_resources(
+                        resource_type=RESOURCE_TYPES_MAP[resource_type],
+                        names=names,
+                        pack=pack_name,
+                        enabled=enabled,
+                    )
+                )
+        return results
+
+    def reconcile_resources(
+        self, resource_type: str, names: Dict[str, str], pack: str, enabled: bool
+    ) -> Dict[str, Dict[str, Union[bool, str]]]:
+        """Make sure that the named resources of one type have enabled=enabled.
+
+        All resources of the type are fetched with one request, and only the ones
+        that are not in the desired state yet get updated (concurrently).
+        names maps the resource name used in the results to the resource name in st2.
+        """
         # we use self.client.managers instead of self.client.<resource type> because
         # not all resources are available as properties on the client.
-        resource = self.client.managers[resource_type].get_by_name(name=name, pack=pack)
-        enabled_before = getattr(resource, "enabled", False)
-        result = {
-            "want_enabled": enabled,
-            "enabled_before": enabled_before,
-            "enabled_after": None,
-            "error_message": "",
-        }
+        manager = self.client.managers[resource_type]
+        existing = {resource.name: resource for resource in manager.get_all(pack=pack)}
 
-        if self.check_mode:
-            result["enabled_after"] = enabled
-            return result
-
-        try:
-            resource.enabled = result["enabled_after"] = enabled
-            self.client.managers[resource_type].update(resource)
-        except Exception as exc:
-            result["enabled_after"] = enabled_before
-            result[
-                "error_message"
-            ] = f"Could not update {resource_type} {pack}.{name}: {exc}"
-        return result
+        results: Dict[str, Dict[str, Union[bool, str]]] = {}
+        to_update = {}
+        for resource_name, name in names.items():
+            resource = existing.get(name)
+            if resource is None:
+                # The listing may have been limited to one page. Look it up directly.
+                resource = manager.get_by_name(name=name, pack=pack)
+            enabled_before = getattr(resource, "enabled", False)
+            result = results[resource_name] = {
+                "want_enabled": enabled,
+                "enabled_before": enabled_before,
+                "enabled_after": enabled_before,
+                "noop": enabled_before == enabled,
+                "error_message": "",
+            }
+            if resource is None:
+                result["noop"] = False
+                result["error_message"] = f"Could not find {resource_type} {pack}.{name}"
+            elif result["noop"]:
+                pass
+            elif self.check_mode:
+                result["enabled_after"] = enabled
+            else:
+                to_update[resource_name] = resource
+
+        def update(item: Tuple[str, object]):
+            _, resource = item
+            resource.enabled = enabled
+            return manager.update(resource)
+
+        outcomes = run_parallel(
+            update,
+            to_update.items(),
+            key=lambda item: item[0],
+            parallelism=self.parallelism,
+            retries=DEFAULT_RETRIES,
+        )
+        for resource_name, outcome in outcomes.items():
+            result = results[resource_name]
+            if outcome.ok:
+                result["enabled_after"] = enabled
+            else:
+                result[
+                    "error_message"
+                ] = f"Could not update {resource_type} {pack}.{names[resource_name]}: {outcome.error}"
+        return results
 
 
 if __name__ == "__main__":
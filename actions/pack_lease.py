@@ -0,0 +1,51 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from python_runner.python_action_wrapper import ActionService
+    from logging import Logger
+
+from st2common.runners.base_action import Action
+
+from lib.client import get_client
+from lib.lease import PackLeases
+from lib.metrics import Metrics
+
+
+class PackLease(Action):
+
+    if TYPE_CHECKING:
+        action_service: ActionService
+        logger: Logger
+
+    def run(self, packs: list = None, action: str = None, owner: str = None):
+        metrics = Metrics("pack_lease")
+        client = get_client(self.config, metrics=metrics)
+        leases = PackLeases.from_config(client, self.config, owner)
+        result = {"packs": packs, "lease_errors": {}}
+
+        if action == "acquire":
+            with metrics.span("acquire"):
+                lease_errors = leases.acquire_all(packs)
+            if lease_errors:
+                for pack_name, error in lease_errors.items():
+                    self.logger.error(error)
+                # all or nothing, so that two deploys of overlapping packs
+                # do not each end up with some of them.
+                with metrics.span("release"):
+                    for pack_name in packs:
+                        if pack_name not in lease_errors:
+                            leases.release(pack_name)
+                result["lease_errors"] = lease_errors
+                result["metrics"] = metrics.finish(self.config, self.logger)
+                return False, result
+        elif action == "release":
+            with metrics.span("release"):
+                for pack_name in packs:
+                    leases.release(pack_name)
+        else:
+            self.logger.error(f"Unknown action: {action}")
+            result["metrics"] = metrics.finish(self.config, self.logger)
+            return False, result
+
+        result["metrics"] = metrics.finish(self.config, self.logger)
+        return True, result
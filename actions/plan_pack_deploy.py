@@ -0,0 +1,161 @@
+import pathlib
+
+from typing import Dict, List, Tuple, TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    from python_runner.python_action_wrapper import ActionService
+    from logging import Logger
+
+from st2common.content.utils import get_pack_base_path
+from st2common.runners.base_action import Action
+
+from lib.git import GitError, git
+from lib.gitdir import find_git_dir, is_dirty, read_head
+from lib.metrics import Metrics
+
+
+# Changes in these directories only need the content to be registered again.
+# key is the directory in the pack, value is the content type for packs.register
+REGISTER_DIRS = {
+    "rules/": "rules",
+    "aliases/": "aliases",
+    "policies/": "policies",
+}
+# Changes to these files are applied by st2gitops.manage_pack_resources
+# which always runs at the end of a deploy.
+RESOURCE_FILES = ["pack_resources.yaml"]
+# Changes to these files do not affect anything StackStorm registers or runs.
+IGNORED_PREFIXES = ["README", "CHANGELOG", "LICENSE", ".github/", "tests/"]
+# git diff --name-status letters of deleted and renamed files. packs.register does
+# not unregister content that is gone, only packs.unload does.
+REMOVED_STATUSES = ("D", "R")
+
+
+class PlanPackDeploy(Action):
+
+    if TYPE_CHECKING:
+        action_service: ActionService
+        logger: Logger
+
+    def run(
+        self,
+        pack: str = None,
+        ssh_git_url: str = None,
+        git_ref: str = None,
+        old_git_ref: str = "",
+    ):
+        self.metrics = Metrics("plan_pack_deploy")
+        plan = self.plan(pack, ssh_git_url, git_ref, old_git_ref)
+        plan["metrics"] = self.metrics.finish(self.config, self.logger)
+        return plan
+
+    def plan(self, pack, ssh_git_url, git_ref, old_git_ref) -> dict:
+        plan = {
+            "mode": "full",
+            "reason": "",
+            "target_commit": "",
+            "old_git_ref": old_git_ref,
+            "changed_files": [],
+            "register_types": [],
+        }
+
+        pack_path = pathlib.Path(get_pack_base_path(pack))
+        git_dir = find_git_dir(pack_path)
+        if not old_git_ref or git_dir is None:
+            plan["reason"] = f"Pack {pack} is not installed from git"
+            return plan
+        with self.metrics.span("check_installed"):
+            installed = read_head(git_dir)[1] == old_git_ref and not is_dirty(
+                pack_path, git_dir
+            )
+        if not installed:
+            plan["reason"] = (
+                f"Pack {pack} in {pack_path} is not a clean checkout of {old_git_ref}"
+            )
+            return plan
+
+        try:
+            with self.metrics.span("fetch_target"):
+                target_commit = self.resolve_target_commit(
+                    pack_path, ssh_git_url, git_ref
+                )
+            plan["target_commit"] = target_commit
+            if target_commit == old_git_ref:
+                plan["mode"] = "skip"
+                plan["reason"] = f"{git_ref} is already installed ({target_commit})"
+                return plan
+            with self.metrics.span("diff"):
+                changes = parse_name_status(
+                    git(
+                        "diff",
+                        "--name-status",
+                        old_git_ref,
+                        target_commit,
+                        cwd=str(pack_path),
+                    )
+                )
+        except GitError as exc:
+            plan["reason"] = str(exc)
+            return plan
+        plan["changed_files"] = [path for _, path in changes]
+
+        register_types = self.classify_changes(changes)
+        if register_types is None:
+            plan["reason"] = "Changes need a full install"
+            return plan
+
+        plan["mode"] = "register"
+        plan["register_types"] = register_types
+        plan["reason"] = "Only registrable metadata changed"
+        return plan
+
+    def resolve_target_commit(
+        self, pack_path: pathlib.Path, ssh_git_url, git_ref
+    ) -> str:
+        """Fetch git_ref into the installed pack's repo and return its commit hash."""
+        try:
+            git("fetch", "--quiet", ssh_git_url, git_ref, cwd=str(pack_path))
+            ref = "FETCH_HEAD"
+        except GitError as exc:
+            # eg a commit hash that the remote does not allow fetching directly
+            self.logger.debug(
+                f"Could not fetch {git_ref}, looking for it locally: {exc}"
+            )
+            ref = git_ref
+        return git("rev-parse", "--verify", f"{ref}^{{commit}}", cwd=str(pack_path))
+
+    @staticmethod
+    def classify_changes(
+        changes: List[Tuple[str, str]]
+    ) -> Union[List[str], None]:
+        """Return the content types to register, or None if a full install is needed.
+
+        changes are (status, path) pairs (see parse_name_status). Any deleted or
+        renamed file needs a full install, which unloads the old content.
+        """
+        register_types: Dict[str, None] = {}
+        for status, path in changes:
+            if status in REMOVED_STATUSES:
+                return None
+            if path in RESOURCE_FILES or path.startswith(tuple(IGNORED_PREFIXES)):
+                continue
+            for directory, content_type in REGISTER_DIRS.items():
+                if path.startswith(directory):
+                    register_types[content_type] = None
+                    break
+            else:
+                return None
+        return list(register_types)
+
+
+def parse_name_status(output: str) -> List[Tuple[str, str]]:
+    """(status letter, path) for each line of git diff --name-status.
+
+    Renames and copies ("R100\told\tnew") are listed under the new path.
+    """
+    changes = []
+    for line in output.splitlines():
+        fields = line.split("\t")
+        if len(fields) >= 2:
+            changes.append((fields[0][:1], fields[-1]))
+    return changes
@@ -0,0 +1,105 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from python_runner.python_action_wrapper import ActionService
+    from logging import Logger
+
+from st2common.runners.base_action import Action
+
+from lib.client import get_client
+from lib.git import GitError
+from lib.git_mirror import GitMirror
+from lib.lease import LeaseHeld, PackLeases
+from lib.metrics import Metrics
+from lib.staging import (
+    StagingError,
+    activate,
+    discard,
+    rollback,
+    stage,
+    staged_paths,
+)
+from lib.venv_cache import VirtualenvCache
+
+# the actions that undo a deploy, which a lease never blocks
+CLEANUP_ACTIONS = ("rollback", "discard")
+
+
+class StagePack(Action):
+
+    if TYPE_CHECKING:
+        action_service: ActionService
+        logger: Logger
+
+    def run(
+        self,
+        pack: str = None,
+        action: str = None,
+        ssh_git_url: str = None,
+        git_ref: str = None,
+        commit: str = "",
+        lease_owner: str = "",
+    ):
+        metrics = Metrics("stage_pack")
+        result = {"commit": commit}
+        leases = PackLeases.from_config(
+            get_client(self.config, metrics=metrics), self.config, lease_owner
+        )
+        # The staging directories of a pack belong to the deploy that leases it.
+        # Putting the pack back (rollback, discard) is never refused, and only
+        # renews the lease if the owner still holds it.
+        renewed_packs = [pack]
+        if action in CLEANUP_ACTIONS:
+            renewed_packs = leases.held([pack])
+        else:
+            try:
+                leases.acquire(pack)
+            except LeaseHeld as exc:
+                self.logger.error(f"Could not {action} pack {pack}: {exc}")
+                result["error_message"] = str(exc)
+                result["metrics"] = metrics.finish(self.config, self.logger)
+                return False, result
+
+        try:
+            with leases.heartbeat(renewed_packs, self.logger):
+                self._run(pack, action, ssh_git_url, git_ref, commit, metrics, result)
+        except (StagingError, GitError, OSError) as exc:
+            self.logger.error(f"Could not {action} pack {pack}: {exc}")
+            if action == "stage":
+                discard(pack)
+            result["error_message"] = str(exc)
+            result["metrics"] = metrics.finish(self.config, self.logger)
+            return False, result
+
+        result["metrics"] = metrics.finish(self.config, self.logger)
+        return True, result
+
+    def _run(self, pack, action, ssh_git_url, git_ref, commit, metrics, result):
+        if action == "stage":
+            venv_cache = VirtualenvCache.from_config(self.config, self.logger)
+            with metrics.span("stage"):
+                staged = stage(
+                    pack,
+                    ssh_git_url,
+                    git_ref,
+                    self.logger,
+                    venv_cache=venv_cache,
+                    wheelhouse=(self.config or {}).get("pip_wheelhouse"),
+                    mirror=GitMirror.from_config(self.config, self.logger),
+                )
+            result["commit"] = staged.commit
+            result["git_mirror"] = staged.git_mirror
+            result["virtualenv_cache"] = staged.virtualenv_cache
+            paths = staged_paths(pack)
+            result["pack_path"] = str(paths.pack_path)
+            result["virtualenv_path"] = str(paths.virtualenv_path)
+        elif action == "activate":
+            with metrics.span("activate"):
+                activate(pack, commit, self.logger)
+        elif action == "rollback":
+            with metrics.span("rollback"):
+                rollback(pack, commit, self.logger)
+        elif action == "discard":
+            discard(pack)
+        else:
+            raise StagingError(f"Unknown action: {action}")
@@ -1,155 +1,226 @@
 # this is based on an action by @emptywee
 
 from __future__ import (absolute_import, division, print_function)
-from st2client.client import Client
 from st2common.runners.base_action import Action
-from st2client.models import KeyValuePair
-import json
+
+from lib.client import get_client
+from lib.concurrency import DEFAULT_PARALLELISM, DEFAULT_RETRIES, run_parallel
+from lib.datastore import delete_key, load_json, save_json
+from lib.lease import PackLeases
+from lib.metrics import Metrics
 
 __all__ = ["SuspendSt2Rules"]
 
+# Each pack's rule states are saved in DATASTORE_KEY.<pack>, so that deploys of
+# different packs do not share a snapshot. Earlier versions saved the rules of
+# all packs in DATASTORE_KEY itself. That is still read on resume.
 DATASTORE_KEY = 'st2gitops_rules_suspended'
 DATASTORE_KEY_TTL = 1 * 86400  # 1 day
 
 
-class SuspendSt2Rules(Action):
+def snapshot_key(pack):
+    return '{}.{}'.format(DATASTORE_KEY, pack)
 
-    class MissingRuleException(Exception):
-        """Rule raised when attempting to modify a rule that does not exist."""
 
-    def run(self, from_packs=None, action=None):
-        client = Client()
-        if action == 'suspend':
-            res = self.suspend_and_save(client, from_packs)
-        elif action == 'resume':
-            res = self.reinstate_rules(client)
-        else:
-            self.logger.error('Unknown action: {}'.format(action))
-            res = False
+class SuspendSt2Rules(Action):
+
+    parallelism = DEFAULT_PARALLELISM
+
+    def run(self, from_packs=None, action=None, parallelism=DEFAULT_PARALLELISM,
+            lease_owner=''):
+        self.metrics = Metrics('suspend_st2_rules')
+        client = get_client(self.config, metrics=self.metrics)
+        self.parallelism = parallelism
+
+        # The rules of packs that another deploy holds the lease on are not
+        # suspended. Resuming is never refused: it only renews the leases the
+        # owner still holds.
+        leases = PackLeases.from_config(client, self.config, lease_owner)
+        with self.metrics.span('acquire_leases'):
+            lease_errors = {} if action == 'resume' else leases.acquire_all(from_packs)
+        for pack, error in lease_errors.items():
+            self.logger.error('Skipping the rules of pack {}: {}'.format(pack, error))
+        packs = [pack for pack in from_packs if pack not in lease_errors]
+        renewed_packs = leases.held(packs) if action == 'resume' else packs
+
+        with leases.heartbeat(renewed_packs, self.logger):
+            if action == 'suspend':
+                res = self.suspend_and_save(client, packs)
+            elif action == 'resume':
+                res = self.reinstate_rules(client, packs)
+            else:
+                self.logger.error('Unknown action: {}'.format(action))
+                res = False
 
-        return res
+        return {'success': res and not lease_errors, 'lease_errors': lease_errors,
+                'metrics': self.metrics.finish(self.config, self.logger)}
 
-    def reinstate_rules(self, client):
+    def reinstate_rules(self, client, packs):
         try:
-            suspended_in_past = client.keys.get_by_name(name=DATASTORE_KEY)
+            snapshots = self.load_snapshots(client, packs)
         except Exception as exc:
-            self.logger.exception("Failed to access datastore "
-                                  "to load key {}: {}".format(DATASTORE_KEY, exc))
+            self.logger.exception("Failed to load the saved rule states "
+                                  "from the datastore: {}".format(exc))
             return False
-        if not suspended_in_past:
-            self.logger.error('Cannot reinstate rules, key {} is not set '
-                              'in the datastore'.format(DATASTORE_KEY))
+        for pack in packs:
+            if pack not in snapshots:
+                # eg a new pack, whose rules were never suspended
+                self.logger.warning('No saved rule states for pack {}, '
+                                    'nothing to reinstate'.format(pack))
+        rules_state = [rule_state for pack in packs for rule_state in snapshots.get(pack, [])]
+
+        try:
+            rules_index = self.get_rules_index(client, {rule['pack'] for rule in rules_state})
+        except Exception as exc:
+            self.logger.exception("Failed to get rules from stackstorm: {}".format(exc))
             return False
-        rules_state = json.loads(suspended_in_past.value)
-        for rule in rules_state:
-            self.logger.debug("Re-setting state of rule {}.{} to {}".format(rule['pack'],
-                                                                            rule['name'],
-                                                                            rule['enabled']))
-            try:
-                res = self.manage_rule(client, rule['pack'], rule['name'], rule['enabled'])
-            except self.MissingRuleException as e:
-                self.logger.warning("Ignore missing rule {}.{}: {}".format(rule['pack'], rule['name'], e))
+
+        rules_to_update = []
+        for rule_state in rules_state:
+            rule = rules_index.get((rule_state['pack'], rule_state['name']))
+            if rule is None:
+                self.logger.warning("Ignore missing rule {}.{}".format(rule_state['pack'],
+                                                                       rule_state['name']))
+                continue
+            if getattr(rule, 'enabled', False) == rule_state['enabled']:
+                # already in the saved state, nothing to do
                 continue
+            self.logger.debug("Re-setting state of rule {}.{} to {}".format(rule_state['pack'],
+                                                                            rule_state['name'],
+                                                                            rule_state['enabled']))
+            rule.enabled = rule_state['enabled']
+            rules_to_update.append(rule)
+
+        if not self.update_rules(client, rules_to_update):
+            # keep the datastore keys so that resume can be retried
+            return False
 
-            if isinstance(res, str):
-                # error happened
-                self.logger.error("Error re-setting state "
-                                  "for rule {}.{} to {}: {}".format(rule['pack'], rule['name'],
-                                                                    rule['enabled'], res))
-                return False
-            else:
-                self.logger.info("Set rule {}.{} -> {}".format(rule['pack'], rule['name'],
-                                                               rule['enabled']))
-        # and delete the datastore key once we've reset the state of the rules
+        # and delete the saved states once we've reset the state of the rules
         try:
-            client.keys.delete(suspended_in_past)
-            self.logger.info("Removed datastore key {}".format(DATASTORE_KEY))
+            self.delete_snapshots(client, list(snapshots))
         except Exception as exc:
-            self.logger.exception("Failed to remove datastore key {}: {}".format(DATASTORE_KEY,
-                                                                                 exc))
+            self.logger.exception("Failed to remove the saved rule states "
+                                  "from the datastore: {}".format(exc))
             return False
 
         return True
 
     def suspend_and_save(self, client, from_packs):
-        rules_state = []
         try:
-            for pack in from_packs:
-                rules = client.rules.get_all(pack=pack)
-                for rule in rules:
-                    if rule.pack in from_packs:
-                        self.logger.debug("Saving state {} of rule {}.{}".format(rule.enabled,
-                                                                                 rule.pack,
-                                                                                 rule.name))
-                        rules_state.append({
-                            'name': rule.name,
-                            'pack': rule.pack,
-                            'enabled': rule.enabled
-                        })
+            rules_index = self.get_rules_index(client, from_packs)
         except Exception as exc:
             self.logger.exception("Failed to get rules from stackstorm: {}".format(exc))
             return False
 
+        rules_state = {pack: [] for pack in from_packs}
+        for rule in rules_index.values():
+            self.logger.debug("Saving state {} of rule {}.{}".format(rule.enabled,
+                                                                     rule.pack,
+                                                                     rule.name))
+            rules_state[rule.pack].append({
+                'name': rule.name,
+                'pack': rule.pack,
+                'enabled': rule.enabled
+            })
+
         try:
-            suspended_in_past = client.keys.get_by_name(name=DATASTORE_KEY)
+            suspended_in_past = self.load_snapshots(client, from_packs)
         except Exception as exc:
             self.logger.exception("Failed to check datastore for "
-                                  "existing key {}: {}".format(DATASTORE_KEY, exc))
+                                  "saved rule states: {}".format(exc))
             return False
 
-        if suspended_in_past:
-            self.logger.warning('{} datastore key exists, not overwriting'.format(DATASTORE_KEY))
-        else:
-            client.keys.update(KeyValuePair(name=DATASTORE_KEY, ttl=DATASTORE_KEY_TTL,
-                                            value=json.dumps(rules_state)))
-
-        for rule in rules_state:
+        for pack in from_packs:
+            if pack in suspended_in_past:
+                # the rules are still suspended by an earlier (interrupted) deploy
+                self.logger.warning('Rule states of pack {} are already saved, '
+                                    'not overwriting'.format(pack))
+                continue
             try:
-                res = self.manage_rule(client, rule['pack'], rule['name'], False)
-            except self.MissingRuleException as e:
-                res = str(e)
-            if isinstance(res, str):
-                # error happened
-                self.logger.error("Error disabling rule {}.{}: {}".format(rule['pack'],
-                                                                          rule['name'], res))
+                save_json(client, snapshot_key(pack), rules_state[pack],
+                          ttl=DATASTORE_KEY_TTL)
+            except Exception as exc:
+                self.logger.exception("Failed to save datastore "
+                                      "key {}: {}".format(snapshot_key(pack), exc))
                 return False
-            else:
-                self.logger.info("Disabled rule {}.{}".format(rule['pack'], rule['name']))
 
-        return True
-
-    def manage_rule(self, client, pack, name, enabled):
-        rule_name = '{}.{}'.format(pack, name)
-        failure_reason = None
-        rule = None
-        try:
-            rule = client.rules.get_by_name(name=name, pack=pack)
-            if not rule:
-                failure_reason = 'rule not found'
-        except Exception as exc:
-            failure_reason = exc
-
-        if failure_reason:
-            raise self.MissingRuleException('Could not get rule {}: {}'.format(rule_name, failure_reason))
-
-        try:
-            rule_enabled = rule.enabled
-        except AttributeError:
-            # this should not happen, but better be safe than sorry
-            self.logger.debug("Hmm, rule {}.{} doesn't have attribute 'enabled', "
-                              "assuming it's off then.".format(name, pack))
-            rule_enabled = False
-
-        if rule_enabled == enabled:
-            # already enabled/disabled, so just return true and formatted results
-            return rule
-
-        try:
-            rule.enabled = enabled
-
-            client.rules.update(rule)
-        except Exception as exc:
-            return 'Could not update rule {}: {}'.format(rule_name, exc)
+        rules_to_update = []
+        for rule in rules_index.values():
+            if not rule.enabled:
+                # already disabled, nothing to do
+                continue
+            rule.enabled = False
+            rules_to_update.append(rule)
+
+        return self.update_rules(client, rules_to_update)
+
+    def load_snapshots(self, client, packs):
+        """Get the saved rule states of packs as {pack: [{name, pack, enabled}]}.
+
+        Packs without a snapshot are left out. Packs that have no key of their own
+        fall back to the states saved in DATASTORE_KEY by earlier versions.
+        """
+        snapshots = {}
+        for pack in packs:
+            rules_state = load_json(client, snapshot_key(pack))
+            if rules_state is not None:
+                snapshots[pack] = rules_state
+        missing = set(packs).difference(snapshots)
+        if missing:
+            for rule_state in load_json(client, DATASTORE_KEY) or []:
+                if rule_state['pack'] in missing:
+                    snapshots.setdefault(rule_state['pack'], []).append(rule_state)
+        return snapshots
+
+    def delete_snapshots(self, client, packs):
+        for pack in packs:
+            delete_key(client, snapshot_key(pack))
+            self.logger.info("Removed datastore key {}".format(snapshot_key(pack)))
+
+        legacy_state = load_json(client, DATASTORE_KEY)
+        if legacy_state is None:
+            return
+        # only drop these packs, the other packs in there are not reinstated yet
+        remaining = [rule_state for rule_state in legacy_state
+                     if rule_state['pack'] not in packs]
+        if not remaining:
+            delete_key(client, DATASTORE_KEY)
+            self.logger.info("Removed datastore key {}".format(DATASTORE_KEY))
+        elif len(remaining) < len(legacy_state):
+            save_json(client, DATASTORE_KEY, remaining, ttl=DATASTORE_KEY_TTL)
+
+    def get_rules_index(self, client, packs):
+        """Get all rules in packs with one request per pack, indexed by (pack, name)."""
+        rules_index = {}
+        with self.metrics.span('get_rules'):
+            for pack in packs:
+                for rule in client.rules.get_all(pack=pack):
+                    if rule.pack in packs:
+                        rules_index[(rule.pack, rule.name)] = rule
+        return rules_index
+
+    def update_rules(self, client, rules):
+        """Concurrently save rules that need a new enabled state. Return False if any failed."""
+        rules_by_key = {(rule.pack, rule.name): rule for rule in rules}
+        with self.metrics.span('update_rules'):
+            outcomes = run_parallel(
+                client.rules.update,
+                rules_by_key.values(),
+                key=lambda rule: (rule.pack, rule.name),
+                parallelism=self.parallelism,
+                retries=DEFAULT_RETRIES,
+            )
+        success = True
+        for (pack, name), outcome in outcomes.items():
+            if outcome.ok:
+                self.logger.info("Set rule {}.{} -> {}".format(pack, name,
+                                                               rules_by_key[(pack, name)].enabled))
+            else:
+                # keep going so that one bad rule does not leave the others unchanged
+                self.logger.error("Error updating rule {}.{}: {}".format(pack, name,
+                                                                         outcome.error))
+                success = False
+        return success
 
 
 if __name__ == '__main__':
@@ -1,12 +1,19 @@
+import time
+
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from python_runner.python_action_wrapper import ActionService
     from logging import Logger
 
-from st2client.client import Client
 from st2common.runners.base_action import Action
 
+from lib.client import get_client
+from lib.concurrency import DEFAULT_PARALLELISM
+from lib.execution_control import ExecutionController
+from lib.metrics import Metrics
+from lib.results import FULL, STREAM, SUMMARY, write_result_file
+
 
 class UnpausePackExecutions(Action):
 
@@ -16,14 +23,64 @@ class UnpausePackExecutions(Action):
 
     def __init__(self, config=None, action_service=None):
         super().__init__(config, action_service)
-        self.client = Client()
+        self.metrics = Metrics("unpause_pack_executions")
+        self.client = get_client(self.config, metrics=self.metrics)
 
-    def run(self, executions: list = None):
-        results = {}
+    def run(
+        self,
+        executions: list = None,
+        parallelism=DEFAULT_PARALLELISM,
+        result_mode: str = FULL,
+        batch_size: int = 0,
+        stagger_seconds: float = 0,
+    ):
+        results = {"success": True, "executions": {}}
         if not executions:
+            results["metrics"] = self.metrics.finish(self.config, self.logger)
             return results
 
-        for execution_id in executions:
-            results[execution_id] = self.client.executions.resume(execution_id)
+        controller = ExecutionController(
+            self.client, self.logger, parallelism=parallelism
+        )
+        # With a batch_size, the workflows are resumed a batch at a time,
+        # stagger_seconds apart, so that they do not all hit the runners at once.
+        batch_size = batch_size or len(executions)
+        outcomes = {}
+        for start in range(0, len(executions), batch_size):
+            if start and stagger_seconds:
+                with self.metrics.span("stagger"):
+                    time.sleep(stagger_seconds)
+            with self.metrics.span("resume_executions"):
+                outcomes.update(
+                    controller.resume(executions[start : start + batch_size])
+                )
+        for execution_id, outcome in outcomes.items():
+            if not outcome["confirmed"]:
+                self.logger.warning(
+                    f"Could not confirm that execution={execution_id} resumed. "
+                    f"Last status={outcome['status']} {outcome['error_message']}"
+                )
 
+        results["success"] = all(outcome["confirmed"] for outcome in outcomes.values())
+        if result_mode != FULL:
+            results["counts"] = {
+                "executions": len(outcomes),
+                "confirmed": sum(outcome["confirmed"] for outcome in outcomes.values()),
+            }
+        if result_mode == SUMMARY:
+            # only the executions that could not be confirmed as resumed
+            results["executions"] = {
+                execution_id: outcome
+                for execution_id, outcome in outcomes.items()
+                if not outcome["confirmed"]
+            }
+        elif result_mode == STREAM:
+            del results["executions"]
+            with self.metrics.span("write_result_file"):
+                results["result_file"] = write_result_file(
+                    self.config, "unpause_pack_executions", outcomes.values()
+                )
+        else:
+            results["executions"] = outcomes
+        results["metrics"] = self.metrics.finish(self.config, self.logger)
         return results
@@ -1,31 +1,97 @@
+import functools
+import pathlib
 import time
 from collections import defaultdict
-from typing import Dict, Tuple, TYPE_CHECKING
+from typing import Any, Dict, Iterator, Optional, Set, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from python_runner.python_action_wrapper import ActionService
     from logging import Logger
 
-from st2client.client import Client
-from st2client.commands.action import LIVEACTION_STATUS_RUNNING
+from st2common.constants.action import LIVEACTION_STATUS_RUNNING
+from st2common.content.utils import get_pack_base_path
 from st2common.runners.base_action import Action
 
+from lib.call_graph import WORKFLOW_RUNNERS, CallGraph, action_refs
+from lib.client import get_client
+from lib.cluster_state import (
+    SnapshotExecutionTracker,
+    read_snapshot,
+    running_executions,
+)
+from lib.concurrency import DEFAULT_PARALLELISM, run_parallel
+from lib.duration_model import DurationModel
+from lib.execution_control import ExecutionController, FINISHED_STATUSES
+from lib.execution_query import (
+    any_execution,
+    iter_executions,
+    iter_running_executions,
+)
+from lib.execution_tracker import PollingExecutionTracker, StreamExecutionTracker
+from lib.lease import PackLeases
+from lib.metrics import Metrics
+from lib.results import FULL, STREAM, SUMMARY, write_result_file
+
 
 # Never try to pause or wait for these actions
 NEVER_MANAGE_ACTIONS = [
     # This action should run as part of st2gitops.deploy_pack
     # so, don't pause the st2gitops.deploy_pack workflow.
     "st2gitops.deploy_pack",
+    "st2gitops.deploy_packs",
+    "st2gitops.deploy_pack_lane",
     # these actions get run by st2gitops.deploy_pack, including this one.
     "st2gitops.delay_new_pack_executions",
     "st2gitops.get_pack_commit_hash",
+    "st2gitops.get_pack_state",
+    "st2gitops.plan_pack_deploy",
+    "st2gitops.checkout_pack_commit",
+    "st2gitops.stage_pack",
     "st2gitops.manage_pack_resources",
     "st2gitops.suspend_st2_rules",
     "st2gitops.wait_or_pause_running_pack_executions",
     "st2gitops.unpause_pack_executions",
+    "st2gitops.pack_lease",
 ]
 
-WORKFLOW_RUNNERS = ["orquesta", "action-chain"]
+# default for the timeout_seconds parameter
+DEFAULT_TIMEOUT_SECONDS = 120
+# predicted run times are percentiles, so leave a little room on top of them
+PREDICTION_SLACK_SECONDS = 5
+
+# only what is needed to sort executions by pack and report them
+EXECUTION_ATTRIBUTES = [
+    "id",
+    "status",
+    "start_timestamp",
+    "action.ref",
+    "action.pack",
+    "action.runner_type",
+    "context.user",
+]
+
+
+class PackWait:
+    """Progress of waiting for (or pausing) the running executions of one pack."""
+
+    SIMPLE = "simple"  # waiting for simple (non-workflow) executions
+    ALL = "all"  # workflows were paused, waiting for everything to pause or finish
+    DONE = "done"
+
+    def __init__(self, pack_name, deadline):
+        self.pack_name = pack_name
+        self.phase = self.SIMPLE
+        self.deadline = deadline
+        self.attempt = 1
+        self.hit_timeout_for_simple = False
+        self.hit_timeout_for_all = False
+        # {predicted_drain_seconds, decision} of the current attempt (see _predict_drain)
+        self.drain_prediction: Optional[Dict[str, Any]] = None
+        self.executions_running = []
+        # ids of paused workflow executions (a dict to keep them ordered and unique)
+        self.paused: Dict[str, None] = {}
+        # {execution_id: outcome of the pause request}
+        self.pause_outcomes: Dict[str, dict] = {}
 
 
 class WaitOrPauseRunningPackExecutions(Action):
@@ -36,44 +102,74 @@ class WaitOrPauseRunningPackExecutions(Action):
 
     def __init__(self, config=None, action_service=None):
         super().__init__(config, action_service)
-        self.client = Client()
+        self.metrics = Metrics("wait_or_pause_running_pack_executions")
+        self.client = get_client(self.config, metrics=self.metrics)
+        self.wait_mode = "stream"
+        self.started = time.time()
+        # the snapshot of st2gitops.ClusterStateSensor, when wait_mode is index and
+        # the sensor keeps it up to date (see lib.cluster_state)
+        self.cluster_state: Optional[Dict[str, Any]] = None
+        self.duration_model: Optional[DurationModel] = None
+        # refs of the actions in the packs, when known (see _find_action_refs)
+        self.action_refs: Optional[Set[str]] = None
+        self.executions_controller = ExecutionController(self.client, self.logger)
 
-    def run(self, from_packs: list = None):
+    def run(
+        self,
+        from_packs: list = None,
+        wait_mode: str = "stream",
+        parallelism=DEFAULT_PARALLELISM,
+        pause_callers: bool = True,
+        lease_owner: str = "",
+        result_mode: str = FULL,
+        timeout_seconds: int = DEFAULT_TIMEOUT_SECONDS,
+        predict_drain: bool = True,
+    ):
+        self.wait_mode = wait_mode
+        self.duration_model = None
+        if predict_drain:
+            # run times longer than the budget always mean pausing
+            self.duration_model = DurationModel.from_config(
+                self.client,
+                self.config,
+                self.logger,
+                horizon_seconds=timeout_seconds,
+                parallelism=parallelism,
+            )
+        self.started = time.time()
+        self.executions_controller.parallelism = parallelism
         results = {"success": True, "packs": {}}
 
-        packs_with_paused = defaultdict(set)
-
-        # First try. We'll loop back through one more time to retry if needed.
-        retry_packs = []
-        for pack_name in from_packs:
-            (
-                hit_timeout_for_simple,
-                hit_timeout_for_all,
-                executions_running,
-                paused_workflows,
-            ) = self.wait_or_pause(pack_name)
-            if executions_running:
-                retry_packs.append(pack_name)
-            if paused_workflows:
-                for execution in paused_workflows:
-                    packs_with_paused[pack_name].add(execution.id)
-
-        # Try one more time to pause anything that is still running
+        # Packs that another deploy holds the lease on are left alone.
+        leases = PackLeases.from_config(self.client, self.config, lease_owner)
+        with self.metrics.span("acquire_leases"):
+            lease_errors = leases.acquire_all(from_packs)
+        for pack_name, error in lease_errors.items():
+            self.logger.error(f"Skipping pack {pack_name}: {error}")
+        leased_packs = [name for name in from_packs if name not in lease_errors]
+
+        pack_waits = {}
+        if leased_packs:
+            with leases.heartbeat(leased_packs, self.logger):
+                pack_waits = self.wait_or_pause(
+                    leased_packs,
+                    timeout_seconds=timeout_seconds,
+                    pause_callers=pause_callers,
+                )
+                self._confirm_pauses(pack_waits)
+
         succeeded_packs = []
         failed_packs = {}
-        for pack_name in retry_packs:
-            (
-                hit_timeout_for_simple,
-                hit_timeout_for_all,
-                executions_running,
-                paused_workflows,
-            ) = self.wait_or_pause(pack_name)
-            if not executions_running:
+        packs_with_paused = {}
+        pause_outcomes = {}
+        drain_predictions = {}
+        for pack_name, pack_wait in pack_waits.items():
+            if not pack_wait.executions_running:
                 succeeded_packs.append(pack_name)
             else:
                 failed_packs[pack_name] = {
-                    "hit_timeout_for_simple": hit_timeout_for_simple,
-                    "hit_timeout_for_all": hit_timeout_for_all,
+                    "hit_timeout_for_simple": pack_wait.hit_timeout_for_simple,
+                    "hit_timeout_for_all": pack_wait.hit_timeout_for_all,
                     "executions_running": [
                         {
                             "id": execution.id,
@@ -83,114 +179,459 @@ class WaitOrPauseRunningPackExecutions(Action):
                             "start_timestamp": execution.start_timestamp,
                             "user": execution.context["user"],
                         }
-                        for execution in executions_running
+                        for execution in pack_wait.executions_running
                     ],
                 }
-            if paused_workflows:
-                for execution in paused_workflows:
-                    packs_with_paused[pack_name].add(execution.id)
+            if pack_wait.paused:
+                packs_with_paused[pack_name] = list(pack_wait.paused)
+            if pack_wait.pause_outcomes:
+                pause_outcomes[pack_name] = pack_wait.pause_outcomes
+            if pack_wait.drain_prediction:
+                drain_predictions[pack_name] = pack_wait.drain_prediction
 
-        results["success"] = not failed_packs
+        results["success"] = not failed_packs and not lease_errors
         results["packs_with_no_running_executions"] = succeeded_packs
         results["packs_with_running_executions"] = failed_packs
-        results["paused_executions_in_packs"] = dict(packs_with_paused)
+        results["paused_executions_in_packs"] = packs_with_paused
+        results["pause_outcomes"] = pause_outcomes
+        results["drain_predictions"] = drain_predictions
+        results["lease_errors"] = lease_errors
+        # paused_executions_in_packs is needed to resume the executions later,
+        # so it is always returned in full.
+        if result_mode != FULL:
+            results["counts"] = {
+                pack_name: {
+                    "running": len(pack_wait.executions_running),
+                    "paused": len(pack_wait.paused),
+                    "pause_confirmed": sum(
+                        outcome["confirmed"]
+                        for outcome in pack_wait.pause_outcomes.values()
+                    ),
+                }
+                for pack_name, pack_wait in pack_waits.items()
+            }
+        if result_mode == SUMMARY:
+            # only the pauses that could not be confirmed
+            unconfirmed = {}
+            for pack_name, outcomes in pause_outcomes.items():
+                failed = {
+                    execution_id: outcome
+                    for execution_id, outcome in outcomes.items()
+                    if not outcome["confirmed"]
+                }
+                if failed:
+                    unconfirmed[pack_name] = failed
+            results["pause_outcomes"] = unconfirmed
+        elif result_mode == STREAM:
+            with self.metrics.span("write_result_file"):
+                results["result_file"] = write_result_file(
+                    self.config,
+                    "wait_or_pause_running_pack_executions",
+                    self._result_records(failed_packs, pause_outcomes),
+                )
+            del results["pause_outcomes"]
+            for failed in failed_packs.values():
+                del failed["executions_running"]
+        results["metrics"] = self.metrics.finish(self.config, self.logger)
         return results
 
-    def wait_or_pause(self, pack_name, timeout_seconds=120):
-        (
-            hit_timeout_for_simple,
-            executions_running,
-            workflows_running,
-        ) = self._wait_for_simple_executions(
-            pack_name=pack_name, timeout_seconds=timeout_seconds / 2
-        )
-        paused = []
-        for execution in workflows_running:
-            self.logger.info(f"Pausing workflow execution={execution.id}")
-            self.client.executions.pause(execution.id)
-            paused.append(execution)
-        hit_timeout_for_all, executions_running = self._wait_for_all_executions(
-            pack_name=pack_name, timeout_seconds=timeout_seconds / 2
-        )
-        return hit_timeout_for_simple, hit_timeout_for_all, executions_running, paused
-
-    def _get_running_executions(self, pack_name):
-        attributes = [
-            "id",
-            "status",
-            "start_timestamp",
-            "action.ref",
-            "action.pack",
-            "action.name",
-            "action.runner_type",
-            "context.user",
+    @staticmethod
+    def _result_records(failed_packs, pause_outcomes) -> Iterator[Dict[str, Any]]:
+        for pack_name, failed in failed_packs.items():
+            for execution in failed["executions_running"]:
+                yield dict(execution, record="running_execution", pack=pack_name)
+        for pack_name, outcomes in pause_outcomes.items():
+            for outcome in outcomes.values():
+                yield dict(outcome, record="pause_outcome", pack=pack_name)
+
+    def wait_or_pause(
+        self,
+        pack_names,
+        timeout_seconds=DEFAULT_TIMEOUT_SECONDS,
+        attempts=2,
+        pause_callers=False,
+    ) -> Dict[str, "PackWait"]:
+        """Wait for, then pause, running executions in all packs at once.
+
+        With pause_callers, running workflows in other packs that call actions in
+        the packs are paused first (see _pause_callers).
+        Every tick reads the running executions of all packs at once
+        (see _iter_running_executions), or takes a stream or sensor snapshot.
+        Each pack spends up to timeout_seconds / 2 waiting for simple (non-workflow)
+        executions, pauses its running workflows as soon as those drain, and then
+        waits up to timeout_seconds / 2 for everything to pause or finish.
+        Packs that still have running executions get another attempt.
+        With a duration model, the wait for simple executions is cut down to when
+        they are predicted to finish, or skipped if that is over budget
+        (see _predict_drain).
+        """
+        now = time.time()
+        pack_waits = {
+            pack_name: PackWait(pack_name, deadline=now + timeout_seconds / 2)
+            for pack_name in pack_names
+        }
+        if self.wait_mode == "index":
+            with self.metrics.span("read_cluster_state"):
+                self.cluster_state = read_snapshot(self.config, since=self.started)
+            if self.cluster_state is None:
+                self.logger.info(
+                    "No up to date cluster state snapshot. Using the st2 API instead."
+                )
+
+        if pause_callers:
+            self._pause_callers(pack_waits)
+
+        self.action_refs = self._find_action_refs(pack_names)
+        # Usually nothing is running. Check that without following the stream,
+        # and stop reading at the first running execution otherwise.
+        with self.metrics.span("get_running_executions"):
+            if self.cluster_state is not None:
+                anything_running = any(
+                    self._is_relevant(pack_names, execution)
+                    for execution in self._snapshot_executions(pack_names)
+                )
+            else:
+                anything_running = any_execution(
+                    self._iter_running_executions(pack_names)
+                )
+        if not anything_running:
+            for pack_wait in pack_waits.values():
+                self.logger.info(
+                    f"Done! No running executions of actions in pack: {pack_wait.pack_name}"
+                )
+                pack_wait.phase = PackWait.DONE
+            return pack_waits
+
+        for pack_name in pack_names:
+            self.logger.info(
+                f"Waiting for any running executions for simple (non-workflow) actions in pack: {pack_name}"
+            )
+
+        tracker = self._track_running_executions(pack_names)
+        try:
+            while True:
+                running_by_pack = defaultdict(list)
+                with self.metrics.span("get_running_executions"):
+                    snapshot = tracker.snapshot()
+                for execution in snapshot:
+                    running_by_pack[execution.action["pack"]].append(execution)
+
+                now = time.time()
+                for pack_wait in pack_waits.values():
+                    if pack_wait.phase == PackWait.DONE:
+                        continue
+                    pack_wait.executions_running = running_by_pack.get(
+                        pack_wait.pack_name, []
+                    )
+                    if pack_wait.phase == PackWait.SIMPLE:
+                        self._wait_for_simple_executions(pack_wait, now, timeout_seconds)
+                    if pack_wait.phase == PackWait.ALL:
+                        self._wait_for_all_executions(
+                            pack_wait, now, timeout_seconds, attempts
+                        )
+
+                active = [
+                    pack_wait
+                    for pack_wait in pack_waits.values()
+                    if pack_wait.phase != PackWait.DONE
+                ]
+                if not active:
+                    break
+                next_deadline = min(pack_wait.deadline for pack_wait in active)
+                with self.metrics.span("wait_for_changes"):
+                    tracker.wait(max(0.0, next_deadline - time.time()))
+        finally:
+            tracker.close()
+        return pack_waits
+
+    def _wait_for_simple_executions(self, pack_wait, now, timeout_seconds) -> None:
+        pack_name = pack_wait.pack_name
+        executions = pack_wait.executions_running
+        workflow_executions = [
+            execution
+            for execution in executions
+            if execution.action["runner_type"] in WORKFLOW_RUNNERS
         ]
-        executions = self.client.executions.query(
-            pack=pack_name,
-            status=LIVEACTION_STATUS_RUNNING,
-            include_attributes=",".join(attributes),
+        if not executions:
+            self.logger.info(
+                f"Done! No running executions of actions in pack: {pack_name}"
+            )
+        elif len(workflow_executions) == len(executions):
+            self.logger.info(
+                f"Done! No running executions for non-workflow actions in pack: {pack_name}"
+            )
+        elif now < pack_wait.deadline and not self._predict_drain(
+            pack_wait, now, executions, workflow_executions
+        ):
+            # keep waiting
+            return
+        else:
+            pack_wait.hit_timeout_for_simple = True
+
+        if workflow_executions:
+            self._pause_workflows(pack_wait, workflow_executions)
+
+        self.logger.info(
+            f"Waiting for any remaining running executions to pause of finish for actions in pack: {pack_name}"
         )
-        executions = [
+        pack_wait.phase = PackWait.ALL
+        pack_wait.deadline = now + timeout_seconds / 2
+
+    def _predict_drain(
+        self, pack_wait, now, executions, workflow_executions
+    ) -> bool:
+        """Set the deadline to when the simple executions are predicted to finish.
+
+        This runs once per attempt. Return True if they are predicted to finish
+        after the deadline, so the workflows should be paused right away.
+        If any of them has no prediction (see DurationModel.predict_drain), the
+        deadline is left alone.
+        """
+        if self.duration_model is None or pack_wait.drain_prediction is not None:
+            return False
+        simple_executions = [
             execution
             for execution in executions
-            # Check pack because the API is returning more than requested (at least in 3.4.1).
-            if execution.action["pack"] == pack_name
-            # And skip anything in NEVER_MANAGE_ACTIONS
-            and execution.action["ref"] not in NEVER_MANAGE_ACTIONS
+            if execution not in workflow_executions
         ]
-        return executions
+        with self.metrics.span("predict_drain"):
+            drain = self.duration_model.predict_drain(simple_executions)
+        pack_name = pack_wait.pack_name
+        if drain is None:
+            pack_wait.drain_prediction = {
+                "predicted_drain_seconds": None,
+                "decision": "unknown",
+            }
+            return False
+
+        pack_wait.drain_prediction = {
+            "predicted_drain_seconds": round(drain - now, 3),
+            "decision": "wait",
+        }
+        if drain > pack_wait.deadline:
+            self.logger.info(
+                f"Running executions in pack {pack_name} are predicted to finish in "
+                f"{drain - now:.0f}s, which is over budget. Pausing workflows now."
+            )
+            pack_wait.drain_prediction["decision"] = "pause"
+            return True
+        self.logger.info(
+            f"Running executions in pack {pack_name} are predicted to finish in "
+            f"{drain - now:.0f}s"
+        )
+        pack_wait.deadline = min(
+            pack_wait.deadline, drain + PREDICTION_SLACK_SECONDS
+        )
+        return False
 
-    def _wait_for_simple_executions(
-        self, pack_name, timeout_seconds
-    ) -> Tuple[bool, list, list]:
+    def _pause_workflows(self, pack_wait, workflow_executions) -> None:
+        execution_ids = [execution.id for execution in workflow_executions]
         self.logger.info(
-            f"Waiting for any running executions for simple (non-workflow) actions in pack: {pack_name}"
+            f"Pausing workflow executions in pack {pack_wait.pack_name}: {execution_ids}"
         )
+        # Only the requests are sent here, so the other packs are not held up.
+        # The wait loop sees the workflows stop running, and _confirm_pauses()
+        # checks the rest at the end.
+        with self.metrics.span("pause_workflows"):
+            outcomes = self.executions_controller.pause(execution_ids, confirm=False)
+        pack_wait.pause_outcomes.update(outcomes)
+        # A workflow whose pause was accepted may still be running for a while.
+        # It pauses later, so it has to be resumed with the rest.
+        for execution_id, outcome in outcomes.items():
+            if outcome["requested"] and outcome["status"] not in FINISHED_STATUSES:
+                pack_wait.paused[execution_id] = None
 
-        executions = []
-        workflow_executions = []
+    def _confirm_pauses(self, pack_waits: Dict[str, PackWait]) -> None:
+        """Check the pauses that were not confirmed while waiting.
 
-        start_time = time.time()
-        end_time = start_time + timeout_seconds
-        while time.time() < end_time:
-            executions = self._get_running_executions(pack_name)
-            if not executions:
-                self.logger.info(
-                    f"Done! No running executions of actions in pack: {pack_name}"
-                )
-                return False, [], []
+        Workflows that finished instead of pausing do not need to be resumed.
+        """
+        outcomes = {}
+        for pack_wait in pack_waits.values():
+            outcomes.update(pack_wait.pause_outcomes)
+        with self.metrics.span("confirm_pauses"):
+            self.executions_controller.confirm_pauses(outcomes)
+        for pack_wait in pack_waits.values():
+            for execution_id, outcome in pack_wait.pause_outcomes.items():
+                if outcome["status"] in FINISHED_STATUSES:
+                    pack_wait.paused.pop(execution_id, None)
+                elif not outcome["confirmed"]:
+                    self.logger.warning(
+                        f"Could not confirm that workflow execution={execution_id} "
+                        f"paused. Last status={outcome['status']} "
+                        f"{outcome['error_message']}"
+                    )
 
-            workflow_executions = [
+    def _pause_callers(self, pack_waits: Dict[str, PackWait]) -> None:
+        """Pause running workflows in other packs that call actions in the packs.
+
+        Otherwise those workflows would only stop once they reach the delay policy,
+        holding on to their runner while they wait. The callers come from the
+        workflow definitions of the installed packs (see lib.call_graph), so only
+        their executions are queried. They are resumed with the pack's own paused
+        executions, because they are reported under paused_executions_in_packs.
+        """
+        with self.metrics.span("find_callers"):
+            callers = CallGraph.from_config(self.config, self.logger).callers(
+                list(pack_waits)
+            )
+        caller_refs = {
+            ref
+            for refs in callers.values()
+            for ref in refs
+            # workflows in the packs themselves are handled by the wait loop
+            if ref.split(".", 1)[0] not in pack_waits
+            and ref not in NEVER_MANAGE_ACTIONS
+        }
+        if not caller_refs:
+            return
+
+        with self.metrics.span("get_running_callers"):
+            running = self._get_running_executions_of(sorted(caller_refs))
+        paused_ids = set()
+        for pack_name, pack_wait in pack_waits.items():
+            executions = [
                 execution
-                for execution in executions
-                if execution.action["runner_type"] in WORKFLOW_RUNNERS
+                for ref in callers[pack_name]
+                for execution in running.get(ref, [])
+                if execution.id not in paused_ids
             ]
-            if len(workflow_executions) == len(executions):
-                self.logger.info(
-                    f"Done! No running executions for non-workflow actions in pack: {pack_name}"
-                )
-                return False, executions, workflow_executions
+            if not executions:
+                continue
+            self.logger.info(
+                f"Pausing running workflows that call actions in pack {pack_name}: "
+                f"{sorted({execution.action['ref'] for execution in executions})}"
+            )
+            self._pause_workflows(pack_wait, executions)
+            paused_ids.update(execution.id for execution in executions)
 
-            time.sleep(1)
-        return True, executions, workflow_executions
+    def _wait_for_all_executions(
+        self, pack_wait, now, timeout_seconds, attempts
+    ) -> None:
+        pack_name = pack_wait.pack_name
+        if not pack_wait.executions_running:
+            self.logger.info(
+                f"Done! No running executions of actions in pack: {pack_name}"
+            )
+            pack_wait.phase = PackWait.DONE
+        elif now >= pack_wait.deadline:
+            pack_wait.hit_timeout_for_all = True
+            if pack_wait.attempt < attempts:
+                # Try one more time to pause anything that is still running
+                pack_wait.attempt += 1
+                pack_wait.hit_timeout_for_simple = False
+                pack_wait.hit_timeout_for_all = False
+                pack_wait.drain_prediction = None
+                pack_wait.phase = PackWait.SIMPLE
+                pack_wait.deadline = now + timeout_seconds / 2
+            else:
+                pack_wait.phase = PackWait.DONE
 
-    def _wait_for_all_executions(self, pack_name, timeout_seconds) -> Tuple[bool, list]:
-        self.logger.info(
-            f"Waiting for any remaining running executions to pause of finish for actions in pack: {pack_name}"
+    def _track_running_executions(self, pack_names):
+        if self.cluster_state is not None:
+            return SnapshotExecutionTracker(
+                self.config,
+                pack_names,
+                deserialize=self.client.executions.resource.deserialize,
+                is_relevant=functools.partial(self._is_relevant, pack_names),
+                fallback=functools.partial(self._track_api_executions, pack_names),
+                logger=self.logger,
+            )
+        return self._track_api_executions(pack_names)
+
+    def _track_api_executions(self, pack_names):
+        query = functools.partial(self._get_running_executions, pack_names)
+        if self.wait_mode in ("stream", "index"):
+            return StreamExecutionTracker(
+                self.client,
+                query=query,
+                is_relevant=functools.partial(self._is_relevant, pack_names),
+                logger=self.logger,
+            )
+        return PollingExecutionTracker(query)
+
+    @staticmethod
+    def _is_relevant(pack_names, execution) -> bool:
+        return (
+            execution.action["pack"] in pack_names
+            # And skip anything in NEVER_MANAGE_ACTIONS
+            and execution.action["ref"] not in NEVER_MANAGE_ACTIONS
         )
-        executions = []
 
-        start_time = time.time()
-        end_time = start_time + timeout_seconds
-        while time.time() < end_time:
-            executions = self._get_running_executions(pack_name)
-            if not executions:
-                self.logger.info(
-                    f"Done! No running executions of actions in pack: {pack_name}"
+    def _find_action_refs(self, pack_names) -> Optional[Set[str]]:
+        """Refs of the actions to wait for, read from the installed packs.
+
+        None if a pack is not on disk (eg a new install), which means
+        that every running execution has to be checked.
+        """
+        refs: Set[str] = set()
+        for pack_name in pack_names:
+            pack_refs = action_refs(
+                pack_name, pathlib.Path(get_pack_base_path(pack_name))
+            )
+            if pack_refs is None:
+                return None
+            refs.update(pack_refs)
+        return refs.difference(NEVER_MANAGE_ACTIONS)
+
+    def _iter_running_executions(self, pack_names):
+        # The API does not filter by pack (at least in 3.4.1). With a few known
+        # action refs it is filtered by action instead, otherwise the running
+        # executions of all packs are paged through and split up by action.pack.
+        executions = iter_running_executions(
+            self.client,
+            EXECUTION_ATTRIBUTES,
+            pack_names=pack_names,
+            action_refs=self.action_refs,
+        )
+        return (
+            execution
+            for execution in executions
+            if self._is_relevant(pack_names, execution)
+        )
+
+    def _get_running_executions(self, pack_names):
+        return list(self._iter_running_executions(pack_names))
+
+    def _snapshot_executions(self, pack_names=None):
+        """The running executions in the cluster state snapshot, as resources."""
+        return [
+            self.client.executions.resource.deserialize(execution)
+            for execution in running_executions(self.cluster_state, pack_names)
+        ]
+
+    def _get_running_executions_of(self, action_refs):
+        """{action_ref: [running executions]}, with one query per action ref.
+
+        With a cluster state snapshot, they are read from it instead.
+        """
+        if self.cluster_state is not None:
+            running = {}
+            for execution in self._snapshot_executions():
+                if execution.action["ref"] in action_refs:
+                    running.setdefault(execution.action["ref"], []).append(execution)
+            return running
+        outcomes = run_parallel(
+            lambda action_ref: list(
+                iter_executions(
+                    self.client,
+                    action=action_ref,
+                    status=LIVEACTION_STATUS_RUNNING,
+                    include_attributes=",".join(EXECUTION_ATTRIBUTES),
+                )
+            ),
+            action_refs,
+            parallelism=self.executions_controller.parallelism,
+        )
+        running = {}
+        for action_ref, outcome in outcomes.items():
+            if outcome.ok:
+                running[action_ref] = outcome.value
+            else:
+                self.logger.warning(
+                    f"Could not get the running executions of {action_ref}: {outcome.error}"
                 )
-                return False, []
-            time.sleep(1)
-        return True, executions
+        return running
 
 
 if __name__ == "__main__":
@@ -0,0 +1,335 @@
+"""An in-process fake of the parts of the st2 API that the st2gitops actions use.
+
+It serves packs, actions, rules, policies, the key-value datastore and executions
+from memory over real HTTP (so st2client and the pooled session are exercised as
+in production), counts the requests per endpoint and can add latency to each one.
+
+Running executions of simple actions succeed execution_seconds after the server
+starts. Running workflows (orquesta) keep running until they are paused.
+"""
+import datetime
+import http.server
+import json
+import pathlib
+import socketserver
+import threading
+import time
+import uuid
+
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import yaml
+
+WORKFLOW_RUNNER = "orquesta"
+SIMPLE_RUNNER = "python-script"
+# st2api api.max_page_size
+MAX_PAGE_SIZE = 100
+START = datetime.datetime(2021, 1, 1)
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+class Scale(NamedTuple):
+    packs: int = 10
+    actions: int = 5000
+    rules: int = 2000
+    executions: int = 500
+    # share of the running executions that are workflows (and get paused)
+    workflow_ratio: float = 0.2
+    # share of the running executions in packs that are not being deployed
+    other_pack_ratio: float = 0.2
+    # rules per pack that are listed in pack_resources.yaml
+    resources_per_pack: int = 20
+    execution_seconds: float = 2.0
+
+
+class Page(list):
+    """One page of a list response, with the total of all pages (X-Total-Count)."""
+
+    def __init__(self, documents: List[Dict[str, Any]], total_count: int):
+        super().__init__(documents)
+        self.total_count = total_count
+
+
+class FakeSt2Api:
+    def __init__(self, scale: Scale, latency: float = 0.0, webui_domain: str = ""):
+        self.scale = scale
+        self.latency = latency
+        self.webui_domain = webui_domain
+        self.calls: Counter = Counter()
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self._server: Optional[socketserver.TCPServer] = None
+
+        self.pack_names = [f"bench{i}" for i in range(scale.packs)]
+        # {collection: {id: document}}
+        self.collections: Dict[str, Dict[str, Dict[str, Any]]] = {
+            "packs": {},
+            "actions": {},
+            "rules": {},
+            "policies": {},
+            "keys": {},
+            "executions": {},
+            "sensortypes": {},
+            "triggertypes": {},
+            "actionalias": {},
+        }
+        self._generate()
+
+    # data
+
+    def _add(self, collection: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        document.setdefault("id", uuid.uuid4().hex[:24])
+        self.collections[collection][document["id"]] = document
+        return document
+
+    def _generate(self) -> None:
+        scale = self.scale
+        for name in self.pack_names + ["other"]:
+            self._add("packs", {"ref": name, "name": name, "version": "1.0.0"})
+        for i in range(scale.actions):
+            pack = self.pack_names[i % scale.packs]
+            name = f"action{i}"
+            runner = WORKFLOW_RUNNER if i % 10 == 0 else SIMPLE_RUNNER
+            self._add(
+                "actions",
+                {
+                    "ref": f"{pack}.{name}",
+                    "pack": pack,
+                    "name": name,
+                    "runner_type": runner,
+                    "enabled": True,
+                },
+            )
+        for i in range(scale.rules):
+            pack = self.pack_names[i % scale.packs]
+            name = f"rule{i}"
+            self._add(
+                "rules",
+                {"ref": f"{pack}.{name}", "pack": pack, "name": name, "enabled": True},
+            )
+
+        others = int(scale.executions * scale.other_pack_ratio)
+        for i in range(scale.executions):
+            pack = "other" if i < others else self.pack_names[i % scale.packs]
+            # spread the workflows evenly between the simple actions
+            ratio = scale.workflow_ratio
+            is_workflow = int((i + 1) * ratio) > int(i * ratio)
+            runner = WORKFLOW_RUNNER if is_workflow else SIMPLE_RUNNER
+            name = f"running{i}"
+            self._add(
+                "executions",
+                {
+                    "status": "running",
+                    # one second apart, as the API pages through them by start time
+                    "start_timestamp": (START + datetime.timedelta(seconds=i)).strftime(
+                        TIMESTAMP_FORMAT
+                    ),
+                    "action": {
+                        "ref": f"{pack}.{name}",
+                        "pack": pack,
+                        "name": name,
+                        "runner_type": runner,
+                    },
+                    "context": {"user": "bench"},
+                },
+            )
+
+    def write_packs(self, packs_dir: str) -> None:
+        """Create the pack directories, with action metadata and a
+        pack_resources.yaml, on disk.
+
+        The metadata covers the registered actions and the actions of the running
+        executions, as the actions look up which action refs a pack has on disk.
+        """
+        rules_by_pack: Dict[str, List[str]] = {}
+        for rule in self.collections["rules"].values():
+            rules_by_pack.setdefault(rule["pack"], []).append(rule["name"])
+        actions_by_pack: Dict[str, Dict[str, str]] = {}
+        actions = list(self.collections["actions"].values()) + [
+            execution["action"] for execution in self.collections["executions"].values()
+        ]
+        for action in actions:
+            pack_actions = actions_by_pack.setdefault(action["pack"], {})
+            pack_actions[action["name"]] = action["runner_type"]
+        for name in self.pack_names:
+            pack_path = pathlib.Path(packs_dir, name)
+            pack_path.mkdir(parents=True, exist_ok=True)
+            (pack_path / "pack.yaml").write_text(f"ref: {name}\nname: {name}\n")
+            (pack_path / "actions").mkdir(exist_ok=True)
+            for action_name, runner in actions_by_pack.get(name, {}).items():
+                metadata = {"name": action_name, "runner_type": runner}
+                (pack_path / "actions" / f"{action_name}.yaml").write_text(
+                    yaml.safe_dump(metadata)
+                )
+            rules = rules_by_pack.get(name, [])[: self.scale.resources_per_pack]
+            resources = {self.webui_domain: {"rules": rules}}
+            (pack_path / "pack_resources.yaml").write_text(yaml.safe_dump(resources))
+            self._find("packs", name)["path"] = str(pack_path)
+
+    def _find(self, collection: str, key: str) -> Optional[Dict[str, Any]]:
+        documents = self.collections[collection]
+        if key in documents:
+            return documents[key]
+        for document in documents.values():
+            if key in (document.get("ref"), document.get("name")):
+                return document
+        return None
+
+    def _execution(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        if (
+            document["status"] == "running"
+            and document["action"]["runner_type"] != WORKFLOW_RUNNER
+            and time.time() - self.started_at >= self.scale.execution_seconds
+        ):
+            document["status"] = "succeeded"
+        elif document["status"] == "pausing":
+            document["status"] = "paused"
+        return document
+
+    # requests
+
+    def handle(
+        self, method: str, path: str, query: Dict[str, List[str]], body: Any
+    ) -> Tuple[int, Any]:
+        parts = [unquote(p) for p in path.strip("/").split("/") if p]
+        # the API may be mounted on /v1 or /api/v1
+        while parts and parts[0] in ("api", "v1"):
+            parts.pop(0)
+        if not parts or parts[0] not in self.collections:
+            return 404, {"faultstring": f"Unknown endpoint {path}"}
+        collection, key = parts[0], (parts[1] if len(parts) > 1 else None)
+        self.calls[f"{method} /{collection}{'/:id' if key else ''}"] += 1
+
+        with self.lock:
+            if key is None and method == "GET":
+                return 200, self._list(collection, query)
+            if key is None and method == "POST":
+                return self._create(collection, body)
+            document = self._find(collection, key) if key else None
+            if method == "PUT" and collection == "keys":
+                document = document or self._add("keys", {"id": key, "name": key})
+            if document is None:
+                return 404, {"faultstring": f"{collection} {key} not found"}
+            if method == "GET":
+                if collection == "executions":
+                    document = self._execution(document)
+                return 200, document
+            if method == "PUT":
+                return self._update(collection, document, body)
+            if method == "DELETE":
+                del self.collections[collection][document["id"]]
+                return 204, None
+        return 405, {"faultstring": f"{method} is not supported"}
+
+    def _list(
+        self, collection: str, query: Dict[str, List[str]]
+    ) -> Page:
+        documents = list(self.collections[collection].values())
+        if collection == "executions":
+            documents = [self._execution(d) for d in documents]
+        for field in ("pack", "name", "status"):
+            if field in query:
+                documents = [d for d in documents if d.get(field) == query[field][0]]
+        default_limit = "-1"
+        if collection == "executions":
+            if "action" in query:
+                documents = [
+                    d for d in documents if d["action"]["ref"] == query["action"][0]
+                ]
+            # the timestamps all have the same format, so they compare as strings
+            if "timestamp_lt" in query:
+                documents = [
+                    d
+                    for d in documents
+                    if d["start_timestamp"] < query["timestamp_lt"][0]
+                ]
+            if "timestamp_gt" in query:
+                documents = [
+                    d
+                    for d in documents
+                    if d["start_timestamp"] > query["timestamp_gt"][0]
+                ]
+            # newest first, like st2api
+            documents.sort(key=lambda d: d["start_timestamp"], reverse=True)
+            # like st2api, which returns api.max_page_size executions unless asked for less
+            default_limit = str(MAX_PAGE_SIZE)
+        offset = int(query.get("offset", ["0"])[0])
+        limit = min(int(query.get("limit", [default_limit])[0]), MAX_PAGE_SIZE)
+        page = documents[offset:] if limit <= 0 else documents[offset : offset + limit]
+        return Page(page, total_count=len(documents))
+
+    def _create(self, collection: str, body: Dict[str, Any]) -> Tuple[int, Any]:
+        ref = f"{body.get('pack')}.{body.get('name')}"
+        if self._find(collection, ref) is not None:
+            return 409, {"faultstring": f"{ref} already exists", "conflict-id": ref}
+        body.pop("id", None)
+        return 201, self._add(collection, dict(body, ref=ref))
+
+    def _update(
+        self, collection: str, document: Dict[str, Any], body: Dict[str, Any]
+    ) -> Tuple[int, Any]:
+        if collection != "executions":
+            body.pop("id", None)
+            document.update(body)
+            return 200, document
+
+        document = self._execution(document)
+        status = body.get("status")
+        if document["action"]["runner_type"] != WORKFLOW_RUNNER:
+            return 400, {"faultstring": "Only workflows can be paused and resumed"}
+        if status == "pausing" and document["status"] == "running":
+            document["status"] = "pausing"
+        elif status == "resuming" and document["status"] == "paused":
+            document["status"] = "running"
+        else:
+            return 400, {
+                "faultstring": f"Execution is {document['status']}, cannot set {status}"
+            }
+        return 200, document
+
+    # server
+
+    def start(self) -> str:
+        """Serve the API on a free localhost port, and return its base URL."""
+        api = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                if api.latency:
+                    time.sleep(api.latency)
+                status, payload = api.handle(
+                    self.command, url.path, parse_qs(url.query), body
+                )
+                data = json.dumps(payload).encode() if payload is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if isinstance(payload, Page):
+                    self.send_header("X-Total-Count", str(payload.total_count))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _respond
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        self.started_at = time.time()
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,254 @@
+"""Benchmark the pack lifecycle actions against an in-process fake st2 API.
+
+The actions run in the order that st2gitops.deploy_packs uses them, against the
+fake API in fake_st2api.py (which needs no StackStorm services). For every step
+this reports the wall time, the API requests per endpoint and the peak memory
+allocated by python (tracemalloc, which includes encoding the fake responses).
+
+Run it with the st2 virtualenv python (for st2common and st2client), eg:
+
+    /opt/stackstorm/st2/bin/python benchmarks/lifecycle.py --latency-ms 5
+
+A baseline is compared when one exists (benchmarks/lifecycle_baseline.json by
+default). Save one from a known good revision with --save-baseline; the command
+exits with status 1 when a step needs more API requests than in the baseline, or
+is slower than the baseline by more than --max-slowdown.
+"""
+import argparse
+import json
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from fake_st2api import FakeSt2Api, Scale
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+ACTIONS_DIR = BENCHMARKS_DIR.parent / "actions"
+DEFAULT_BASELINE = BENCHMARKS_DIR / "lifecycle_baseline.json"
+WEBUI_DOMAIN = "st2.bench.invalid"
+
+
+class Step(NamedTuple):
+    name: str
+    module: str
+    action_class: str
+    # returns the run() parameters, given the results of the earlier steps
+    parameters: Callable[[List[str], Dict[str, Any]], Dict[str, Any]]
+
+
+def _paused_executions(results: Dict[str, Any]) -> List[str]:
+    paused = results.get("wait_or_pause", {}).get("paused_executions_in_packs", {})
+    return [execution_id for ids in paused.values() for execution_id in ids]
+
+
+STEPS = [
+    Step(
+        "delay",
+        "delay_new_pack_executions",
+        "DelayNewPackExecutions",
+        lambda packs, _: {"from_packs": packs, "action": "delay"},
+    ),
+    Step(
+        "suspend_rules",
+        "suspend_st2_rules",
+        "SuspendSt2Rules",
+        lambda packs, _: {"from_packs": packs, "action": "suspend"},
+    ),
+    Step(
+        "wait_or_pause",
+        "wait_or_pause_running_pack_executions",
+        "WaitOrPauseRunningPackExecutions",
+        lambda packs, _: {"from_packs": packs, "wait_mode": "poll"},
+    ),
+    Step(
+        "resume_rules",
+        "suspend_st2_rules",
+        "SuspendSt2Rules",
+        lambda packs, _: {"from_packs": packs, "action": "resume"},
+    ),
+    Step(
+        "manage_pack_resources",
+        "manage_pack_resources",
+        "ManagePackResources",
+        lambda packs, _: {"from_packs": packs},
+    ),
+    Step(
+        "unpause",
+        "unpause_pack_executions",
+        "UnpausePackExecutions",
+        lambda packs, results: {"executions": _paused_executions(results)},
+    ),
+    Step(
+        "resume",
+        "delay_new_pack_executions",
+        "DelayNewPackExecutions",
+        lambda packs, _: {"from_packs": packs, "action": "resume"},
+    ),
+]
+
+
+def configure_st2(packs_dir: str) -> None:
+    """Set up the st2 config that the actions read, without an st2.conf."""
+    from st2common import config as st2_config
+    from st2common.config import cfg
+
+    st2_config.register_opts(ignore_errors=True)
+    cfg.CONF(args=[], default_config_files=[])
+    cfg.CONF.set_override("packs_base_paths", packs_dir, group="content")
+    cfg.CONF.set_override("system_packs_base_path", packs_dir, group="content")
+    cfg.CONF.set_override("webui_base_url", f"https://{WEBUI_DOMAIN}", group="webui")
+
+
+def run_step(
+    step: Step, api: FakeSt2Api, config, packs, results, parallelism, memory: bool
+) -> Dict[str, Any]:
+    import importlib
+
+    action_class = getattr(importlib.import_module(step.module), step.action_class)
+    parameters = step.parameters(packs, results)
+    if parallelism:
+        parameters["parallelism"] = parallelism
+
+    api.calls.clear()
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    action = action_class(config=config)
+    result = action.run(**parameters)
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if memory else 0
+    if memory:
+        tracemalloc.stop()
+
+    if isinstance(result, tuple):
+        success, result = result
+    elif isinstance(result, dict):
+        success = result.get("success", True)
+    else:
+        success = bool(result)
+    results[step.name] = result
+    return {
+        "success": bool(success),
+        "wall_seconds": round(wall, 4),
+        "api_calls": sum(api.calls.values()),
+        "api_calls_by_endpoint": dict(sorted(api.calls.items())),
+        "peak_memory_kb": round(peak / 1024),
+    }
+
+
+def compare(report, baseline, max_slowdown: float) -> List[str]:
+    if (baseline.get("scale"), baseline.get("latency_ms")) != (
+        report["scale"],
+        report["latency_ms"],
+    ):
+        print("The baseline was measured at another scale or latency. Not comparing.")
+        return []
+    regressions = []
+    for name, step in report["steps"].items():
+        before = baseline.get("steps", {}).get(name)
+        if not before:
+            continue
+        if step["api_calls"] > before["api_calls"]:
+            regressions.append(
+                f"{name}: {step['api_calls']} API calls (baseline {before['api_calls']})"
+            )
+        if step["wall_seconds"] > before["wall_seconds"] * (1 + max_slowdown):
+            regressions.append(
+                f"{name}: {step['wall_seconds']:.3f}s (baseline {before['wall_seconds']:.3f}s)"
+            )
+    return regressions
+
+
+def main():
+    defaults = Scale()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--packs", type=int, default=defaults.packs)
+    parser.add_argument("--actions", type=int, default=defaults.actions)
+    parser.add_argument("--rules", type=int, default=defaults.rules)
+    parser.add_argument("--executions", type=int, default=defaults.executions)
+    parser.add_argument("--workflow-ratio", type=float, default=defaults.workflow_ratio)
+    parser.add_argument(
+        "--execution-seconds",
+        type=float,
+        default=defaults.execution_seconds,
+        help="when the running simple executions finish",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="added to every API request"
+    )
+    parser.add_argument("--parallelism", type=int, default=None)
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc")
+    parser.add_argument("--baseline", type=pathlib.Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--max-slowdown", type=float, default=0.25)
+    args = parser.parse_args()
+
+    scale = Scale(
+        packs=args.packs,
+        actions=args.actions,
+        rules=args.rules,
+        executions=args.executions,
+        workflow_ratio=args.workflow_ratio,
+        execution_seconds=args.execution_seconds,
+    )
+    work_dir = tempfile.mkdtemp(prefix="st2gitops-bench-")
+    packs_dir = os.path.join(work_dir, "packs")
+    api = FakeSt2Api(scale, latency=args.latency_ms / 1000, webui_domain=WEBUI_DOMAIN)
+    api.write_packs(packs_dir)
+    os.environ["ST2_API_URL"] = api.start()
+    sys.path.insert(0, str(ACTIONS_DIR))
+    configure_st2(packs_dir)
+    config = {"cache_dir": os.path.join(work_dir, "cache")}
+
+    report = {"scale": scale._asdict(), "latency_ms": args.latency_ms, "steps": {}}
+    results: Dict[str, Any] = {}
+    try:
+        for step in STEPS:
+            step_report = run_step(
+                step,
+                api,
+                config,
+                api.pack_names,
+                results,
+                parallelism=args.parallelism,
+                memory=not args.no_memory,
+            )
+            report["steps"][step.name] = step_report
+            print(
+                f"{step.name:25} wall={step_report['wall_seconds']:.3f}s "
+                f"api_calls={step_report['api_calls']} "
+                f"peak_memory={step_report['peak_memory_kb']}KiB "
+                f"success={step_report['success']}"
+            )
+    finally:
+        api.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    report["total_wall_seconds"] = round(
+        sum(step["wall_seconds"] for step in report["steps"].values()), 4
+    )
+    report["total_api_calls"] = sum(
+        step["api_calls"] for step in report["steps"].values()
+    )
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+        print(f"Saved the baseline to {args.baseline}")
+    elif args.baseline.exists():
+        regressions = compare(
+            report, json.loads(args.baseline.read_text()), args.max_slowdown
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
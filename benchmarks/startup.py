@@ -0,0 +1,85 @@
+"""Measure the startup overhead of each st2gitops python action.
+
+Every sample runs in a fresh interpreter, like the python-script runner does, and times:
+  - import: importing the action module (st2common, st2client, ...)
+  - init: instantiating the action class (which builds the st2 client)
+  - first_call: one cheap API request (packs.get_by_ref_or_id), unless --no-api
+
+Run it with the st2 virtualenv python on a host that can reach st2, with the
+usual ST2_API_URL / ST2_AUTH_TOKEN (or ST2_API_KEY) environment, eg:
+
+    /opt/stackstorm/st2/bin/python benchmarks/startup.py --repeat 5
+
+Compare the output before and after a change to see the per-action overhead.
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+
+ACTIONS_DIR = pathlib.Path(__file__).resolve().parent.parent / "actions"
+
+SAMPLE = """
+import importlib, inspect, json, sys, time
+sys.path.insert(0, {actions_dir!r})
+start = time.perf_counter()
+module = importlib.import_module({module!r})
+imported = time.perf_counter()
+from st2common.runners.base_action import Action
+action_class = next(
+    obj for obj in vars(module).values()
+    if inspect.isclass(obj) and issubclass(obj, Action) and obj is not Action
+)
+action = action_class(config={{}})
+initialized = time.perf_counter()
+if {api_call!r}:
+    from lib.client import get_client
+    client = getattr(action, "client", None) or get_client({{}})
+    client.packs.get_by_ref_or_id("st2gitops")
+called = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "init": initialized - imported,
+    "first_call": called - initialized,
+}}))
+"""
+
+
+def sample(module: str, api_call: bool) -> dict:
+    code = SAMPLE.format(actions_dir=str(ACTIONS_DIR), module=module, api_call=api_call)
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-api", action="store_true", help="skip the first API call")
+    parser.add_argument("modules", nargs="*", help="action modules (default: all)")
+    args = parser.parse_args()
+
+    modules = args.modules or sorted(
+        path.stem for path in ACTIONS_DIR.glob("*.py") if path.stem != "__init__"
+    )
+    results = {}
+    for module in modules:
+        samples = [sample(module, not args.no_api) for _ in range(args.repeat)]
+        results[module] = {
+            phase: round(statistics.median(s[phase] for s in samples), 4)
+            for phase in ("import", "init", "first_call")
+        }
+        results[module]["total"] = round(sum(results[module].values()), 4)
+        print(f"{module:45} " + " ".join(f"{k}={v:.4f}s" for k, v in results[module].items()))
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import os
+import queue
+import sys
+import threading
+import time
+
+from typing import TYPE_CHECKING
+
+from st2reactor.sensor.base import Sensor
+
+if TYPE_CHECKING:
+    from logging import Logger
+
+# the code shared with the actions is in actions/lib
+PACK_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PACK_PATH, "actions"))
+
+from lib.client import get_client  # noqa: E402
+from lib.cluster_state import (  # noqa: E402
+    RUNNING_STATUS,
+    WRITE_INTERVAL,
+    ClusterStateIndex,
+    snapshot_path,
+)
+from lib.execution_query import iter_executions  # noqa: E402
+from lib.execution_tracker import Backoff, StreamConnection  # noqa: E402
+
+
+# how often running executions are re-synced in case an event was missed
+REFRESH_SECONDS = 60.0
+# the stream may still be connecting during the first resync, so the index is
+# only trusted after another resync this much later
+STREAM_SETTLE_SECONDS = 5.0
+# how often the stream loop checks whether the sensor is stopping
+STOP_CHECK_SECONDS = 1.0
+# only what the snapshot keeps (see lib.cluster_state.EXECUTION_FIELDS)
+EXECUTION_ATTRIBUTES = [
+    "id",
+    "status",
+    "start_timestamp",
+    "action.ref",
+    "action.pack",
+    "action.runner_type",
+    "context.user",
+]
+
+
+class ClusterStateSensor(Sensor):
+    """Keep a warm index of the running executions for the st2gitops actions.
+
+    Running executions follow st2.execution__update events on the st2 stream.
+    The index is written to a snapshot file in cache_dir every WRITE_INTERVAL
+    seconds (see lib.cluster_state), which the actions read instead of querying
+    the API while it is fresh.
+
+    This sensor does not dispatch triggers.
+    """
+
+    if TYPE_CHECKING:
+        _logger: Logger
+
+    def __init__(self, sensor_service, config=None):
+        super().__init__(sensor_service=sensor_service, config=config)
+        self._logger = self.sensor_service.get_logger(name=self.__class__.__name__)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._index = ClusterStateIndex()
+        self._client = None
+        self._path = None
+        self._writer = None
+
+    def setup(self):
+        self._client = get_client(self.config)
+        self._path = snapshot_path(self.config)
+        self._writer = threading.Thread(
+            target=self._write_loop, name="st2gitops-cluster-state", daemon=True
+        )
+        self._writer.start()
+
+    def run(self):
+        backoff = Backoff(minimum=1.0, maximum=30.0)
+        while not self._stop.is_set():
+            try:
+                self._follow_stream()
+                backoff.reset()
+            except Exception as exc:
+                self._logger.warning(f"Lost the st2 stream: {exc}")
+            with self._lock:
+                self._index.stream_connected = False
+            self._stop.wait(backoff.next())
+
+    def cleanup(self):
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+
+    def add_trigger(self, trigger):
+        pass
+
+    def update_trigger(self, trigger):
+        pass
+
+    def remove_trigger(self, trigger):
+        pass
+
+    def _follow_stream(self) -> None:
+        """Apply execution events until the stream fails or the sensor stops.
+
+        The stream is read in another thread, so that the running executions can
+        be re-synced right away, again after STREAM_SETTLE_SECONDS (covering
+        anything missed while the stream connected), and then every REFRESH_SECONDS.
+        Events queued meanwhile are applied in order on top of each query.
+        The connection is closed, and its thread stopped, however this returns.
+        """
+        connection = StreamConnection(self._client, self._logger)
+        connection.start()
+        try:
+            self._resync_executions(connected=False)
+            next_resync = time.monotonic() + STREAM_SETTLE_SECONDS
+            while not self._stop.is_set():
+                if time.monotonic() >= next_resync:
+                    self._resync_executions(connected=True)
+                    next_resync = time.monotonic() + REFRESH_SECONDS
+                # wake up at least every STOP_CHECK_SECONDS to notice a stop
+                timeout = min(next_resync - time.monotonic(), STOP_CHECK_SECONDS)
+                try:
+                    item = connection.events.get(timeout=max(0.0, timeout))
+                except queue.Empty:
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                with self._lock:
+                    self._index.apply_execution(item)
+        finally:
+            connection.close()
+
+    def _resync_executions(self, connected: bool) -> None:
+        executions = [
+            execution.serialize()
+            for execution in iter_executions(
+                self._client,
+                status=RUNNING_STATUS,
+                include_attributes=",".join(EXECUTION_ATTRIBUTES),
+            )
+        ]
+        with self._lock:
+            self._index.resync_executions(executions)
+            self._index.stream_connected = connected
+
+    def _write_loop(self) -> None:
+        while not self._stop.wait(WRITE_INTERVAL):
+            try:
+                with self._lock:
+                    self._index.write(self._path)
+            except OSError as exc:
+                self._logger.warning(f"Could not write {self._path}: {exc}")
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the actions import the shared code as lib.*, the same way st2 runs them
+PACK_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PACK_PATH, "actions"))
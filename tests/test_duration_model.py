@@ -0,0 +1,60 @@
+import logging
+import time
+
+from types import SimpleNamespace
+
+from lib.duration_model import DurationModel
+from lib.execution_query import format_timestamp, parse_timestamp
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Executions:
+    """executions.query of st2client over a list, filtering on the start like st2api."""
+
+    def __init__(self):
+        self.executions = []
+
+    def add(self, execution_id, start, seconds):
+        self.executions.append(
+            SimpleNamespace(
+                id=execution_id,
+                start_timestamp=format_timestamp(start),
+                end_timestamp=format_timestamp(start + seconds),
+            )
+        )
+
+    def query(self, timestamp_gt=None, limit=None, **filters):
+        after = parse_timestamp(timestamp_gt) if timestamp_gt else None
+        executions = [
+            execution
+            for execution in self.executions
+            if after is None or parse_timestamp(execution.start_timestamp) > after
+        ]
+        executions.sort(key=lambda execution: execution.start_timestamp, reverse=True)
+        return executions[:limit]
+
+
+def run_times(model):
+    return sorted(sample[1] for sample in model._samples("deployed.action"))
+
+
+def test_refresh_finds_runs_longer_than_any_seen_before(tmp_path):
+    executions = Executions()
+    now = time.time()
+    for i in range(3):
+        executions.add(f"short{i}", now - 100 + i, 10)
+    model = DurationModel(
+        SimpleNamespace(executions=executions),
+        LOGGER,
+        cache_dir=tmp_path,
+        refresh_seconds=0,
+        horizon_seconds=600,
+    )
+    assert run_times(model) == [10, 10, 10]
+
+    # started long before the last check, and only finished now
+    executions.add("long", now - 500, 500)
+    # too long for the horizon
+    executions.add("longest", now - 1000, 1000)
+    assert run_times(model) == [10, 10, 10, 500]
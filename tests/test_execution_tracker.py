@@ -0,0 +1,261 @@
+import http.server
+import json
+import logging
+import queue
+import threading
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+from lib.execution_tracker import (
+    EXECUTION_UPDATE_EVENT,
+    STREAM_RECONNECTS,
+    Backoff,
+    PollingExecutionTracker,
+    StreamExecutionTracker,
+)
+
+LOGGER = logging.getLogger(__name__)
+# long enough for a slow test machine, short enough to notice a hang
+TIMEOUT = 5.0
+
+
+class FakeStream(http.server.ThreadingHTTPServer):
+    """A local stand-in for the /stream endpoint of st2stream.
+
+    Every connection sends the messages put in messages, and ends on None.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, status=200):
+        super().__init__(("127.0.0.1", 0), StreamHandler)
+        self.status = status
+        self.messages: "queue.Queue" = queue.Queue()
+        self.connections = 0
+        self.connected = threading.Event()
+        self.stopping = threading.Event()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def endpoint(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def send(self, execution_id, status, pack="deployed"):
+        self.messages.put(
+            {
+                "id": execution_id,
+                "status": status,
+                "action": {"pack": pack, "ref": pack + ".action"},
+            }
+        )
+
+    def stop(self):
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
+
+
+class StreamHandler(http.server.BaseHTTPRequestHandler):
+    # like st2stream, which sends each event in its own chunk
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.connections += 1
+        if server.status != 200:
+            self.send_error(server.status)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.flush()
+        server.connected.set()
+        self.close_connection = True
+        while not server.stopping.is_set():
+            try:
+                message = server.messages.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if message is None:
+                break
+            body = "event: {}\ndata: {}\n\n".format(
+                EXECUTION_UPDATE_EVENT, json.dumps(message)
+            ).encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(body), body))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stream_libraries():
+    # StreamConnection reads the stream with the libraries that come with st2client
+    pytest.importorskip("requests")
+    pytest.importorskip("sseclient")
+
+
+@pytest.fixture
+def stream(stream_libraries):
+    server = FakeStream()
+    yield server
+    server.stop()
+
+
+def make_client(endpoint):
+    return SimpleNamespace(
+        managers={
+            "Stream": SimpleNamespace(endpoint=endpoint, cacert=None, basic_auth=None)
+        },
+        executions=SimpleNamespace(
+            resource=SimpleNamespace(
+                deserialize=lambda payload: SimpleNamespace(**payload)
+            )
+        ),
+    )
+
+
+def execution(execution_id, status="running", pack="deployed"):
+    return SimpleNamespace(
+        id=execution_id,
+        status=status,
+        action={"pack": pack, "ref": pack + ".action"},
+    )
+
+
+class Query:
+    def __init__(self, *executions):
+        self.executions = list(executions)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return list(self.executions)
+
+
+def make_tracker(endpoint, query, resync_seconds=60.0):
+    return StreamExecutionTracker(
+        make_client(endpoint),
+        query=query,
+        is_relevant=lambda execution: execution.action["pack"] == "deployed",
+        logger=LOGGER,
+        resync_seconds=resync_seconds,
+    )
+
+
+def wait_for(tracker, condition):
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        running = tracker.snapshot()
+        if condition(running):
+            return running
+        tracker.wait(deadline - time.monotonic())
+    pytest.fail("the tracker did not get there in time")
+
+
+def ids(executions):
+    return sorted(execution.id for execution in executions)
+
+
+def test_stream_tracks_running_executions(stream):
+    query = Query(execution("a"), execution("b"))
+    tracker = make_tracker(stream.endpoint, query)
+    try:
+        assert ids(tracker.snapshot()) == ["a", "b"]
+        assert stream.connected.wait(TIMEOUT)
+
+        stream.send("c", "running")
+        stream.send("x", "running", pack="other")
+        stream.send("a", "succeeded")
+        assert ids(wait_for(tracker, lambda running: "a" not in ids(running))) == [
+            "b",
+            "c",
+        ]
+
+        stream.send("b", "paused")
+        stream.send("c", "failed")
+        assert wait_for(tracker, lambda running: not running) == []
+        # everything after the first snapshot came from the stream
+        assert query.calls == 1
+        assert tracker._fallback is None
+    finally:
+        tracker.close()
+
+
+def test_stream_reconnects_and_resyncs_after_it_drops(stream):
+    query = Query(execution("a"))
+    tracker = make_tracker(stream.endpoint, query)
+    try:
+        assert ids(tracker.snapshot()) == ["a"]
+        assert stream.connected.wait(TIMEOUT)
+
+        # a finishes while the stream is down, so only a resync can notice
+        query.executions = []
+        stream.messages.put(None)
+        assert wait_for(tracker, lambda running: not running) == []
+        stream.send("b", "running")
+        assert ids(wait_for(tracker, lambda running: running)) == ["b"]
+        assert stream.connections == 2
+        assert query.calls == 2
+        assert tracker._fallback is None
+    finally:
+        tracker.close()
+
+
+def test_stream_falls_back_to_polling_after_too_many_reconnects(stream):
+    query = Query(execution("a"))
+    tracker = make_tracker(stream.endpoint, query)
+    try:
+        for _ in range(STREAM_RECONNECTS + 1):
+            stream.messages.put(None)
+        wait_for(tracker, lambda running: tracker._fallback is not None)
+        assert stream.connections == STREAM_RECONNECTS + 1
+    finally:
+        tracker.close()
+
+
+def test_stream_falls_back_to_polling_when_unavailable(stream_libraries):
+    stream = FakeStream(status=503)
+    query = Query(execution("a"))
+    tracker = make_tracker(stream.endpoint, query)
+    try:
+        wait_for(tracker, lambda running: tracker._fallback is not None)
+        assert stream.connections == 1
+        assert isinstance(tracker._fallback, PollingExecutionTracker)
+
+        query.executions = []
+        assert tracker.snapshot() == []
+    finally:
+        tracker.close()
+        stream.stop()
+
+
+def test_close_unblocks_a_read(stream):
+    tracker = make_tracker(stream.endpoint, Query())
+    assert stream.connected.wait(TIMEOUT)
+    connection = tracker._connection
+    # the listener thread is now blocked reading a stream that sends nothing
+    started = time.monotonic()
+    tracker.close()
+    assert time.monotonic() - started < 1.0
+    assert not connection._thread.is_alive()
+    assert connection.events.empty()
+
+
+def test_polling_backs_off_until_the_executions_change():
+    query = Query(execution("a"))
+    tracker = PollingExecutionTracker(query, Backoff(minimum=1, maximum=4))
+    tracker.snapshot()
+    assert [tracker.backoff.next() for _ in range(4)] == [1, 2, 4, 4]
+
+    tracker.snapshot()
+    assert tracker.backoff.next() == 4
+    query.executions = []
+    tracker.snapshot()
+    assert tracker.backoff.next() == 1
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from lib.git import GitError, git
+from lib.git_mirror import CACHED, CLONED, FETCHED, GitMirror
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Remote:
+    """A bare repo served over file://, with a work tree to commit from."""
+
+    def __init__(self, path):
+        self.bare = path / "remote.git"
+        self.work = path / "work"
+        git("init", "--quiet", "--bare", str(self.bare))
+        git("init", "--quiet", str(self.work))
+        self.git("checkout", "--quiet", "-b", "main")
+        self.git("remote", "add", "origin", str(self.bare))
+
+    @property
+    def url(self):
+        return self.bare.as_uri()
+
+    def git(self, *args):
+        return git(*args, cwd=str(self.work))
+
+    def commit(self, content):
+        (self.work / "pack.yaml").write_text(content)
+        self.git("add", "pack.yaml")
+        self.git(
+            "-c",
+            "user.name=st2gitops",
+            "-c",
+            "user.email=st2gitops@example.com",
+            "commit",
+            "--quiet",
+            "-m",
+            content,
+        )
+        self.git("push", "--quiet", "origin", "main")
+        return self.git("rev-parse", "HEAD")
+
+
+def has_commit(path, commit):
+    return git("cat-file", "-t", commit, cwd=str(path)) == "commit"
+
+
+@pytest.fixture
+def remote(tmp_path):
+    return Remote(tmp_path)
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    return GitMirror(LOGGER, cache_dir)
+
+
+def test_clone_then_fetch_then_cached(remote, mirror, tmp_path):
+    first = remote.commit("version: 1.0.0")
+    assert mirror.clone(remote.url, "main", tmp_path / "one") == CLONED
+    assert git("rev-parse", "origin/main", cwd=str(tmp_path / "one")) == first
+    assert git("remote", "get-url", "origin", cwd=str(tmp_path / "one")) == remote.url
+
+    second = remote.commit("version: 1.1.0")
+    assert mirror.clone(remote.url, "main", tmp_path / "two") == FETCHED
+    assert git("rev-parse", "origin/main", cwd=str(tmp_path / "two")) == second
+
+    assert mirror.clone(remote.url, first, tmp_path / "three") == CACHED
+    assert has_commit(tmp_path / "three", first)
+
+
+def test_revert_to_a_mirrored_commit_works_offline(remote, mirror, tmp_path):
+    old = remote.commit("version: 1.0.0")
+    remote.commit("version: 1.1.0")
+    assert mirror.clone(remote.url, "main", tmp_path / "deployed") == CLONED
+
+    remote.bare.rename(tmp_path / "gone.git")
+    assert mirror.clone(remote.url, old, tmp_path / "reverted") == CACHED
+    assert has_commit(tmp_path / "reverted", old)
+    # branches can move, so they still need the remote
+    with pytest.raises(GitError):
+        mirror.clone(remote.url, "main", tmp_path / "branch")
+
+
+def test_concurrent_clones_of_a_repo_take_turns(remote, mirror, tmp_path, monkeypatch):
+    commit = remote.commit("version: 1.0.0")
+    update = GitMirror.update
+    active = []
+    overlapped = threading.Event()
+
+    def slow_update(self, *args):
+        active.append(None)
+        if len(active) > 1:
+            overlapped.set()
+        # give the other clone time to get past the lock if it could
+        time.sleep(0.2)
+        try:
+            return update(self, *args)
+        finally:
+            active.pop()
+
+    monkeypatch.setattr(GitMirror, "update", slow_update)
+    barrier = threading.Barrier(2)
+    statuses = {}
+
+    def clone(name):
+        barrier.wait()
+        statuses[name] = mirror.clone(remote.url, "main", tmp_path / name)
+
+    threads = [threading.Thread(target=clone, args=(name,)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not overlapped.is_set()
+    assert sorted(statuses.values()) == [CLONED, FETCHED]
+    for name in ("a", "b"):
+        assert git("rev-parse", "origin/main", cwd=str(tmp_path / name)) == commit
@@ -0,0 +1,114 @@
+import errno
+import logging
+import os
+
+import pytest
+
+from lib import venv_cache
+from lib.venv_cache import VirtualenvCache
+
+LOGGER = logging.getLogger(__name__)
+
+
+def make_key(requirements, wheelhouse=None):
+    return VirtualenvCache.key(
+        "deployed", "3.8.10", ["--no-download"], requirements, wheelhouse=wheelhouse
+    )
+
+
+def make_virtualenv(path, size=100):
+    (path / "bin").mkdir(parents=True)
+    (path / "bin" / "python").write_bytes(b"#" * size)
+    os.symlink("python", str(path / "bin" / "python3"))
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    return VirtualenvCache(LOGGER, cache_dir=cache_dir, max_bytes=1024 * 1024)
+
+
+def test_cache_is_disabled_by_default(tmp_path):
+    assert not VirtualenvCache.from_config({}, LOGGER).enabled
+    assert not VirtualenvCache.from_config(None, LOGGER).enabled
+
+    cache = VirtualenvCache.from_config(
+        {"cache_dir": str(tmp_path), "virtualenv_cache_size_mb": 1}, LOGGER
+    )
+    assert cache.cache_dir == tmp_path / "virtualenvs"
+    assert cache.max_bytes == 1024 * 1024
+
+
+def test_key_covers_included_requirement_files(tmp_path):
+    requirements = tmp_path / "requirements.txt"
+    requirements.write_text("-r base.txt\n--constraint=constraints/pins.txt\n")
+    (tmp_path / "base.txt").write_text("requests\n")
+    (tmp_path / "constraints").mkdir()
+    (tmp_path / "constraints" / "pins.txt").write_text("requests==2.25.1\n")
+
+    key = make_key(requirements)
+    assert make_key(requirements) == key
+
+    (tmp_path / "base.txt").write_text("requests\nsix\n")
+    included_key = make_key(requirements)
+    assert included_key != key
+
+    (tmp_path / "constraints" / "pins.txt").write_text("requests==2.26.0\n")
+    assert make_key(requirements) not in (key, included_key)
+
+
+def test_key_covers_the_wheelhouse_contents(tmp_path):
+    requirements = tmp_path / "requirements.txt"
+    requirements.write_text("requests\n")
+    wheelhouse = tmp_path / "wheelhouse"
+    wheelhouse.mkdir()
+
+    key = make_key(requirements, str(wheelhouse))
+    assert key != make_key(requirements)
+
+    (wheelhouse / "requests-2.26.0-py2.py3-none-any.whl").write_bytes(b"")
+    assert make_key(requirements, str(wheelhouse)) != key
+
+
+def test_restore_hardlinks_the_cached_virtualenv(cache, tmp_path):
+    built = make_virtualenv(tmp_path / "built")
+    cache.save("key", built)
+
+    restored = tmp_path / "restored"
+    assert cache.restore("key", restored)
+    cached = cache.cache_dir / "key" / "bin" / "python"
+    assert os.path.samefile(str(restored / "bin" / "python"), str(cached))
+    assert os.readlink(str(restored / "bin" / "python3")) == "python"
+    assert not cache.restore("other", tmp_path / "missed")
+    assert not (tmp_path / "missed").exists()
+
+
+def test_restore_copies_across_filesystems(cache, tmp_path, monkeypatch):
+    built = make_virtualenv(tmp_path / "built")
+    cache.save("key", built)
+
+    def link(source, destination, **kwargs):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    monkeypatch.setattr(venv_cache.os, "link", link)
+    restored = tmp_path / "restored"
+    assert cache.restore("key", restored)
+    cached = cache.cache_dir / "key" / "bin" / "python"
+    assert not os.path.samefile(str(restored / "bin" / "python"), str(cached))
+    assert (restored / "bin" / "python").read_bytes() == cached.read_bytes()
+    assert os.readlink(str(restored / "bin" / "python3")) == "python"
+
+
+def test_evicts_the_least_recently_used_entries_over_the_cap(cache, tmp_path):
+    cache.max_bytes = 250
+    for key in ("a", "b"):
+        cache.save(key, make_virtualenv(tmp_path / key))
+    os.utime(str(cache.cache_dir / "a"), (1000, 1000))
+    os.utime(str(cache.cache_dir / "b"), (2000, 2000))
+    # using a makes b the least recently used
+    assert cache.restore("a", tmp_path / "restored")
+
+    cache.save("c", make_virtualenv(tmp_path / "c"))
+    assert sorted(entry.name for entry in cache.cache_dir.iterdir()) == ["a", "c"]